@@ -6,8 +6,11 @@ import asyncio
 from sandbox import Sandbox, SandboxSettings
 
 async def main():
-    # 创建沙箱实例
-    sandbox = Sandbox()
+    # 创建沙箱实例（最多同时执行 5 个任务）
+    sandbox = Sandbox(SandboxSettings(
+        allowed_modules=['math', 'random', 'json', 'time'],
+        max_concurrency=5
+    ))
     
     # 异步执行代码
     result = await sandbox.execute_async("""
@@ -33,7 +36,8 @@ __result__ = {i}
     settings = SandboxSettings(
         max_memory_mb=100,
         max_cpu_percent=50,
-        max_execution_time=2
+        max_execution_time=2,
+        allowed_modules=['time']
     )
     
     custom_sandbox = Sandbox(settings)
@@ -2,14 +2,34 @@
 沙箱包初始化
 """
 
-from sandbox.core.sandbox import Sandbox
-from sandbox.exceptions import SandboxError, ResourceLimitExceeded, SecurityError
-from sandbox.config.settings import SandboxSettings, DEFAULT_SETTINGS
+import importlib
+
+# 公开名称按需从所在模块导入，只导入子模块（如容器内的执行器）时不加载 psutil 等依赖
+_EXPORTS = {
+    'Sandbox': 'sandbox.core.sandbox',
+    'SandboxSession': 'sandbox.core.session',
+    'SandboxError': 'sandbox.exceptions',
+    'ResourceLimitExceeded': 'sandbox.exceptions',
+    'SecurityError': 'sandbox.exceptions',
+    'SessionClosed': 'sandbox.exceptions',
+    'SandboxSettings': 'sandbox.config.settings',
+    'DEFAULT_SETTINGS': 'sandbox.config.settings'
+}
 
 __all__ = [
     'Sandbox',
+    'SandboxSession',
     'SandboxError',
     'ResourceLimitExceeded',
+    'SessionClosed',
     'SandboxSettings',
     'DEFAULT_SETTINGS'
-] 
\ No newline at end of file
+]
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
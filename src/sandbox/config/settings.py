@@ -17,6 +17,27 @@ class SandboxSettings:
     allow_imports: bool = True  # 是否允许导入模块
     allowed_modules: List[str] = field(default_factory=lambda: ['math', 'random', 'json'])  # 允许导入的模块
     check_interval: float = 0.1  # 资源检查间隔（秒）
+    execution_mode: str = "inline"  # 执行模式：inline（当前进程）/ pool（预启动工作进程池）/ zygote（预加载模块后 fork）/ isolated（fork 后隔离）
+    isolation_tmpfs_mb: int = 64  # isolated 模式下私有 /tmp 的大小（MB）
+    pool_size: int = 4  # 工作进程池大小（pool 模式）
+    code_cache_size: int = 128  # 编译代码缓存容量，0 表示禁用
+    max_concurrency: int = 8  # 异步执行的最大并发数
+    enforcement: str = "monitor"  # 工作进程的限制方式：monitor（采样监控）/ rlimit / cgroup
+    cgroup_root: str = "/sys/fs/cgroup/sandbox"  # cgroup 模式使用的 cgroup v2 目录
+    docker_endpoints: List[str] = field(default_factory=list)  # Docker 守护进程地址，为空时使用本机（环境变量）配置
+    docker_pool_size: int = 0  # DockerSandbox 预启动的常驻容器数，0 表示每次执行启动新容器
+    docker_recycle_after: int = 100  # 常驻容器执行多少次后替换
+    docker_health_interval: float = 30.0  # 空闲容器健康检查间隔（秒）
+    docker_stats: bool = True  # 读取 Docker stats 流，记录容器的资源时间序列和峰值
+    docker_max_queued: int = 0  # DockerSandbox 异步执行排队等待的最大任务数，0 表示不限
+    stream_buffer_size: int = 64  # execute_stream 输出缓冲区的块数，满时代码暂停等待读取
+    session_idle_timeout: float = 1800.0  # 会话空闲超时（秒），超时后回收命名空间，0 表示不回收
+    async_logging: bool = False  # 安全日志只入队，由后台线程批量写入
+    log_queue_size: int = 10000  # 异步日志队列最多容纳的记录数，满时按丢弃策略处理
+    audit_log: bool = False  # 同时写入结构化 JSONL 审计日志（logs/audit），支持按执行ID 和时间查询
+    audit_max_mb: int = 64  # 审计日志分段达到该大小（MB）后轮转并压缩
+    audit_max_age: float = 3600.0  # 审计日志分段打开超过该时长（秒）后轮转并压缩
+    memory_accounting: str = "process"  # inline 模式的内存计量：process（进程 RSS 相对执行开始时的增量，与其他执行重叠时改按执行归属）/ tracemalloc（按执行归属）
 
 # 默认配置
 DEFAULT_SETTINGS = SandboxSettings() 
\ No newline at end of file
@@ -2,6 +2,20 @@
 沙箱核心模块初始化
 """
 
-from sandbox.core.sandbox import Sandbox
+import importlib
 
-__all__ = ['Sandbox'] 
\ No newline at end of file
+# 按需导入，见 sandbox/__init__.py
+_EXPORTS = {
+    'Sandbox': 'sandbox.core.sandbox',
+    'SandboxSession': 'sandbox.core.session'
+}
+
+__all__ = ['Sandbox', 'SandboxSession']
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
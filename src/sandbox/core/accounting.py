@@ -0,0 +1,330 @@
+"""
+资源计量模块
+为每次执行单独统计墙钟时间、CPU 时间和内存峰值，并记录执行中实际导入的模块
+"""
+
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from types import CodeType
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, Optional, Set, Tuple
+
+import psutil
+
+# 内存计量方式（当前进程内执行时）
+MEMORY_PROCESS = "process"  # 宿主进程 RSS 相对执行开始时的增量
+MEMORY_TRACEMALLOC = "tracemalloc"  # 按执行归属的 Python 内存分配
+
+# tracemalloc 记录的调用栈深度，需要足够深才能追溯到沙箱代码帧
+TRACEMALLOC_FRAMES = 25
+
+# 计算 CPU 使用率的最短窗口（秒），窗口内的采样只检查内存。/proc 中的 CPU 时间以
+# 时钟滴答（通常 10ms）为单位，窗口过短时使用率会严重失真
+MIN_CPU_WINDOW = 0.05
+
+_MB = 1024 * 1024
+
+
+@dataclass
+class ResourceUsage:
+    """单次执行的资源使用情况"""
+    wall_time: float = 0.0  # 墙钟时间（秒）
+    cpu_time: float = 0.0  # CPU 时间（秒）
+    peak_memory_mb: float = 0.0  # 归属于本次执行的内存峰值（MB）
+    peak_cpu_percent: float = 0.0  # CPU 使用率峰值（%），Docker 执行时由容器统计得到
+
+
+@dataclass
+class ExecutionResult:
+    """单次执行的结果"""
+    execution_id: str
+    value: Any = None  # 代码中 __result__ 的值
+    usage: ResourceUsage = field(default_factory=ResourceUsage)
+    imported_modules: FrozenSet[str] = frozenset()  # 执行中经沙箱成功导入的模块
+    isolation: Optional[Dict[str, Any]] = None  # isolated 模式下各隔离步骤是否生效（见 isolate）
+
+
+# 当前执行中导入的模块，由 track_imports 设置
+_imported_modules: ContextVar[Optional[Set[str]]] = ContextVar("sandbox_imported_modules", default=None)
+
+
+@contextmanager
+def track_imports() -> Iterator[Set[str]]:
+    """在上下文内收集经沙箱导入的模块名
+
+    Yields:
+        Set[str]: 上下文结束前持续更新的模块名集合
+    """
+    modules: Set[str] = set()
+    reset_token = _imported_modules.set(modules)
+    try:
+        yield modules
+    finally:
+        _imported_modules.reset(reset_token)
+
+
+def record_imports(names: Iterable[str]) -> None:
+    """把导入的模块名记入当前执行，工作进程和容器回传的模块名也经此记录
+
+    Args:
+        names: 模块名，from 导入记为 包名.名称
+    """
+    modules = _imported_modules.get()
+    if modules is not None:
+        modules.update(names)
+
+
+def execution_filename(execution_id: str) -> str:
+    """tracemalloc 计量时本次执行代码对象使用的文件名"""
+    return f"<sandbox-{execution_id}>"
+
+
+def relabel(code: CodeType, filename: str) -> CodeType:
+    """递归替换代码对象（含嵌套函数、类）的文件名
+
+    编译缓存中的代码对象由所有执行共享，替换文件名后 tracemalloc 才能把分配归属到具体执行。
+    """
+    consts = tuple(relabel(const, filename) if isinstance(const, CodeType) else const
+                   for const in code.co_consts)
+    return code.replace(co_filename=filename, co_consts=consts)
+
+
+# 正在使用 tracemalloc 计量的执行数，以及 tracemalloc 是否由这里启动
+_tracing_users = 0
+_tracing_started = False
+_tracing_lock = threading.Lock()
+
+
+def ensure_tracemalloc() -> None:
+    """按需启动 tracemalloc，每次调用须对应一次 release_tracemalloc"""
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _tracing_started = True
+
+
+def release_tracemalloc() -> None:
+    """最后一个使用 tracemalloc 的执行结束时停止 tracemalloc（由其他代码启动的除外）"""
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users = max(_tracing_users - 1, 0)
+        if _tracing_users == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+
+# 当前进程内正在执行的代码数，以及按进程 RSS 计量内存的采样器
+_inline_count = 0
+_process_samplers: Set["ThreadSampler"] = set()
+_inline_lock = threading.Lock()
+
+
+@contextmanager
+def inline_execution(memory_mode: str) -> Iterator[str]:
+    """登记一次在当前进程内执行的代码，产出本次执行实际使用的内存计量方式
+
+    进程 RSS 无法区分并发执行各自的增长：已有其他执行时 process 模式改用 tracemalloc
+    按执行归属内存；之前开始的 process 模式执行从此不再按 RSS 计量（见 ThreadSampler）。
+
+    Args:
+        memory_mode: 配置的内存计量方式
+
+    Yields:
+        str: 实际使用的内存计量方式
+    """
+    global _inline_count
+    with _inline_lock:
+        if memory_mode == MEMORY_PROCESS and _inline_count:
+            memory_mode = MEMORY_TRACEMALLOC
+        _inline_count += 1
+        for sampler in _process_samplers:
+            sampler.overlapped = True
+    try:
+        yield memory_mode
+    finally:
+        with _inline_lock:
+            _inline_count -= 1
+
+
+def max_rss_mb() -> float:
+    """当前进程生命周期内的最大 RSS（MB）"""
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _thread_cpu_clock(thread_id: int) -> Optional[int]:
+    """获取线程 CPU 时钟，平台不支持时返回 None"""
+    try:
+        return time.pthread_getcpuclockid(thread_id)
+    except (AttributeError, OSError):
+        return None
+
+
+class ThreadSampler:
+    """当前进程内某个执行线程的资源采样器
+
+    process 模式下一旦有其他执行与本次执行重叠（overlapped），进程 RSS 和最大 RSS 中混入了
+    其他执行的增长，此后不再更新内存用量，内存峰值只反映独自执行期间的用量。
+    """
+
+    def __init__(self, thread_id: int, memory_mode: str = MEMORY_PROCESS, label: Optional[str] = None):
+        """
+        Args:
+            thread_id: 执行线程的 threading.get_ident()
+            memory_mode: 内存计量方式
+            label: tracemalloc 模式下本次执行代码对象的文件名
+        """
+        self.memory_mode = memory_mode
+        self.label = label
+        self.peak_memory_mb = 0.0
+        self._clock = _thread_cpu_clock(thread_id)
+        self._process = psutil.Process()
+        # process 模式以执行开始时的 RSS 为基线，只计入执行期间的增长；
+        # 进程最大 RSS 在执行期间被刷新时，刷新后的值同样计入，两次采样之间的短暂峰值也能发现
+        self.baseline_mb = 0.0
+        self._start_max_rss_mb = 0.0
+        self.overlapped = False
+        if not (memory_mode == MEMORY_TRACEMALLOC and label):
+            self.baseline_mb = self._process.memory_info().rss / _MB
+            self._start_max_rss_mb = max_rss_mb()
+            with _inline_lock:
+                _process_samplers.add(self)
+                self.overlapped = _inline_count > 1
+        self._last_wall = time.monotonic()
+        self._last_cpu = self._cpu_time()
+        if self._clock is None:
+            self._process.cpu_percent()
+
+    def _cpu_time(self) -> float:
+        if self._clock is None:
+            return 0.0
+        try:
+            return time.clock_gettime(self._clock)
+        except OSError:
+            return self._last_cpu
+
+    def _memory_mb(self, batch: Dict[Any, Any]) -> float:
+        if self.memory_mode == MEMORY_TRACEMALLOC and self.label:
+            if 'tracemalloc' not in batch:
+                try:
+                    snapshot = tracemalloc.take_snapshot()
+                except RuntimeError:
+                    # 最后一个计量中的执行刚结束，tracemalloc 已停止
+                    batch['tracemalloc'] = {}
+                else:
+                    batch['tracemalloc'] = {
+                        stat.traceback[0].filename: stat.size
+                        for stat in snapshot.statistics('filename', cumulative=True)
+                    }
+            return batch['tracemalloc'].get(self.label, 0) / _MB
+        if self.overlapped:
+            return self.peak_memory_mb
+        key = ('rss', self._process.pid)
+        if key not in batch:
+            batch[key] = (self._process.memory_info().rss / _MB, max_rss_mb())
+        rss, max_rss = batch[key]
+        memory_mb = rss - self.baseline_mb
+        if max_rss > self._start_max_rss_mb:
+            memory_mb = max(memory_mb, max_rss - self.baseline_mb)
+        return max(memory_mb, 0.0)
+
+    def close(self) -> None:
+        """执行结束，不再参与重叠判断"""
+        with _inline_lock:
+            _process_samplers.discard(self)
+
+    def sample(self, batch: Dict[Any, Any]) -> Tuple[float, float]:
+        """采样一次
+
+        Args:
+            batch: 同一批次共享的缓存（进程 RSS、tracemalloc 快照等只取一次）
+
+        Returns:
+            Tuple[float, float]: (内存MB, CPU使用率%)
+        """
+        memory_mb = self._memory_mb(batch)
+        self.peak_memory_mb = max(self.peak_memory_mb, memory_mb)
+
+        if self._clock is None:
+            return memory_mb, self._process.cpu_percent()
+
+        now = time.monotonic()
+        elapsed = now - self._last_wall
+        if elapsed < MIN_CPU_WINDOW:
+            return memory_mb, 0.0
+        cpu = self._cpu_time()
+        cpu_percent = (cpu - self._last_cpu) / elapsed * 100
+        self._last_wall, self._last_cpu = now, cpu
+        return memory_mb, cpu_percent
+
+
+class ProcessSampler:
+    """工作进程 / 子进程的资源采样器"""
+
+    def __init__(self, pid: int):
+        """
+        Args:
+            pid: 进程 PID，登记时的 RSS 作为内存基线
+        """
+        self._process = psutil.Process(pid)
+        self.baseline_mb = self._process.memory_info().rss / _MB
+        self.peak_memory_mb = 0.0
+        self._last_wall = time.monotonic()
+        self._last_cpu = self._cpu_time()
+
+    def _cpu_time(self) -> float:
+        times = self._process.cpu_times()
+        return times.user + times.system
+
+    def sample(self, batch: Dict[Any, Any]) -> Tuple[float, float]:
+        """采样一次
+
+        Args:
+            batch: 同一批次共享的缓存
+
+        Returns:
+            Tuple[float, float]: (相对基线的内存增量MB, CPU使用率%)
+        """
+        memory_mb = self._process.memory_info().rss / _MB - self.baseline_mb
+        self.peak_memory_mb = max(self.peak_memory_mb, memory_mb)
+        now = time.monotonic()
+        elapsed = now - self._last_wall
+        if elapsed < MIN_CPU_WINDOW:
+            return memory_mb, 0.0
+        cpu = self._cpu_time()
+        cpu_percent = (cpu - self._last_cpu) / elapsed * 100
+        self._last_wall, self._last_cpu = now, cpu
+        return memory_mb, cpu_percent
+
+
+class WorkerMeter:
+    """在工作进程内计量单个任务的 CPU 时间和内存峰值"""
+
+    def __init__(self):
+        self._cpu = time.process_time()
+        self._rss_mb = psutil.Process().memory_info().rss / _MB
+        self._max_rss_mb = max_rss_mb()
+
+    def finish(self) -> Dict[str, float]:
+        """结束计量
+
+        内存峰值取自 ru_maxrss：任务刷新了进程生命周期内的最大 RSS 时即为任务峰值，
+        否则退化为任务结束时的 RSS 增量。
+
+        Returns:
+            Dict[str, float]: cpu_time 和 peak_memory_mb
+        """
+        max_rss = max_rss_mb()
+        if max_rss > self._max_rss_mb:
+            peak = max_rss - self._rss_mb
+        else:
+            peak = psutil.Process().memory_info().rss / _MB - self._rss_mb
+        return {
+            'cpu_time': time.process_time() - self._cpu,
+            'peak_memory_mb': max(peak, 0.0)
+        }
@@ -0,0 +1,139 @@
+"""
+批量执行模块
+把大量相互独立的代码片段分发到多个工作进程执行，逐项隔离失败并统计吞吐量
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, List, Optional
+
+from sandbox.core.accounting import ResourceUsage
+from sandbox.exceptions import SandboxError
+
+
+@dataclass
+class ItemResult:
+    """批量执行中单个代码片段的结果"""
+    index: int  # 在输入中的位置
+    value: Any = None  # 代码中 __result__ 的值
+    error: Optional[SandboxError] = None  # 执行失败时的异常
+    execution_id: Optional[str] = None
+    usage: ResourceUsage = field(default_factory=ResourceUsage)
+
+    @property
+    def ok(self) -> bool:
+        """是否执行成功"""
+        return self.error is None
+
+
+@dataclass
+class BatchStats:
+    """批量执行的汇总统计"""
+    total: int = 0
+    completed: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    wall_time: float = 0.0  # 从提交到最后一项完成的时间（秒）
+    cpu_time: float = 0.0  # 各项 CPU 时间之和（秒）
+
+    @property
+    def throughput(self) -> float:
+        """每秒完成的执行数"""
+        return self.completed / self.wall_time if self.wall_time > 0 else 0.0
+
+
+class BatchExecution:
+    """进行中的批量执行
+
+    创建时即开始执行。迭代时按输入顺序（ordered=True）或完成顺序返回 ItemResult，
+    单项失败记录在结果的 error 中，不影响其他项。
+    """
+
+    def __init__(self, sandbox, codes: Iterable[str], ordered: bool = True, max_workers: int = 1,
+                 pool=None):
+        """
+        Args:
+            sandbox: 执行代码的 Sandbox
+            codes: 代码片段
+            ordered: 是否按输入顺序返回结果
+            max_workers: 同时执行的数量
+            pool: 本次批量执行专用的工作进程池，全部片段结束（或被取消）后关闭
+        """
+        self.ordered = ordered
+        self.stats = BatchStats()
+        self._sandbox = sandbox
+        self._pool = pool
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sandbox-batch")
+        self._futures: List[Future] = [
+            self._executor.submit(self._run_item, index, code) for index, code in enumerate(codes)
+        ]
+        self.stats.total = len(self._futures)
+        self._executor.shutdown(wait=False)
+        self._pending = len(self._futures)
+        if self._pending == 0:
+            self._release_pool()
+        for future in self._futures:
+            future.add_done_callback(self._item_done)
+
+    def _item_done(self, future: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+            last = self._pending == 0
+        if last:
+            self._release_pool()
+
+    def _release_pool(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _run_item(self, index: int, code: str) -> ItemResult:
+        try:
+            result = self._sandbox._execute(code)
+            item = ItemResult(index, result.value, execution_id=result.execution_id, usage=result.usage)
+        except SandboxError as e:
+            item = ItemResult(index, error=e)
+        except Exception as e:
+            item = ItemResult(index, error=SandboxError(f"代码执行出错: {str(e)}"))
+
+        with self._lock:
+            self.stats.completed += 1
+            if item.ok:
+                self.stats.succeeded += 1
+            else:
+                self.stats.failed += 1
+            self.stats.cpu_time += item.usage.cpu_time
+            self.stats.wall_time = time.monotonic() - self._start
+        return item
+
+    def __iter__(self) -> Iterator[ItemResult]:
+        futures = self._futures if self.ordered else as_completed(self._futures)
+        for future in futures:
+            yield future.result()
+
+    def __len__(self) -> int:
+        return self.stats.total
+
+    def results(self) -> List[ItemResult]:
+        """等待全部完成并按输入顺序返回结果
+
+        Returns:
+            List[ItemResult]: 每个代码片段的结果
+        """
+        return [future.result() for future in self._futures]
+
+    def cancel(self) -> int:
+        """取消尚未开始的执行，正在执行的项会继续完成
+
+        Returns:
+            int: 被取消的数量
+        """
+        cancelled = sum(1 for future in self._futures if future.cancel())
+        with self._lock:
+            self.stats.total -= cancelled
+        self._futures = [future for future in self._futures if not future.cancelled()]
+        return cancelled
@@ -0,0 +1,132 @@
+"""
+编译代码缓存模块
+按源码哈希缓存编译后的代码对象，避免重复解析和编译相同的代码片段
+"""
+
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+from types import CodeType
+from typing import Dict, Optional, Tuple
+
+# 沙箱代码对象使用的文件名
+SANDBOX_FILENAME = "<sandbox>"
+
+
+class CodeCache:
+    """有界 LRU 编译代码缓存"""
+
+    def __init__(self, maxsize: int = 128):
+        """初始化缓存
+
+        Args:
+            maxsize: 最多缓存的代码对象数量，0 表示禁用缓存
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str, int], CodeType]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(source: str, filename: str = SANDBOX_FILENAME) -> Tuple[str, str, int]:
+        """生成缓存键
+
+        编译结果只取决于源码、文件名和优化级别，沙箱的资源与权限设置在执行期生效，
+        因此不参与缓存键。
+
+        Args:
+            source: 源码
+            filename: 代码对象的文件名
+
+        Returns:
+            Tuple[str, str, int]: (源码SHA-256, 文件名, 优化级别)
+        """
+        digest = hashlib.sha256(source.encode('utf-8', 'surrogatepass')).hexdigest()
+        return digest, filename, sys.flags.optimize
+
+    def compile(self, source: str, maxsize: Optional[int] = None) -> CodeType:
+        """获取源码对应的代码对象，未命中时编译并缓存
+
+        Args:
+            source: 源码
+            maxsize: 调用方要求的缓存容量，为 None 时按当前容量；0 表示本次不使用缓存。
+                缓存在进程内共享，容量只按各调用方要求的最大值增长，不会被较小的要求缩小
+
+        Returns:
+            CodeType: 编译后的代码对象
+
+        Raises:
+            SyntaxError: 源码存在语法错误
+        """
+        if maxsize is not None and maxsize > self.maxsize:
+            self.resize(maxsize)
+
+        if self.maxsize <= 0 or (maxsize is not None and maxsize <= 0):
+            with self._lock:
+                self.misses += 1
+            return compile(source, SANDBOX_FILENAME, 'exec')
+
+        key = self.make_key(source)
+        with self._lock:
+            code = self._entries.get(key)
+            if code is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return code
+            self.misses += 1
+
+        code = compile(source, SANDBOX_FILENAME, 'exec')
+
+        with self._lock:
+            self._entries[key] = code
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return code
+
+    def resize(self, maxsize: int) -> None:
+        """调整缓存容量，超出部分按最近最少使用顺序淘汰
+
+        Args:
+            maxsize: 新的缓存容量
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > max(maxsize, 0):
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存和命中统计"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """获取缓存统计信息
+
+        Returns:
+            Dict[str, int]: 命中数、未命中数、当前条目数和容量
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize
+            }
+
+
+# 进程内共享的代码缓存
+_code_cache = CodeCache()
+
+
+def get_code_cache() -> CodeCache:
+    """获取进程内共享的编译代码缓存
+
+    Returns:
+        CodeCache: 共享缓存实例
+    """
+    return _code_cache
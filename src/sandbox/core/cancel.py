@@ -0,0 +1,201 @@
+"""
+执行取消模块
+提供跨线程取消正在运行的代码的令牌
+
+注入的异常只应在沙箱代码的帧中触发。沙箱自身的实现（受限导入、日志、输出回调）会获取锁，
+异常在持有锁时触发会使锁泄漏，这些调用需放在 cancel_shield() 中，期间的取消推迟到退出时生效。
+"""
+
+import ctypes
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+# 取消后重复注入异常的间隔（秒），直到执行线程离开 guard_thread
+REINJECT_INTERVAL = 0.1
+
+
+class ExecutionCancelled(BaseException):
+    """注入到执行线程中的中断异常
+
+    不是 Exception 的子类，沙箱代码中的 except Exception 不会捕获它。
+    """
+    pass
+
+
+def _set_async_exc(thread_id: int, exc_type: Optional[type]) -> int:
+    """向指定线程注入异步异常，exc_type 为 None 时清除待处理的异常"""
+    return ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id),
+        ctypes.py_object(exc_type) if exc_type is not None else ctypes.c_void_p(0)
+    )
+
+
+class CancelToken:
+    """执行取消令牌
+
+    取消时记录原因并依次调用已注册的回调（终止工作进程、容器等），
+    在当前进程中执行的代码则通过注入异常中断。沙箱代码可能用 except 捕获注入的异常，
+    因此每隔 REINJECT_INTERVAL 重新注入一次，直到执行线程离开 guard_thread。
+    """
+
+    def __init__(self):
+        self.reason: Optional[BaseException] = None
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._thread_id: Optional[int] = None
+        self._shield_depth = 0  # 执行线程位于沙箱内部实现中的嵌套层数
+        self._deferred = False  # 屏蔽期间收到取消，退出屏蔽时抛出
+        self._injected = False  # 已注入、可能尚未触发的异常
+        self._released = threading.Event()  # 执行线程已离开 guard_thread
+
+    @property
+    def cancelled(self) -> bool:
+        """是否已被取消"""
+        return self.reason is not None
+
+    def cancel(self, reason: BaseException) -> None:
+        """取消执行
+
+        Args:
+            reason: 取消原因，执行方会把它作为最终异常抛出
+        """
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+            if self._thread_id is not None:
+                self._inject()
+                threading.Thread(target=self._reinject_loop, name="sandbox-cancel", daemon=True).start()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """注册取消回调，已取消时立即调用
+
+        Args:
+            callback: 取消时调用的无参函数
+        """
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        """移除取消回调
+
+        Args:
+            callback: 之前注册的回调
+        """
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self) -> None:
+        """已取消时抛出取消原因"""
+        if self.reason is not None:
+            raise self.reason
+
+    @contextmanager
+    def guard_thread(self):
+        """在上下文内允许通过注入异常中断当前线程"""
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._thread_id = thread_id
+            self._released.clear()
+        previous = getattr(_guarded, 'token', None)
+        _guarded.token = self
+        try:
+            self.raise_if_cancelled()
+            yield
+        finally:
+            # 重新注入的异常可能在清理完成前触发，清理是幂等的，重试到完成为止
+            while True:
+                try:
+                    self._release(thread_id)
+                    break
+                except ExecutionCancelled:
+                    continue
+            _guarded.token = previous
+
+    def _inject(self) -> None:
+        """向执行线程注入取消异常，位于屏蔽区时改为推迟，调用方须持有锁"""
+        if self._shield_depth:
+            self._deferred = True
+        else:
+            self._injected = True
+            _set_async_exc(self._thread_id, ExecutionCancelled)
+
+    def _reinject_loop(self) -> None:
+        """执行线程离开 guard_thread 之前定期重新注入取消异常"""
+        while not self._released.wait(REINJECT_INTERVAL):
+            with self._lock:
+                if self._thread_id is None:
+                    return
+                self._inject()
+
+    def _release(self, thread_id: int) -> None:
+        """停止向执行线程注入异常并清除尚未触发的异常"""
+        with self._lock:
+            self._thread_id = None
+            self._shield_depth = 0
+            self._deferred = False
+            self._released.set()
+            if self._injected:
+                self._injected = False
+                _set_async_exc(thread_id, None)
+
+    def _enter_shield(self) -> None:
+        with self._lock:
+            if self._injected:
+                # 取消发生在进入屏蔽之前，撤回尚未触发的异常，退出屏蔽时再抛出。
+                # 先撤回再修改状态：异常在撤回前触发时状态保持不变
+                _set_async_exc(self._thread_id, None)
+                self._injected = False
+                self._deferred = True
+            self._shield_depth += 1
+
+    def _exit_shield(self) -> bool:
+        with self._lock:
+            self._shield_depth -= 1
+            if self._shield_depth or not self._deferred:
+                return False
+            self._deferred = False
+            return True
+
+
+# 当前线程上正在守护的取消令牌
+_guarded = threading.local()
+
+
+def current_token() -> Optional[CancelToken]:
+    """获取当前线程上正在守护（可注入异常）的取消令牌
+
+    Returns:
+        Optional[CancelToken]: 不在 guard_thread 中时为 None
+    """
+    return getattr(_guarded, 'token', None)
+
+
+@contextmanager
+def cancel_shield():
+    """在上下文内屏蔽注入的取消异常
+
+    沙箱内部实现（受限导入、日志、输出回调）在执行线程上运行时使用，
+    期间收到的取消在退出上下文时以 ExecutionCancelled 抛出。
+    """
+    token = current_token()
+    if token is None:
+        yield
+        return
+    token._enter_shield()
+    try:
+        yield
+    finally:
+        if token._exit_shield():
+            raise ExecutionCancelled()
@@ -0,0 +1,227 @@
+"""
+进程隔离模块
+在 fork 出的子进程中尽力进入空的网络命名空间、挂载私有 tmpfs 并降低权限，
+内核或权限不支持的步骤会被跳过，不影响代码执行，各步骤是否生效见 isolate 的返回值
+"""
+
+import ctypes
+import json
+import os
+from typing import Any, Dict, List
+
+CLONE_NEWNS = 0x00020000
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+
+MS_NOSUID = 0x2
+MS_NODEV = 0x4
+MS_NOEXEC = 0x8
+MS_REC = 0x4000
+MS_PRIVATE = 0x40000
+
+PR_CAPBSET_DROP = 24
+PR_SET_NO_NEW_PRIVS = 38
+
+_LINUX_CAPABILITY_VERSION_3 = 0x20080522
+
+NOBODY_ID = 65534
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    return _libc
+
+
+def _check(result: int) -> None:
+    if result != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def _unshare(flags: int) -> None:
+    if hasattr(os, "unshare"):
+        os.unshare(flags)
+    else:
+        _check(_get_libc().unshare(flags))
+
+
+def _mount(source, target: str, fstype, flags: int, data=None) -> None:
+    encode = lambda value: value.encode() if value is not None else None
+    _check(_get_libc().mount(encode(source), encode(target), encode(fstype), flags, encode(data)))
+
+
+def _write_id_maps(uid: int, gid: int) -> None:
+    """在新用户命名空间中把当前用户映射为命名空间内的同一个 id
+
+    不映射为命名空间内的 root，清除能力后执行的程序也不会重新获得能力
+    """
+    with open("/proc/self/setgroups", "w") as f:
+        f.write("deny")
+    with open("/proc/self/uid_map", "w") as f:
+        f.write(f"{uid} {uid} 1")
+    with open("/proc/self/gid_map", "w") as f:
+        f.write(f"{gid} {gid} 1")
+
+
+class _CapHeader(ctypes.Structure):
+    _fields_ = [("version", ctypes.c_uint32), ("pid", ctypes.c_int)]
+
+
+class _CapData(ctypes.Structure):
+    _fields_ = [("effective", ctypes.c_uint32), ("permitted", ctypes.c_uint32), ("inheritable", ctypes.c_uint32)]
+
+
+def _drop_bounding_set() -> None:
+    """从能力边界集中移除全部能力，需要在降低用户之前调用（需要 CAP_SETPCAP）"""
+    try:
+        with open("/proc/sys/kernel/cap_last_cap") as f:
+            last_cap = int(f.read())
+    except (OSError, ValueError):
+        return
+    libc = _get_libc()
+    for cap in range(last_cap + 1):
+        libc.prctl(PR_CAPBSET_DROP, cap, 0, 0, 0)
+
+
+def _clear_capabilities() -> None:
+    """清除当前进程的有效、允许和可继承能力（环境能力随允许能力一起清除）"""
+    header = _CapHeader(_LINUX_CAPABILITY_VERSION_3, 0)
+    data = (_CapData * 2)()
+    _check(_get_libc().capset(ctypes.byref(header), data))
+
+
+def _nobody_ids():
+    try:
+        import pwd
+        entry = pwd.getpwnam("nobody")
+        return entry.pw_uid, entry.pw_gid
+    except (ImportError, KeyError):
+        return NOBODY_ID, NOBODY_ID
+
+
+def isolate(tmpfs_mb: int) -> Dict[str, Any]:
+    """隔离当前进程，只能在单线程的子进程中调用
+
+    1. 进入新的网络和挂载命名空间（非 root 时借助用户命名空间，用户在命名空间内保持原来的 id），
+       网络命名空间中只有未启用的 lo
+    2. 在 /tmp 挂载私有 tmpfs
+    3. 设置 no_new_privs，root 时切换到 nobody 用户，并清除全部能力，
+       执行的代码无法卸载私有 tmpfs 或修改网络命名空间
+
+    Args:
+        tmpfs_mb: 私有 tmpfs 的大小（MB）
+
+    Returns:
+        Dict[str, Any]: 各步骤是否生效：network、tmpfs、no_new_privs、capabilities（已清除全部能力），
+            以及最终的 uid
+    """
+    report = {'network': False, 'tmpfs': False, 'no_new_privs': False, 'capabilities': False,
+              'uid': os.geteuid()}
+    uid, gid = os.getuid(), os.getgid()
+    privileged = os.geteuid() == 0
+
+    try:
+        if privileged:
+            _unshare(CLONE_NEWNET | CLONE_NEWNS)
+        else:
+            _unshare(CLONE_NEWUSER | CLONE_NEWNET | CLONE_NEWNS)
+            _write_id_maps(uid, gid)
+        report['network'] = True
+    except OSError:
+        pass
+
+    if report['network']:
+        try:
+            # 挂载变更不传播回宿主的挂载命名空间
+            _mount(None, "/", None, MS_REC | MS_PRIVATE)
+            _mount("tmpfs", "/tmp", "tmpfs", MS_NOSUID | MS_NODEV | MS_NOEXEC, f"size={tmpfs_mb}m,mode=1777")
+            report['tmpfs'] = True
+        except OSError:
+            pass
+
+    try:
+        _check(_get_libc().prctl(PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0))
+        report['no_new_privs'] = True
+    except (OSError, AttributeError):
+        pass
+
+    _drop_bounding_set()
+    if privileged:
+        nobody_uid, nobody_gid = _nobody_ids()
+        try:
+            os.setgroups([])
+            os.setgid(nobody_gid)
+            os.setuid(nobody_uid)
+        except OSError:
+            pass
+    try:
+        # 用户命名空间的创建者在命名空间内拥有全部能力，切换用户失败时 root 也保留着能力
+        _clear_capabilities()
+        report['capabilities'] = True
+    except (OSError, AttributeError):
+        pass
+    report['uid'] = os.geteuid()
+    return report
+
+
+_STEP_NAMES = {
+    'network': "网络命名空间",
+    'tmpfs': "私有 tmpfs",
+    'no_new_privs': "no_new_privs",
+    'capabilities': "清除能力",
+}
+
+
+def missing_steps(report: Dict[str, Any]) -> List[str]:
+    """隔离报告中未生效的步骤
+
+    Args:
+        report: isolate 的返回值
+
+    Returns:
+        List[str]: 未生效步骤的名称
+    """
+    return [name for name in _STEP_NAMES if not report.get(name)]
+
+
+def format_isolation(report: Dict[str, Any]) -> str:
+    """把隔离报告格式化为一行文字
+
+    Args:
+        report: isolate 的返回值
+
+    Returns:
+        str: 各步骤是否生效以及最终的 uid
+    """
+    steps = [f"{label} {'生效' if report.get(name) else '未生效'}" for name, label in _STEP_NAMES.items()]
+    return f"{', '.join(steps)}, uid {report.get('uid')}"
+
+
+def probe_isolation(tmpfs_mb: int = 64) -> Dict[str, Any]:
+    """在临时子进程中尝试隔离，报告当前内核和权限下哪些步骤可用
+
+    Args:
+        tmpfs_mb: 私有 tmpfs 的大小（MB）
+
+    Returns:
+        Dict[str, Any]: 同 isolate 的返回值
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            report = isolate(tmpfs_mb)
+            with os.fdopen(write_fd, 'w') as f:
+                json.dump(report, f)
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'r') as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    return json.loads(data)
@@ -0,0 +1,210 @@
+"""
+资源限制模块
+包含基于采样的超限判定，以及由内核强制执行的 setrlimit / cgroup v2 限制
+"""
+
+import math
+import os
+import signal
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+from sandbox.config.settings import SandboxSettings
+
+# 资源限制的执行方式
+ENFORCEMENT_MONITOR = "monitor"  # 主进程周期性采样
+ENFORCEMENT_RLIMIT = "rlimit"  # setrlimit(RLIMIT_AS / RLIMIT_CPU)
+ENFORCEMENT_CGROUP = "cgroup"  # cgroup v2 子组（memory.max / cpu.max）
+
+_MB = 1024 * 1024
+
+
+def check_limits(settings: SandboxSettings, memory_mb: float, cpu_percent: float,
+                 elapsed: float) -> Optional[str]:
+    """根据沙箱设置判断资源使用是否超限
+
+    Args:
+        settings: 沙箱配置
+        memory_mb: 内存使用量(MB)
+        cpu_percent: CPU使用率(%)
+        elapsed: 已执行时间(秒)
+
+    Returns:
+        Optional[str]: 超限时返回描述信息，否则返回 None
+    """
+    if memory_mb > settings.max_memory_mb:
+        return f"内存使用超出限制: {memory_mb:.2f}MB > {settings.max_memory_mb}MB"
+
+    if cpu_percent > settings.max_cpu_percent:
+        return f"CPU使用率超出限制: {cpu_percent:.2f}% > {settings.max_cpu_percent}%"
+
+    if elapsed > settings.max_execution_time:
+        return f"执行时间超出限制: {elapsed:.2f}秒 > {settings.max_execution_time}秒"
+
+    return None
+
+
+def is_kernel_enforced(settings: SandboxSettings) -> bool:
+    """资源限制是否由内核强制执行（仅对工作进程生效）"""
+    return settings.enforcement in (ENFORCEMENT_RLIMIT, ENFORCEMENT_CGROUP)
+
+
+def memory_breach_message(settings: SandboxSettings) -> str:
+    """内核拒绝分配内存时的超限描述"""
+    return f"内存使用超出限制: 超过 {settings.max_memory_mb}MB"
+
+
+def timeout_message(settings: SandboxSettings) -> str:
+    """墙钟时间超限描述"""
+    return f"执行时间超出限制: 超过 {settings.max_execution_time}秒"
+
+
+def describe_exit(exitcode: Optional[int], oom_killed: bool = False) -> Optional[str]:
+    """根据工作进程的退出状态判断是否因内核限制被终止
+
+    Args:
+        exitcode: multiprocessing 风格的退出码，被信号终止时为负的信号值
+        oom_killed: 所在 cgroup 是否发生了 OOM kill
+
+    Returns:
+        Optional[str]: 因资源超限退出时返回描述信息，否则返回 None
+    """
+    if exitcode == -signal.SIGXCPU:
+        return "CPU时间超出限制"
+    if exitcode == -signal.SIGKILL and oom_killed:
+        return "内存使用超出限制: cgroup 内存耗尽"
+    return None
+
+
+def process_limits(settings: SandboxSettings):
+    """工作进程内执行单个任务时使用的限制上下文
+
+    rlimit 模式下设置进程资源上限；cgroup 由创建子组的一方配置，monitor 由主进程采样，
+    这两种情况返回空上下文。
+    """
+    if settings.enforcement == ENFORCEMENT_RLIMIT:
+        return rlimits(settings)
+    return nullcontext()
+
+
+@contextmanager
+def rlimits(settings: SandboxSettings):
+    """在当前进程内临时设置 RLIMIT_AS 和 RLIMIT_CPU
+
+    内存上限以当前虚拟内存大小为基准再加 max_memory_mb，CPU 上限以已用 CPU 时间为基准
+    再加不超过 max_execution_time 的整秒预算，因此可在常驻工作进程中逐个任务设置。退出上下文时恢复原值。
+    超出内存上限时分配失败抛出 MemoryError，超出 CPU 上限时进程收到 SIGXCPU。
+
+    RLIMIT_CPU 以整秒计，上限取不超过 已用时间 + max_execution_time 的整秒数，CPU 密集的代码
+    在墙钟超时之前收到 SIGXCPU；取整后预算过小时多给一秒，此时由墙钟超时终止。
+    rlimit 只限制 CPU 时间，不限制 CPU 使用率，max_cpu_percent 在该模式下不生效。
+    """
+    import resource
+
+    old_as = resource.getrlimit(resource.RLIMIT_AS)
+    old_cpu = resource.getrlimit(resource.RLIMIT_CPU)
+
+    with open("/proc/self/statm") as f:
+        vms = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    as_limit = vms + settings.max_memory_mb * _MB
+    if old_as[1] != resource.RLIM_INFINITY:
+        as_limit = min(as_limit, old_as[1])
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = usage.ru_utime + usage.ru_stime
+    cpu_limit = math.floor(used + settings.max_execution_time)
+    if cpu_limit - used < min(settings.max_execution_time, 1) / 2:
+        cpu_limit += 1
+    if old_cpu[1] != resource.RLIM_INFINITY:
+        cpu_limit = min(cpu_limit, old_cpu[1])
+
+    resource.setrlimit(resource.RLIMIT_AS, (as_limit, old_as[1]))
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, old_cpu[1]))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, old_as)
+        resource.setrlimit(resource.RLIMIT_CPU, old_cpu)
+
+
+class Cgroup:
+    """cgroup v2 子组"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def create(cls, root: str, name: str) -> Optional["Cgroup"]:
+        """在 root 下创建子组，内核或权限不支持时返回 None
+
+        Args:
+            root: 沙箱使用的 cgroup v2 目录
+            name: 子组名称
+
+        Returns:
+            Optional[Cgroup]: 创建成功的子组
+        """
+        parent = os.path.dirname(root)
+        if not os.path.exists(os.path.join(parent, "cgroup.controllers")):
+            # 父目录不是 cgroup v2 层级
+            return None
+        try:
+            if not os.path.exists(root):
+                os.makedirs(root)
+                # 在父组和沙箱根组中启用 memory / cpu 控制器
+                with open(os.path.join(parent, "cgroup.subtree_control"), "w") as f:
+                    f.write("+memory +cpu")
+            with open(os.path.join(root, "cgroup.subtree_control"), "w") as f:
+                f.write("+memory +cpu")
+            path = os.path.join(root, name)
+            os.makedirs(path, exist_ok=True)
+            return cls(path)
+        except OSError:
+            return None
+
+    def _write(self, name: str, value: str) -> None:
+        with open(os.path.join(self.path, name), "w") as f:
+            f.write(value)
+
+    def configure(self, memory_bytes: int, cpu_percent: int, period_us: int = 100000) -> None:
+        """写入内存和 CPU 限制
+
+        Args:
+            memory_bytes: memory.max 的值
+            cpu_percent: CPU 使用率上限(%)，换算为 cpu.max 配额
+            period_us: cpu.max 的周期（微秒）
+        """
+        self._write("memory.max", str(memory_bytes))
+        try:
+            self._write("memory.swap.max", "0")
+        except OSError:
+            pass
+        quota = max(1000, int(period_us * cpu_percent / 100))
+        self._write("cpu.max", f"{quota} {period_us}")
+
+    def attach(self, pid: int) -> None:
+        """把进程移入子组"""
+        self._write("cgroup.procs", str(pid))
+
+    def memory_current(self) -> int:
+        """子组当前内存用量（字节）"""
+        with open(os.path.join(self.path, "memory.current")) as f:
+            return int(f.read().strip())
+
+    def oom_kills(self) -> int:
+        """子组累计发生的 OOM kill 次数"""
+        try:
+            with open(os.path.join(self.path, "memory.events")) as f:
+                for line in f:
+                    key, _, value = line.partition(" ")
+                    if key == "oom_kill":
+                        return int(value)
+        except OSError:
+            pass
+        return 0
+
+    def remove(self) -> None:
+        """删除子组（组内进程须已退出）"""
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
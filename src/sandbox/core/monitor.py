@@ -0,0 +1,207 @@
+"""
+资源监控服务模块
+进程内共享一个监控线程，按截止时间堆调度所有执行的资源采样
+
+监控线程只负责采样、判定超限和终止执行；采样回调和日志等可能阻塞的通知交给单独的通知线程，
+通知阻塞时不会推迟其他执行的超时终止。超限的执行在注销之前每个采样间隔重复调用一次超限回调，
+第一次终止没有生效（例如异常被沙箱代码捕获）时继续终止。
+某个执行的采样或回调出错时只记录日志，不影响监控线程和其他执行；采样出错的执行仍按墙钟时间判定超时。
+"""
+
+import heapq
+import itertools
+import logging
+import math
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psutil
+
+from sandbox.config.settings import SandboxSettings
+from sandbox.core.limits import check_limits
+
+_logger = logging.getLogger(__name__)
+
+
+class MonitoredExecution:
+    """受监控的单次执行"""
+
+    def __init__(self, sampler, settings: SandboxSettings, on_breach: Callable[[str], None],
+                 on_sample: Optional[Callable[[float, float], None]] = None):
+        """
+        Args:
+            sampler: 资源采样器（ThreadSampler / ProcessSampler），返回归属于本次执行的用量
+            settings: 沙箱配置，提供限制值和采样间隔
+            on_breach: 超限时在监控线程中调用，参数为超限描述；之后每个采样间隔重复调用直到注销，
+                只应终止执行，不能阻塞，日志等通知通过 MonitorService.notify 交给通知线程
+            on_sample: 每次采样后在通知线程中调用，参数为内存(MB)和CPU使用率(%)
+        """
+        self.sampler = sampler
+        self.settings = settings
+        self.on_breach = on_breach
+        self.on_sample = on_sample
+        self.start_time = time.monotonic()
+        self.deadline = self.start_time + settings.max_execution_time
+        self.breach: Optional[str] = None  # 第一次判定的超限描述
+        self.active = True  # 注销前为 True
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        """已执行时间（秒）"""
+        return time.monotonic() - self.start_time
+
+    def next_check(self, now: float) -> float:
+        """下一次检查时间：采样间隔与截止时间中较早者
+
+        采样时间对齐到以采样间隔为步长的网格上，相同间隔的执行落在同一批次中，
+        同一进程在一个批次内只采样一次。
+        """
+        interval = max(self.settings.check_interval, 0.001)
+        next_time = (math.floor(now / interval) + 1) * interval
+        if now < self.deadline:
+            next_time = min(next_time, self.deadline)
+        return next_time
+
+    def _trip(self, message: str) -> None:
+        with self._lock:
+            if not self.active:
+                return
+            if self.breach is None:
+                self.breach = message
+            self.on_breach(self.breach)
+
+    def _stop(self) -> None:
+        with self._lock:
+            self.active = False
+
+
+class MonitorService:
+    """进程内共享的资源监控服务"""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, MonitoredExecution]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._notifications: "queue.SimpleQueue[Tuple[Callable[..., Any], tuple]]" = queue.SimpleQueue()
+        self._notifier: Optional[threading.Thread] = None
+        self._notifier_lock = threading.Lock()
+
+    def register(self, execution: MonitoredExecution) -> MonitoredExecution:
+        """开始监控一次执行
+
+        Args:
+            execution: 受监控的执行
+
+        Returns:
+            MonitoredExecution: 同一个执行对象
+        """
+        with self._cond:
+            # 首次检查立即进行（尽早发现已超出的内存），之后对齐到采样网格
+            heapq.heappush(self._heap, (time.monotonic(), next(self._seq), execution))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sandbox-monitor", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return execution
+
+    def unregister(self, execution: MonitoredExecution) -> None:
+        """停止监控，返回后不会再触发该执行的超限回调
+
+        Args:
+            execution: 受监控的执行
+        """
+        execution._stop()
+
+    def notify(self, callback: Callable[..., Any], *args: Any) -> None:
+        """在通知线程中调用 callback，不阻塞调用方
+
+        Args:
+            callback: 要调用的函数，抛出的异常被忽略
+            *args: 调用参数
+        """
+        with self._notifier_lock:
+            if self._notifier is None or not self._notifier.is_alive():
+                self._notifier = threading.Thread(target=self._notify_loop, name="sandbox-monitor-notify",
+                                                  daemon=True)
+                self._notifier.start()
+        self._notifications.put((callback, args))
+
+    def _notify_loop(self) -> None:
+        """通知线程主循环"""
+        while True:
+            callback, args = self._notifications.get()
+            try:
+                callback(*args)
+            except Exception:
+                pass
+
+    def _sample_callback(self, execution: MonitoredExecution, memory_mb: float, cpu_percent: float) -> None:
+        # 采样回调排队期间执行可能已经结束
+        if execution.active:
+            execution.on_sample(memory_mb, cpu_percent)
+
+    def _run(self) -> None:
+        """监控线程主循环"""
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                now = time.monotonic()
+                if self._heap[0][0] > now:
+                    self._cond.wait(self._heap[0][0] - now)
+                    continue
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    execution = heapq.heappop(self._heap)[2]
+                    if execution.active:
+                        due.append(execution)
+
+            # 同一批次共享进程 RSS、tracemalloc 快照等采样结果
+            batch: Dict[Any, Any] = {}
+            reschedule = []
+            for execution in due:
+                try:
+                    if execution.breach is None:
+                        try:
+                            memory_mb, cpu_percent = execution.sampler.sample(batch)
+                        except (psutil.NoSuchProcess, psutil.AccessDenied):
+                            continue
+                        except Exception:
+                            _logger.exception("资源采样出错，本次只检查执行时间")
+                            memory_mb, cpu_percent = 0.0, 0.0
+                        else:
+                            if execution.on_sample is not None and execution.active:
+                                self.notify(self._sample_callback, execution, memory_mb, cpu_percent)
+                        breach = check_limits(execution.settings, memory_mb, cpu_percent, execution.elapsed)
+                    else:
+                        # 已超限但仍未注销：执行还在运行，再次终止
+                        breach = execution.breach
+                    if breach:
+                        execution._trip(breach)
+                except Exception:
+                    # 超限回调出错时下一个采样间隔重试
+                    _logger.exception("检查执行的资源使用时出错")
+                if execution.active:
+                    reschedule.append(execution)
+
+            if reschedule:
+                now = time.monotonic()
+                with self._cond:
+                    for execution in reschedule:
+                        heapq.heappush(self._heap, (execution.next_check(now), next(self._seq), execution))
+
+
+_monitor = MonitorService()
+
+
+def get_monitor() -> MonitorService:
+    """获取进程内共享的资源监控服务
+
+    Returns:
+        MonitorService: 共享监控服务
+    """
+    return _monitor
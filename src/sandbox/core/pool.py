@@ -0,0 +1,369 @@
+"""
+预启动工作进程池模块
+代码通过管道发送给常驻的工作进程执行，资源超限时终止并替换对应进程
+
+工作进程中运行的是不可信代码，回传的输出和结果使用 JSON 消息（见 sandbox.docker.protocol），
+主进程不反序列化工作进程发来的 pickle 数据
+"""
+
+import atexit
+import dataclasses
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import psutil
+
+from sandbox.config.settings import SandboxSettings
+from sandbox.core.accounting import ProcessSampler, ResourceUsage, WorkerMeter, record_imports, track_imports
+from sandbox.core.cancel import CancelToken
+from sandbox.core.limits import (
+    ENFORCEMENT_CGROUP, ENFORCEMENT_RLIMIT, Cgroup, describe_exit,
+    is_kernel_enforced, memory_breach_message, process_limits, timeout_message
+)
+from sandbox.core.monitor import MonitoredExecution, get_monitor
+from sandbox.core.stream import OutputSink, capture_output
+from sandbox.docker.protocol import MAX_MESSAGE_SIZE, ProtocolError, decode_body, encode_body
+from sandbox.exceptions import SandboxError, ResourceLimitExceeded
+
+
+class WorkerError(SandboxError):
+    """工作进程中代码执行出错"""
+
+    def __init__(self, error_type: str, message: str):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+def _mp_context():
+    """获取多进程上下文，优先使用 fork 以复用已导入的模块"""
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("spawn")
+
+
+def _unpack_reply(reply: Dict[str, Any], start: float, sampled_peak_mb: float = 0.0) -> Tuple[Any, ResourceUsage]:
+    """把子进程回传的 result / error 消息转换为执行结果或异常
+
+    Args:
+        reply: result 或 error 消息
+        start: 执行开始时间（time.monotonic）
+        sampled_peak_mb: 主进程采样到的内存峰值（MB）
+
+    Returns:
+        Tuple[Any, ResourceUsage]: 执行结果和资源使用情况
+
+    Raises:
+        ResourceLimitExceeded: 子进程内判定资源超限
+        WorkerError: 代码执行出错
+        SandboxError: 消息内容无效
+    """
+    if reply.get('type') == "result":
+        try:
+            usage = ResourceUsage(
+                wall_time=time.monotonic() - start,
+                cpu_time=float(reply['usage']['cpu_time']),
+                peak_memory_mb=max(float(reply['usage']['peak_memory_mb']), sampled_peak_mb)
+            )
+            imported = [str(name) for name in reply['imported_modules']]
+        except (KeyError, TypeError, ValueError):
+            raise SandboxError("无效的执行结果")
+        record_imports(imported)
+        return reply.get('result'), usage
+    error_type, error = str(reply.get('error_type')), str(reply.get('error'))
+    if error_type == ResourceLimitExceeded.__name__:
+        raise ResourceLimitExceeded(error)
+    raise WorkerError(error_type, error)
+
+
+def _send(conn, message: Dict[str, Any]) -> None:
+    """以 JSON 消息回传给主进程"""
+    conn.send_bytes(encode_body(message))
+
+
+def _worker_main(conn) -> None:
+    """工作进程主循环
+
+    Args:
+        conn: 与主进程通信的管道端点
+    """
+    from sandbox.core.sandbox import Sandbox
+
+    sandbox = Sandbox(SandboxSettings(), enable_logging=False)
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+
+        code, settings, stream = message
+        sandbox.update_settings(settings)
+        sink = None
+        if stream:
+            # 输出逐块发回主进程，主进程读取缓慢时管道写满即形成背压
+            sink = lambda kind, data: _send(conn, {"type": "output", "kind": kind, "data": data})
+        try:
+            meter = WorkerMeter()
+            with process_limits(settings), capture_output(sink), track_imports() as imported:
+                result = sandbox._run_code(code)
+            usage = meter.finish()
+            message = {"type": "result", "result": result, "usage": usage, "imported_modules": sorted(imported)}
+            try:
+                body = encode_body(message)
+            except Exception:
+                # 例如循环引用，整体回传 repr
+                body = encode_body(dict(message, result=repr(result)))
+            conn.send_bytes(body)
+        except MemoryError:
+            _send(conn, {"type": "error", "error_type": ResourceLimitExceeded.__name__,
+                         "error": memory_breach_message(settings)})
+        except Exception as e:
+            _send(conn, {"type": "error", "error_type": type(e).__name__, "error": str(e)})
+
+
+class _Worker:
+    """单个工作进程句柄"""
+
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.cgroup: Optional[Cgroup] = None
+
+    def kill(self) -> None:
+        """强制终止工作进程"""
+        try:
+            self.process.kill()
+            self.process.join(timeout=1.0)
+        except Exception:
+            pass
+        self.conn.close()
+        if self.cgroup is not None:
+            self.cgroup.remove()
+
+    def kernel_settings(self, settings: SandboxSettings) -> SandboxSettings:
+        """为 cgroup 模式配置工作进程所在子组，不可用时回退到 rlimit
+
+        Args:
+            settings: 沙箱配置
+
+        Returns:
+            SandboxSettings: 实际发送给工作进程的配置
+        """
+        if settings.enforcement != ENFORCEMENT_CGROUP:
+            return settings
+        if self.cgroup is None:
+            cgroup = Cgroup.create(settings.cgroup_root, f"worker-{self.process.pid}")
+            if cgroup is not None:
+                try:
+                    cgroup.attach(self.process.pid)
+                    self.cgroup = cgroup
+                except OSError:
+                    cgroup.remove()
+        if self.cgroup is not None:
+            try:
+                # 内存上限以工作进程当前用量为基准
+                memory_bytes = self.cgroup.memory_current() + settings.max_memory_mb * 1024 * 1024
+                self.cgroup.configure(memory_bytes, settings.max_cpu_percent)
+                return settings
+            except OSError:
+                pass
+        return dataclasses.replace(settings, enforcement=ENFORCEMENT_RLIMIT)
+
+    def stop(self) -> None:
+        """通知工作进程退出"""
+        try:
+            self.conn.send(None)
+            self.process.join(timeout=1.0)
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class WorkerPool:
+    """预启动工作进程池"""
+
+    def __init__(self, size: int = 4):
+        """初始化进程池并启动全部工作进程
+
+        Args:
+            size: 工作进程数量
+        """
+        self.size = max(1, size)
+        self._ctx = _mp_context()
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(self.size):
+            self._add_worker()
+
+    def _add_worker(self) -> None:
+        """启动一个新的工作进程并放入空闲队列"""
+        worker = _Worker(self._ctx)
+        with self._lock:
+            self._workers.append(worker)
+        self._idle.put(worker)
+
+    def _acquire(self, interval: float, token: Optional[CancelToken]) -> _Worker:
+        """等待并取出一个空闲工作进程，等待期间响应取消"""
+        while True:
+            if token is not None:
+                token.raise_if_cancelled()
+            try:
+                return self._idle.get(timeout=interval)
+            except queue.Empty:
+                continue
+
+    def _replace(self, worker: _Worker) -> None:
+        """终止工作进程并用新进程替换"""
+        worker.kill()
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        if not self._closed:
+            self._add_worker()
+
+    @staticmethod
+    def _receive(worker: _Worker, output: Optional[OutputSink],
+                 timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """接收执行结果，期间把输出块转发给 output
+
+        Returns:
+            Optional[Dict[str, Any]]: result 或 error 消息，超时返回 None
+
+        Raises:
+            ProtocolError: 工作进程发来的消息无效
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is not None and not worker.conn.poll(max(deadline - time.monotonic(), 0)):
+                return None
+            message = decode_body(worker.conn.recv_bytes(MAX_MESSAGE_SIZE))
+            if message.get('type') != "output":
+                return message
+            if output is not None:
+                output(str(message.get('kind')), str(message.get('data')))
+
+    def execute(self, code: str, settings: SandboxSettings, token: Optional[CancelToken] = None,
+                output: Optional[OutputSink] = None) -> Tuple[Any, ResourceUsage]:
+        """在空闲工作进程中执行代码
+
+        Args:
+            code: 要执行的代码
+            settings: 沙箱配置
+            token: 取消令牌，取消时终止并替换执行中的工作进程
+            output: 接收 print 输出的回调，为 None 时输出到工作进程的控制台
+
+        Returns:
+            Tuple[Any, ResourceUsage]: 执行结果和工作进程的资源使用情况
+
+        Raises:
+            ResourceLimitExceeded: 资源使用超出限制（对应工作进程会被替换）
+            WorkerError: 代码执行出错
+            SandboxError: 进程池已关闭或工作进程异常退出
+        """
+        if self._closed:
+            raise SandboxError("工作进程池已关闭")
+
+        worker = self._acquire(settings.check_interval, token)
+        kill = worker.process.kill
+        if token is not None:
+            token.add_callback(kill)
+        oom_kills = 0
+        execution = None
+        start = time.monotonic()
+        try:
+            if is_kernel_enforced(settings):
+                # 内存和 CPU 由内核限制，这里只等待墙钟超时
+                settings = worker.kernel_settings(settings)
+                if worker.cgroup is not None:
+                    oom_kills = worker.cgroup.oom_kills()
+                worker.conn.send((code, settings, output is not None))
+                reply = self._receive(worker, output, settings.max_execution_time)
+                if reply is None:
+                    self._replace(worker)
+                    worker = None
+                    raise ResourceLimitExceeded(timeout_message(settings))
+            else:
+                # 由共享监控服务采样，超限时终止工作进程，这里只需阻塞等待结果
+                execution = get_monitor().register(MonitoredExecution(
+                    ProcessSampler(worker.process.pid),
+                    settings,
+                    lambda message: kill()
+                ))
+                try:
+                    worker.conn.send((code, settings, output is not None))
+                    reply = self._receive(worker, output)
+                finally:
+                    get_monitor().unregister(execution)
+                if execution.breach:
+                    # 结果返回后才被判定超限，进程已被终止，需要替换
+                    self._replace(worker)
+                    worker = None
+        except (EOFError, OSError, ProtocolError, psutil.NoSuchProcess):
+            breach = execution.breach if execution is not None else None
+            if worker is not None:
+                worker.process.join(timeout=1.0)
+                oom_killed = worker.cgroup is not None and worker.cgroup.oom_kills() > oom_kills
+                breach = breach or describe_exit(worker.process.exitcode, oom_killed)
+                self._replace(worker)
+                worker = None
+            if token is not None:
+                token.raise_if_cancelled()
+            if breach:
+                raise ResourceLimitExceeded(breach)
+            raise SandboxError("工作进程异常退出")
+        finally:
+            if token is not None:
+                token.remove_callback(kill)
+            if worker is not None:
+                self._idle.put(worker)
+
+        return _unpack_reply(reply, start, execution.sampler.peak_memory_mb if execution is not None else 0.0)
+
+    def shutdown(self) -> None:
+        """关闭进程池并终止全部工作进程"""
+        self._closed = True
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
+
+
+_pools: Dict[int, WorkerPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_worker_pool(size: int) -> WorkerPool:
+    """获取进程内共享的工作进程池
+
+    Args:
+        size: 工作进程数量
+
+    Returns:
+        WorkerPool: 对应大小的共享进程池
+    """
+    with _pools_lock:
+        pool = _pools.get(size)
+        if pool is None:
+            pool = _pools[size] = WorkerPool(size)
+        return pool
+
+
+@atexit.register
+def shutdown_pools() -> None:
+    """关闭全部共享进程池"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
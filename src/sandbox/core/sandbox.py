@@ -9,11 +9,25 @@ import time
 import psutil
 import threading
 import traceback
+import asyncio
+import contextvars
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import Dict, Any, Optional, List
-from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, List, Iterable, Iterator
+from dataclasses import dataclass, field, replace
 from sandbox.config.settings import SandboxSettings, DEFAULT_SETTINGS
 from sandbox.exceptions import SandboxError, ResourceLimitExceeded, SecurityError
+from sandbox.core.limits import ENFORCEMENT_RLIMIT, check_limits, is_kernel_enforced
+from sandbox.core.cache import get_code_cache
+from sandbox.core.cancel import CancelToken, ExecutionCancelled, cancel_shield
+from sandbox.core.monitor import MonitoredExecution, get_monitor
+from sandbox.core.batch import BatchExecution
+from sandbox.core.stream import OutputSink, StreamChunk, capture_output, sandbox_print, stream_execution
+from sandbox.core.accounting import (
+    MEMORY_TRACEMALLOC, ExecutionResult, ResourceUsage, ThreadSampler, ensure_tracemalloc,
+    execution_filename, inline_execution, record_imports, relabel, release_tracemalloc, track_imports
+)
 import uuid
 from sandbox.logging.security_logger import SecurityLogger
 
@@ -29,15 +43,21 @@ class Sandbox:
         """
         self.settings = settings or SandboxSettings()
         self._process = None
-        self._monitor_thread = None
-        self._stop_monitor = threading.Event()
         self._start_time = None
         self._globals = self._setup_globals()
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._worker_pool = None  # execute_many 专用的工作进程池，为 None 时使用共享进程池
         
         # 初始化安全日志记录
         self.enable_logging = enable_logging
         if enable_logging:
-            self.logger = SecurityLogger()
+            self.logger = SecurityLogger(async_mode=self.settings.async_logging,
+                                         queue_size=self.settings.log_queue_size,
+                                         audit=self.settings.audit_log,
+                                         audit_max_bytes=self.settings.audit_max_mb * 1024 * 1024,
+                                         audit_max_age=self.settings.audit_max_age)
         
         print("Sandbox initialized")
         
@@ -62,7 +82,7 @@ class Sandbox:
         # 设置安全的全局变量
         globals_dict = {
             '__builtins__': {
-                'print': print,
+                'print': sandbox_print,
                 'len': len,
                 'range': range,
                 'str': str,
@@ -145,7 +165,7 @@ class Sandbox:
                 'oct': oct,
                 'ord': ord,
                 'pow': pow,
-                'print': print,
+                'print': sandbox_print,
                 'range': range,
                 'repr': repr,
                 'reversed': reversed,
@@ -179,19 +199,25 @@ class Sandbox:
         Raises:
             SandboxError: 如果导入被禁止或模块不安全
         """
-        if not self.settings.allow_imports:
-            if self.enable_logging:
-                self.logger.log_module_import(name, False)
-            raise SandboxError("模块导入被禁止")
+        # 导入机制和日志都会获取锁，期间推迟注入的取消异常
+        with cancel_shield():
+            if not self.settings.allow_imports:
+                if self.enable_logging:
+                    self.logger.log_module_import(name, False)
+                raise SandboxError("模块导入被禁止")
         
-        if name in self.settings.allowed_modules:
-            if self.enable_logging:
-                self.logger.log_module_import(name, True)
-            return __import__(name, globals, locals, fromlist, level)
+            if name in self.settings.allowed_modules:
+                if self.enable_logging:
+                    self.logger.log_module_import(name, True)
+                module = __import__(name, globals, locals, fromlist, level)
+                # from 导入的名称可能是子模块（from numpy import random），一并记录
+                record_imports([name] + [f"{name}.{item}" for item in fromlist or ()])
+                return module
         
-        if self.enable_logging:
-            self.logger.log_module_import(name, False)
-        raise SandboxError(f"不允许导入模块: {name}")
+            if self.enable_logging:
+                self.logger.log_module_import(name, False)
+            raise SandboxError(f"不允许导入模块: {name}")
+    
     
     def is_path_allowed(self, path: str) -> bool:
         """检查路径是否允许访问"""
@@ -207,7 +233,8 @@ class Sandbox:
                 allowed = False
         
         if self.enable_logging:
-            self.logger.log_file_access(path, "访问", allowed)
+            with cancel_shield():
+                self.logger.log_file_access(path, "访问", allowed)
         
         return allowed
     
@@ -264,72 +291,68 @@ class Sandbox:
             return False
     
     @contextmanager
-    def _resource_monitor(self):
-        """资源监控上下文管理器"""
+    def _resource_monitor(self, token: CancelToken, label: Optional[str] = None):
+        """资源监控上下文管理器
+        
+        在进程共享的监控服务中登记本次执行，超限时通过取消令牌中断执行线程。
+        CPU 按执行线程计量；内存默认取宿主进程 RSS 相对执行开始时的增量，传入 label（tracemalloc
+        计量，或与其他执行重叠）时只统计归属于本次执行代码的分配。
+        
+        Args:
+            token: 本次执行的取消令牌
+            label: tracemalloc 计量时本次执行代码对象的文件名
+            
+        Yields:
+            ResourceUsage: 退出上下文时填入本次执行的资源使用情况
+        """
         print("Starting resource monitor context")  # 调试信息
         self._start_time = time.time()
         self._process = psutil.Process()
-        self._stop_monitor.clear()
-        self._monitor_thread = threading.Thread(target=self._monitor_resources)
-        self._monitor_thread.start()
+        usage = ResourceUsage()
+        # 监控回调在监控服务的线程中执行，在本次执行的上下文副本中记录日志才能归属到本次执行
+        context = contextvars.copy_context()
+        monitor = get_monitor()
+        
+        def on_breach(message: str) -> None:
+            # 监控线程只负责中断执行，日志交给通知线程，日志阻塞时不影响其他执行的超时终止。
+            # 执行结束前每个采样间隔都会再次调用，只记录第一次
+            if self.enable_logging and not token.cancelled:
+                monitor.notify(context.run, self.logger.log_error, "ResourceLimitExceeded", message)
+            token.cancel(ResourceLimitExceeded(message))
+        
+        def on_sample(memory_mb: float, cpu_percent: float) -> None:
+            context.run(self.logger.log_resource_usage, memory_mb, cpu_percent)
+        
+        if label is not None:
+            ensure_tracemalloc()
+        memory_mode = MEMORY_TRACEMALLOC if label is not None else self.settings.memory_accounting
+        sampler = ThreadSampler(threading.get_ident(), memory_mode, label)
+        execution = monitor.register(MonitoredExecution(
+            sampler,
+            self.settings,
+            on_breach,
+            on_sample=on_sample if self.enable_logging else None
+        ))
+        start_wall = time.monotonic()
+        start_cpu = time.thread_time()
         
         try:
-            yield
+            with token.guard_thread():
+                yield usage
         finally:
             print("Cleaning up resource monitor")  # 调试信息
-            self._stop_monitor.set()
-            if self._monitor_thread and self._monitor_thread.is_alive():
-                self._monitor_thread.join()
+            monitor.unregister(execution)
+            sampler.close()
+            if label is not None:
+                release_tracemalloc()
+            usage.wall_time = time.monotonic() - start_wall
+            usage.cpu_time = time.thread_time() - start_cpu
+            if label is None:
+                sampler.sample({})
+            usage.peak_memory_mb = sampler.peak_memory_mb
             self._process = None
-            self._monitor_thread = None
             print("Resource monitor cleanup completed")  # 调试信息
     
-    def _monitor_resources(self):
-        """监控资源使用情况"""
-        check_interval = 0.1  # 检查间隔（秒）
-        last_check = time.time()
-        
-        while not self._stop_monitor.is_set():
-            current_time = time.time()
-            if current_time - last_check >= check_interval:
-                if self._process:
-                    try:
-                        # 检查内存使用
-                        memory_info = self._process.memory_info()
-                        memory_mb = memory_info.rss / 1024 / 1024
-                        
-                        # 检查 CPU 使用
-                        cpu_percent = self._process.cpu_percent()
-                        
-                        # 记录资源使用情况
-                        if self.enable_logging:
-                            self.logger.log_resource_usage(memory_mb, cpu_percent)
-                        
-                        # 检查是否超出限制
-                        if memory_mb > self.settings.max_memory_mb:
-                            self._stop_monitor.set()
-                            if self.enable_logging:
-                                self.logger.log_error("ResourceLimitExceeded", f"内存使用超出限制: {memory_mb:.2f}MB > {self.settings.max_memory_mb}MB")
-                            raise ResourceLimitExceeded(f"内存使用超出限制: {memory_mb:.2f}MB")
-                        
-                        if cpu_percent > self.settings.max_cpu_percent:
-                            self._stop_monitor.set()
-                            if self.enable_logging:
-                                self.logger.log_error("ResourceLimitExceeded", f"CPU使用率超出限制: {cpu_percent:.2f}% > {self.settings.max_cpu_percent}%")
-                            raise ResourceLimitExceeded(f"CPU使用率超出限制: {cpu_percent:.2f}%")
-                        
-                        # 检查执行时间
-                        if time.time() - self._start_time > self.settings.max_execution_time:
-                            self._stop_monitor.set()
-                            if self.enable_logging:
-                                self.logger.log_error("ResourceLimitExceeded", f"执行时间超出限制: {time.time() - self._start_time:.2f}秒 > {self.settings.max_execution_time}秒")
-                            raise ResourceLimitExceeded(f"执行时间超出限制: {time.time() - self._start_time:.2f}秒")
-                    except (psutil.NoSuchProcess, psutil.AccessDenied):
-                        break
-                
-                last_check = current_time
-            time.sleep(0.01)  # 短暂休眠以减少 CPU 使用
-    
     def execute(self, code: str) -> Any:
         """执行代码
         
@@ -343,40 +366,255 @@ class Sandbox:
             SandboxError: 如果执行出错
             ResourceLimitExceeded: 如果资源使用超出限制
         """
+        return self._execute(code).value
+    
+    def run(self, code: str) -> ExecutionResult:
+        """执行代码并返回包含资源使用情况的结果
+        
+        Args:
+            code: 要执行的代码
+            
+        Returns:
+            ExecutionResult: 执行ID、__result__ 的值及本次执行的墙钟时间、CPU 时间和内存峰值
+            
+        Raises:
+            SandboxError: 如果执行出错
+            ResourceLimitExceeded: 如果资源使用超出限制
+        """
+        return self._execute(code)
+    
+    def _execute(self, code: str, token: Optional[CancelToken] = None,
+                 namespace: Optional[Dict[str, Any]] = None,
+                 output: Optional[OutputSink] = None) -> ExecutionResult:
+        """执行代码，可通过取消令牌从其他线程中断
+        
+        Args:
+            code: 要执行的代码
+            token: 取消令牌，取消后以其原因作为异常抛出
+            namespace: 会话的持久命名空间，提供时总是在当前进程中执行
+            output: 接收 print 输出的回调，为 None 时输出到宿主控制台
+            
+        Returns:
+            ExecutionResult: 执行结果
+        """
         execution_id = str(uuid.uuid4())
+        isolation: Dict[str, Any] = {}
         
         if self.enable_logging:
             self.logger.start_execution(execution_id, code, self.settings.__dict__)
         
         try:
-            with self._resource_monitor():
-                # 创建新的命名空间
-                local_vars = {}
-                
-                # 执行代码
-                exec(code, self._globals, local_vars)
-                
-                # 返回结果
-                result = local_vars.get('__result__')
-                
-                if self.enable_logging:
-                    self.logger.end_execution("成功", result)
-                
-                return result
+            with track_imports() as imported:
+                if namespace is None and self.settings.execution_mode == "pool":
+                    from sandbox.core.pool import get_worker_pool
+                    pool = self._worker_pool or get_worker_pool(self.settings.pool_size)
+                    result, usage = pool.execute(code, self.settings, token, output)
+                elif namespace is None and self.settings.execution_mode == "zygote":
+                    from sandbox.core.zygote import get_zygote
+                    result, usage = get_zygote(self.settings.allowed_modules).execute(
+                        code, self.settings, token, output)
+                elif namespace is None and self.settings.execution_mode == "isolated":
+                    # 从 zygote fork 子进程，子进程隔离后在内核限制下执行
+                    from sandbox.core.zygote import get_zygote
+                    settings = self.settings
+                    if not is_kernel_enforced(settings):
+                        settings = replace(settings, enforcement=ENFORCEMENT_RLIMIT)
+                    result, usage = get_zygote(settings.allowed_modules).execute(
+                        code, settings, token, output, self._isolation_recorder(isolation))
+                else:
+                    token = token or CancelToken()
+                    # 与其他执行重叠时按执行归属内存，进程 RSS 会计入其他执行的增长
+                    with inline_execution(self.settings.memory_accounting) as memory_mode:
+                        label = None
+                        if memory_mode == MEMORY_TRACEMALLOC:
+                            label = execution_filename(execution_id)
+                        with self._resource_monitor(token, label) as usage, capture_output(output):
+                            result = self._run_code(code, label, namespace)
+                    # 超限发生在代码即将结束时，注入的异常可能来不及触发
+                    token.raise_if_cancelled()
+                    # 两次采样之间的短暂内存峰值只在结束时的计量中可见（process 模式下
+                    # 与其他执行重叠后不再更新峰值，只检查独自执行期间的用量）
+                    breach = check_limits(self.settings, usage.peak_memory_mb, 0.0, 0.0)
+                    if breach:
+                        raise ResourceLimitExceeded(breach)
+            
+            if self.enable_logging:
+                self.logger.end_execution("成功", result)
+            
+            return ExecutionResult(execution_id, result, usage, frozenset(imported), isolation or None)
         except ResourceLimitExceeded as e:
             if self.enable_logging:
                 self.logger.end_execution("失败", str(e))
             raise
-        except Exception as e:
+        except (ExecutionCancelled, Exception) as e:
+            if token is not None and token.cancelled:
+                if self.enable_logging:
+                    self.logger.end_execution("失败", str(token.reason))
+                raise token.reason
             if self.enable_logging:
-                self.logger.log_error(type(e).__name__, str(e))
+                self.logger.log_error(getattr(e, 'error_type', type(e).__name__), str(e))
                 self.logger.end_execution("失败")
             raise SandboxError(f"代码执行出错: {str(e)}")
     
+    def _isolation_recorder(self, isolation: Dict[str, Any]):
+        """接收子进程隔离报告的回调：保存到 isolation 并写入安全日志"""
+        def record(report: Dict[str, Any]) -> None:
+            isolation.update(report)
+            if self.enable_logging:
+                self.logger.log_isolation(report)
+        return record
+    
+    def execute_stream(self, code: str) -> Iterator[StreamChunk]:
+        """执行代码并在产生输出时逐块返回
+        
+        代码在后台线程中执行，print 的输出经有界缓冲区（stream_buffer_size 块）交给调用方，
+        缓冲区满时代码暂停等待读取。pool、zygote 和 isolated 模式下输出在子进程中产生时即经管道转发，
+        同样受缓冲区大小限制。最后一块的类型为 result，data 为 __result__ 的值；
+        执行出错时先返回一块 stderr 错误信息，然后抛出异常。提前停止迭代会取消执行。
+        
+        Args:
+            code: 要执行的代码
+            
+        Yields:
+            StreamChunk: stdout / stderr / result 输出块
+            
+        Raises:
+            SandboxError: 如果执行出错
+            ResourceLimitExceeded: 如果资源使用超出限制
+        """
+        return stream_execution(
+            lambda token, output: self._execute(code, token, output=output).value,
+            self.settings.stream_buffer_size
+        )
+    
+    def execute_many(self, codes: Iterable[str], settings: Optional[SandboxSettings] = None,
+                     ordered: bool = True, max_workers: Optional[int] = None) -> BatchExecution:
+        """批量执行相互独立的代码片段
+        
+        inline 模式受 GIL 限制无法利用多核，批量执行时改用 pool 模式：默认使用进程内共享、
+        大小等于 CPU 核数的进程池；指定其他 max_workers 时为本次批量执行单独启动进程池，
+        全部片段结束后关闭。单个片段失败不影响其他片段。
+        
+        Args:
+            codes: 代码片段
+            settings: 本次批量执行使用的沙箱配置，默认使用当前配置
+            ordered: True 时按输入顺序迭代结果，False 时按完成顺序
+            max_workers: 同时执行的数量，默认等于 CPU 核数
+            
+        Returns:
+            BatchExecution: 可迭代的执行结果，stats 属性提供成功/失败数和吞吐量
+        """
+        settings = settings or self.settings
+        default_workers = os.cpu_count() or 1
+        workers = max_workers or default_workers
+        pool = None
+        if settings.execution_mode == "inline":
+            settings = replace(settings, execution_mode="pool", pool_size=default_workers)
+            if workers != default_workers:
+                # 共享进程池按大小常驻，其他大小只为本次批量执行启动
+                from sandbox.core.pool import WorkerPool
+                pool = WorkerPool(workers)
+        
+        runner = Sandbox(settings, enable_logging=False)
+        runner._worker_pool = pool
+        if self.enable_logging:
+            runner.enable_logging = True
+            runner.logger = self.logger
+        return BatchExecution(runner, codes, ordered, workers, pool)
+    
+    async def execute_async(self, code: str, timeout: Optional[float] = None) -> Any:
+        """异步执行代码
+        
+        同一事件循环中并发执行的数量受 max_concurrency 限制，超出的调用排队等待。
+        调用被取消或超时时会中断正在运行的代码。
+        
+        Args:
+            code: 要执行的代码
+            timeout: 超时时间（秒），默认使用 max_execution_time
+            
+        Returns:
+            Any: 执行结果
+            
+        Raises:
+            SandboxError: 如果执行出错
+            ResourceLimitExceeded: 如果资源使用超出限制或超时
+        """
+        if timeout is None:
+            timeout = self.settings.max_execution_time
+        token = CancelToken()
+        
+        async with self._get_semaphore():
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._get_executor(), self._execute, code, token)
+            try:
+                return (await asyncio.wait_for(future, timeout)).value
+            except asyncio.TimeoutError:
+                token.cancel(ResourceLimitExceeded(f"执行时间超出限制: {timeout:.2f}秒"))
+                raise token.reason
+            except asyncio.CancelledError:
+                token.cancel(SandboxError("执行已取消"))
+                raise
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """获取当前事件循环对应的并发信号量"""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.settings.max_concurrency)
+        return semaphore
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """获取异步执行使用的有界线程池"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.settings.max_concurrency,
+                    thread_name_prefix="sandbox-exec"
+                )
+            return self._executor
+    
+    def _run_code(self, code: str, label: Optional[str] = None,
+                  namespace: Optional[Dict[str, Any]] = None) -> Any:
+        """在当前进程中直接执行代码，不做资源监控
+        
+        Args:
+            code: 要执行的代码
+            label: 替换代码对象的文件名，用于 tracemalloc 按执行归属内存
+            namespace: 会话的持久命名空间（由 new_namespace 创建），为 None 时使用新的命名空间
+            
+        Returns:
+            Any: 代码中 __result__ 变量的值
+        """
+        # 编译（命中缓存时直接复用代码对象），代码缓存持有锁，期间推迟注入的取消异常
+        with cancel_shield():
+            code_obj = get_code_cache().compile(code, self.settings.code_cache_size)
+            if label is not None:
+                code_obj = relabel(code_obj, label)
+        
+        if namespace is None:
+            # 创建新的命名空间
+            local_vars = {}
+            exec(code_obj, self._globals, local_vars)
+        else:
+            # 会话命名空间同时作为全局变量，之前定义的函数可以访问之后定义的变量
+            local_vars = namespace
+            local_vars.pop('__result__', None)
+            exec(code_obj, local_vars)
+        
+        # 返回结果
+        return local_vars.get('__result__')
+    
+    def new_namespace(self) -> Dict[str, Any]:
+        """创建会话使用的持久命名空间
+        
+        Returns:
+            Dict[str, Any]: 只包含受限内置函数的命名空间
+        """
+        return dict(self._globals)
+    
     def cleanup(self) -> None:
         """清理资源"""
-        if self._monitor_thread and self._monitor_thread.is_alive():
-            self._stop_monitor.set()
-            self._monitor_thread.join()
         self._process = None
-        self._monitor_thread = None
\ No newline at end of file
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""
+沙箱会话模块
+在多次执行之间保留命名空间，空闲超时的会话由后台线程回收
+"""
+
+import gc
+import threading
+import time
+import uuid
+import weakref
+from typing import Any, List, Optional
+
+from sandbox.config.settings import SandboxSettings
+from sandbox.core.accounting import ExecutionResult
+from sandbox.core.sandbox import Sandbox
+from sandbox.exceptions import SessionClosed
+
+
+class SandboxSession:
+    """持久化命名空间的沙箱会话
+
+    同一会话中的多次执行共享变量、函数和已导入的模块，每次执行仍受相同的资源限制。
+    会话总是在当前进程中执行，同一时刻只执行一段代码。
+    """
+
+    def __init__(self, settings: Optional[SandboxSettings] = None, enable_logging: bool = True,
+                 idle_timeout: Optional[float] = None):
+        """
+        Args:
+            settings: 沙箱配置，如果为 None 则使用默认配置
+            enable_logging: 是否启用安全日志记录
+            idle_timeout: 空闲超时（秒），默认使用 settings.session_idle_timeout，0 表示不回收
+        """
+        self.settings = settings or SandboxSettings()
+        self.session_id = str(uuid.uuid4())
+        self.idle_timeout = self.settings.session_idle_timeout if idle_timeout is None else idle_timeout
+        self.last_used = time.monotonic()
+        self._sandbox = Sandbox(self.settings, enable_logging)
+        self._namespace = self._sandbox.new_namespace()
+        self._lock = threading.Lock()
+        self._closed_reason: Optional[str] = None
+
+        if self.idle_timeout > 0:
+            _reaper.add(self)
+
+    @property
+    def closed(self) -> bool:
+        """会话是否已关闭或被回收"""
+        return self._closed_reason is not None
+
+    @property
+    def idle_time(self) -> float:
+        """距上次执行结束的时间（秒）"""
+        return time.monotonic() - self.last_used
+
+    def execute(self, code: str) -> Any:
+        """在会话命名空间中执行代码
+
+        Args:
+            code: 要执行的代码
+
+        Returns:
+            Any: 执行结果
+
+        Raises:
+            SessionClosed: 会话已关闭或已被回收
+            SandboxError: 如果执行出错
+            ResourceLimitExceeded: 如果资源使用超出限制
+        """
+        return self.run(code).value
+
+    def run(self, code: str) -> ExecutionResult:
+        """在会话命名空间中执行代码并返回包含资源使用情况的结果
+
+        Args:
+            code: 要执行的代码
+
+        Returns:
+            ExecutionResult: 执行结果
+
+        Raises:
+            SessionClosed: 会话已关闭或已被回收
+            SandboxError: 如果执行出错
+            ResourceLimitExceeded: 如果资源使用超出限制
+        """
+        with self._lock:
+            if self._closed_reason is not None:
+                raise SessionClosed(self._closed_reason)
+            try:
+                return self._sandbox._execute(code, namespace=self._namespace)
+            finally:
+                self.last_used = time.monotonic()
+
+    def variables(self) -> List[str]:
+        """会话中已定义的变量名
+
+        Returns:
+            List[str]: 不含内置项和双下划线名称的变量名
+        """
+        with self._lock:
+            return sorted(name for name in self._namespace if not name.startswith('__'))
+
+    def reset(self) -> None:
+        """清空会话中的变量，会话可继续使用"""
+        with self._lock:
+            if self._closed_reason is not None:
+                raise SessionClosed(self._closed_reason)
+            self._namespace = self._sandbox.new_namespace()
+            self.last_used = time.monotonic()
+        gc.collect()
+
+    def close(self) -> None:
+        """关闭会话并释放命名空间"""
+        with self._lock:
+            self._release("会话已关闭")
+
+    def evict_if_idle(self) -> bool:
+        """空闲超时时回收会话，正在执行时跳过
+
+        Returns:
+            bool: 是否已回收
+        """
+        if self.idle_timeout <= 0 or not self._lock.acquire(blocking=False):
+            return False
+        try:
+            if self._closed_reason is not None or self.idle_time < self.idle_timeout:
+                return False
+            self._release(f"会话空闲超过 {self.idle_timeout} 秒，已被回收")
+            return True
+        finally:
+            self._lock.release()
+
+    def _release(self, reason: str) -> None:
+        if self._closed_reason is not None:
+            return
+        self._closed_reason = reason
+        self._namespace = {}
+        self._sandbox.cleanup()
+        _reaper.discard(self)
+
+    def __enter__(self) -> "SandboxSession":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+class _SessionReaper:
+    """回收空闲会话的后台线程，没有会话时自动退出"""
+
+    def __init__(self):
+        self._sessions: "weakref.WeakSet[SandboxSession]" = weakref.WeakSet()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, session: SandboxSession) -> None:
+        with self._cond:
+            self._sessions.add(session)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sandbox-session-reaper", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def discard(self, session: SandboxSession) -> None:
+        with self._cond:
+            self._sessions.discard(session)
+
+    def _next_wait(self) -> Optional[float]:
+        """距最早一个会话超时的时间，没有会话时返回 None"""
+        waits = [max(session.idle_timeout - session.idle_time, 0.0) for session in list(self._sessions)]
+        return min(waits) if waits else None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                wait = self._next_wait()
+                if wait is None:
+                    self._thread = None
+                    return
+                # 会话可能在等待期间被使用，醒来后重新计算
+                self._cond.wait(max(wait, 0.05))
+                sessions = list(self._sessions)
+            evicted = [session for session in sessions if session.evict_if_idle()]
+            del sessions
+            if evicted:
+                del evicted
+                gc.collect()
+
+
+_reaper = _SessionReaper()
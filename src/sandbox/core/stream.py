@@ -0,0 +1,154 @@
+"""
+输出流模块
+把沙箱代码中 print 的输出转发给调用方，execute_stream 通过有界缓冲区逐块返回
+"""
+
+import queue
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional
+
+from sandbox.core.cancel import CancelToken, cancel_shield, current_token
+from sandbox.exceptions import SandboxError
+
+# 输出块类型
+STDOUT = "stdout"
+STDERR = "stderr"
+RESULT = "result"  # 最后一块，data 为 __result__ 的值
+
+OutputSink = Callable[[str, str], None]
+
+# 当前线程（上下文）中执行的代码的输出去向，为 None 时 print 输出到宿主控制台
+_current_sink: ContextVar[Optional[OutputSink]] = ContextVar("sandbox_output_sink", default=None)
+
+
+@dataclass
+class StreamChunk:
+    """execute_stream 返回的输出块"""
+    kind: str  # stdout / stderr / result
+    data: Any
+
+
+@contextmanager
+def capture_output(sink: Optional[OutputSink]):
+    """在上下文内把沙箱代码的 print 输出交给 sink
+
+    Args:
+        sink: 接收 (类型, 文本) 的回调，为 None 时不改变输出去向
+    """
+    if sink is None:
+        yield
+        return
+    reset_token = _current_sink.set(sink)
+    try:
+        yield
+    finally:
+        _current_sink.reset(reset_token)
+
+
+def sandbox_print(*args, sep: Optional[str] = ' ', end: Optional[str] = '\n', file=None, flush: bool = False) -> None:
+    """沙箱内使用的 print，输出被捕获时写入当前 sink
+
+    sink 通常会获取锁（队列、事件日志），调用期间推迟注入的取消异常。
+    """
+    sink = _current_sink.get()
+    if sink is None or file is not None:
+        print(*args, sep=sep, end=end, file=file, flush=flush)
+        return
+    sep = ' ' if sep is None else sep
+    end = '\n' if end is None else end
+    text = sep.join(str(arg) for arg in args) + end
+    with cancel_shield():
+        sink(STDOUT, text)
+
+
+class OutputStream:
+    """执行线程与调用方之间的有界输出缓冲区
+
+    缓冲区满时写入方阻塞（背压），沙箱代码随之暂停；阻塞时间计入执行时间，
+    调用方长时间不读取会触发超时。写入方在屏蔽取消异常的状态下调用，以短超时轮询，
+    执行被取消时放弃写入，退出屏蔽时抛出取消异常。
+    """
+
+    _ERROR = "error"
+
+    def __init__(self, maxsize: int):
+        """
+        Args:
+            maxsize: 缓冲区最多容纳的输出块数
+        """
+        self._queue: "queue.Queue[StreamChunk]" = queue.Queue(maxsize=max(maxsize, 1))
+        self._closed = False
+        self.finished = False
+
+    def write(self, kind: str, data: Any) -> None:
+        """写入一个输出块，缓冲区满时阻塞直到调用方读取或流被关闭"""
+        chunk = StreamChunk(kind, data)
+        token = current_token()
+        while not self._closed and not (token is not None and token.cancelled):
+            try:
+                self._queue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self, result: Any) -> None:
+        """写入最终结果"""
+        self.write(RESULT, result)
+
+    def fail(self, error: BaseException) -> None:
+        """写入错误信息，调用方读到后抛出该异常"""
+        self.write(STDERR, f"{type(error).__name__}: {error}\n")
+        self.write(self._ERROR, error)
+
+    def close(self) -> None:
+        """关闭流并丢弃未读取的输出，解除写入方的阻塞"""
+        self._closed = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def __iter__(self) -> Iterator[StreamChunk]:
+        while True:
+            chunk = self._queue.get()
+            if chunk.kind == self._ERROR:
+                self.finished = True
+                raise chunk.data
+            yield chunk
+            if chunk.kind == RESULT:
+                self.finished = True
+                return
+
+
+def stream_execution(execute: Callable[[CancelToken, OutputSink], Any], buffer_size: int) -> Iterator[StreamChunk]:
+    """在后台线程中执行并逐块返回输出，供各执行后端的 execute_stream 使用
+
+    Args:
+        execute: 以 (取消令牌, 输出回调) 调用、返回 __result__ 的执行函数
+        buffer_size: 输出缓冲区的块数
+
+    Yields:
+        StreamChunk: stdout / stderr / result 输出块；提前停止迭代会取消执行
+    """
+    stream = OutputStream(buffer_size)
+    token = CancelToken()
+
+    def produce() -> None:
+        try:
+            result = execute(token, stream.write)
+        except BaseException as e:
+            stream.fail(e)
+        else:
+            stream.finish(result)
+
+    threading.Thread(target=produce, name="sandbox-stream", daemon=True).start()
+    try:
+        yield from stream
+    finally:
+        if not stream.finished:
+            token.cancel(SandboxError("执行已取消"))
+            stream.close()
@@ -0,0 +1,490 @@
+"""
+Zygote 预加载进程模块
+Zygote 进程预先导入允许的模块并冻结堆，每次执行从它 fork 出写时复制的子进程
+
+子进程中运行的是不可信代码，输出和结果以 JSON 消息（见 sandbox.docker.protocol）写入主进程创建的结果管道。
+管道的写端随任务交给 zygote，由子进程继承，zygote 自己不持有读端，也不解析子进程发出的任何数据，
+只通过退出管道得知子进程结束并回报退出状态。
+"""
+
+import atexit
+import dataclasses
+import functools
+import gc
+import itertools
+import os
+import signal
+import threading
+import time
+from multiprocessing.connection import wait
+from multiprocessing.reduction import recv_handle, send_handle
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psutil
+
+from sandbox.config.settings import SandboxSettings
+from sandbox.core.accounting import ProcessSampler, ResourceUsage, WorkerMeter, track_imports
+from sandbox.core.cancel import CancelToken
+from sandbox.core.isolation import format_isolation, isolate, probe_isolation
+from sandbox.core.limits import (
+    ENFORCEMENT_CGROUP, ENFORCEMENT_RLIMIT, Cgroup, describe_exit,
+    is_kernel_enforced, memory_breach_message, process_limits, timeout_message
+)
+from sandbox.core.monitor import MonitoredExecution, get_monitor
+from sandbox.core.pool import _mp_context, _unpack_reply
+from sandbox.core.stream import OutputSink, capture_output
+from sandbox.docker.protocol import FrameDecoder, ProtocolError, encode, write_message
+from sandbox.exceptions import SandboxError, ResourceLimitExceeded
+
+# 有提前关闭退出管道的子进程时，检查其是否退出的间隔（秒）
+LINGER_INTERVAL = 0.05
+
+
+def _preload(modules: List[str]) -> List[Dict[str, Any]]:
+    """逐个导入模块并记录耗时和内存增量
+
+    Args:
+        modules: 要预加载的模块名列表
+
+    Returns:
+        List[Dict[str, Any]]: 每个模块的预加载记录
+    """
+    process = psutil.Process()
+    report = []
+    for name in modules:
+        rss_before = process.memory_info().rss
+        start = time.perf_counter()
+        error = None
+        try:
+            __import__(name)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        report.append({
+            'module': name,
+            'import_ms': (time.perf_counter() - start) * 1000,
+            'memory_mb': (process.memory_info().rss - rss_before) / 1024 / 1024,
+            'error': error
+        })
+    return report
+
+
+def _child_settings(settings: SandboxSettings) -> SandboxSettings:
+    """cgroup 模式下把子进程移入独立子组，不可用时回退到 rlimit"""
+    if settings.enforcement != ENFORCEMENT_CGROUP:
+        return settings
+    cgroup = Cgroup.create(settings.cgroup_root, f"zygote-{os.getpid()}")
+    if cgroup is not None:
+        try:
+            cgroup.configure(settings.max_memory_mb * 1024 * 1024, settings.max_cpu_percent)
+            cgroup.attach(os.getpid())
+            return settings
+        except OSError:
+            cgroup.remove()
+    return dataclasses.replace(settings, enforcement=ENFORCEMENT_RLIMIT)
+
+
+def _run_child(sandbox, code: str, settings: SandboxSettings, result_fd: int, stream: bool) -> None:
+    """在 fork 出的子进程中执行代码，把隔离报告、捕获的输出和结果以 JSON 消息写入结果管道
+
+    消息：{"type": "isolation", "report"}、{"type": "output", "kind", "data"}、
+    {"type": "result", "result", "usage", "imported_modules"} 或 {"type": "error", "error_type", "error"}
+    """
+    with os.fdopen(result_fd, 'wb') as out:
+        # 输出在产生时写入结果管道，主进程读取缓慢时管道写满即形成背压
+        sink = None
+        if stream:
+            sink = lambda kind, data: write_message(out, {"type": "output", "kind": kind, "data": data})
+        try:
+            settings = _child_settings(settings)
+            if settings.execution_mode == "isolated":
+                write_message(out, {"type": "isolation", "report": isolate(settings.isolation_tmpfs_mb)})
+            sandbox.update_settings(settings)
+            meter = WorkerMeter()
+            with process_limits(settings), capture_output(sink), track_imports() as imported:
+                result = sandbox._run_code(code)
+            usage = meter.finish()
+            reply = {"type": "result", "result": result, "usage": usage, "imported_modules": sorted(imported)}
+        except MemoryError:
+            reply = {"type": "error", "error_type": ResourceLimitExceeded.__name__,
+                     "error": memory_breach_message(settings)}
+        except BaseException as e:
+            reply = {"type": "error", "error_type": type(e).__name__, "error": str(e)}
+        try:
+            data = encode(reply)
+        except Exception:
+            # 例如循环引用，整体回传 repr
+            data = encode(dict(reply, result=repr(reply.get('result'))))
+        out.write(data)
+
+
+def _close_inherited_fds(*keep: int) -> None:
+    """在子进程中关闭从 zygote 继承的文件描述符，只保留标准输入输出和 keep
+
+    包括 zygote 与主进程通信的管道、其他子进程的退出管道等，沙箱代码无法借助它们向 zygote 或主进程发送数据
+    """
+    fd = 3
+    for kept in sorted(keep):
+        os.closerange(fd, kept)
+        fd = kept + 1
+    os.closerange(fd, os.sysconf("SC_OPEN_MAX"))
+
+
+def _child_exit_reply(pid: int, status: int, settings: SandboxSettings) -> Dict[str, str]:
+    """子进程未写回结果就退出时，根据退出状态生成 error 消息"""
+    exitcode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    oom_killed = False
+    if settings.enforcement == ENFORCEMENT_CGROUP:
+        oom_killed = Cgroup(os.path.join(settings.cgroup_root, f"zygote-{pid}")).oom_kills() > 0
+    breach = describe_exit(exitcode, oom_killed)
+    if breach:
+        return {"type": "error", "error_type": ResourceLimitExceeded.__name__, "error": breach}
+    return {"type": "error", "error_type": SandboxError.__name__, "error": "子进程异常退出"}
+
+
+def _zygote_main(conn, modules: List[str]) -> None:
+    """Zygote 进程主循环
+
+    Args:
+        conn: 与主进程通信的管道端点
+        modules: 需要预加载的模块
+    """
+    from sandbox.core.sandbox import Sandbox
+
+    report = _preload(modules)
+    # 在当前内核和权限下试一次隔离，isolated 模式的子进程能生效的步骤与此相同
+    isolation = probe_isolation(SandboxSettings().isolation_tmpfs_mb)
+    sandbox = Sandbox(SandboxSettings(allowed_modules=list(modules)), enable_logging=False)
+    gc.collect()
+    gc.freeze()
+    conn.send(("ready", report, isolation))
+
+    # 退出管道读端 -> (任务ID, 子进程PID, 沙箱配置)。子进程持有写端，退出时 zygote 读到 EOF
+    children: Dict[int, Tuple[int, int, SandboxSettings]] = {}
+    # 提前关闭了退出管道、仍在运行的子进程：PID -> (任务ID, 沙箱配置)，定期回收
+    lingering: Dict[int, Tuple[int, SandboxSettings]] = {}
+
+    def finish(job_id: int, pid: int, status: int, settings: SandboxSettings) -> None:
+        reply = _child_exit_reply(pid, status, settings)
+        if settings.enforcement == ENFORCEMENT_CGROUP:
+            Cgroup(os.path.join(settings.cgroup_root, f"zygote-{pid}")).remove()
+        conn.send(("done", job_id, reply))
+
+    while True:
+        for ready in wait([conn] + list(children), LINGER_INTERVAL if lingering else None):
+            if ready is conn:
+                try:
+                    message = conn.recv()
+                    if message is not None:
+                        result_fd = recv_handle(conn)
+                except EOFError:
+                    message = None
+                if message is None:
+                    for pid in [child[1] for child in children.values()] + list(lingering):
+                        _kill(pid)
+                    return
+
+                job_id, code, settings, stream = message
+                exit_read, exit_write = os.pipe()
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        _close_inherited_fds(result_fd, exit_write)
+                        _run_child(sandbox, code, settings, result_fd, stream)
+                    finally:
+                        os._exit(0)
+                os.close(result_fd)
+                os.close(exit_write)
+                children[exit_read] = (job_id, pid, settings)
+                conn.send(("started", job_id, pid))
+                continue
+
+            # 子进程不应写入退出管道，读到的数据直接丢弃
+            if os.read(ready, 65536):
+                continue
+            job_id, pid, settings = children.pop(ready)
+            os.close(ready)
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                finish(job_id, pid, status, settings)
+            else:
+                lingering[pid] = (job_id, settings)
+
+        for pid, (job_id, settings) in list(lingering.items()):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                del lingering[pid]
+                finish(job_id, pid, status, settings)
+
+
+def _kill(pid: int) -> None:
+    """强制终止子进程"""
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class _Job:
+    """主进程侧的任务状态"""
+
+    def __init__(self, output: Optional[OutputSink],
+                 on_isolation: Optional[Callable[[Dict[str, Any]], None]]):
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.pid: Optional[int] = None
+        self.reply: Optional[Dict[str, Any]] = None  # 子进程写入结果管道的 result / error 消息
+        self.exit_reply: Optional[Dict[str, str]] = None  # zygote 根据子进程退出状态生成的 error 消息
+        self.output = output
+        self.on_isolation = on_isolation
+        self._decoder = FrameDecoder()
+
+    def read(self, read_fd: int, timeout: Optional[float] = None) -> bool:
+        """读取结果管道并处理子进程发来的消息，直到管道关闭（子进程退出）
+
+        输出在读到时交给 output，主进程读取缓慢时子进程阻塞在管道写入处。
+
+        Args:
+            read_fd: 结果管道读端
+            timeout: 超时时间（秒），None 表示一直等待
+
+        Returns:
+            bool: 管道是否已关闭，超时返回 False
+
+        Raises:
+            ProtocolError: 子进程发来的消息无效
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is not None and not wait([read_fd], max(deadline - time.monotonic(), 0)):
+                return False
+            data = os.read(read_fd, 65536)
+            if not data:
+                return True
+            for message in self._decoder.feed(data):
+                kind = message.get('type')
+                if kind == "output":
+                    if self.output is not None:
+                        self.output(str(message.get('kind')), str(message.get('data')))
+                elif kind == "isolation":
+                    if self.on_isolation is not None and isinstance(message.get('report'), dict):
+                        self.on_isolation(message['report'])
+                elif kind in ("result", "error"):
+                    self.reply = message
+
+
+class ZygoteServer:
+    """Zygote 进程管理类"""
+
+    def __init__(self, modules: List[str]):
+        """启动 zygote 进程并等待模块预加载完成
+
+        Args:
+            modules: 需要预加载的模块
+        """
+        self.modules = list(modules)
+        self._jobs: Dict[int, _Job] = {}
+        self._ids = itertools.count()
+        self._send_lock = threading.Lock()
+
+        ctx = _mp_context()
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_zygote_main, args=(child_conn, self.modules), daemon=True)
+        self._process.start()
+        child_conn.close()
+
+        message = self._conn.recv()
+        self.startup_report: List[Dict[str, Any]] = message[1]
+        # isolated 模式下各隔离步骤在当前环境中是否可用，同 probe_isolation 的返回值
+        self.isolation_report: Dict[str, Any] = message[2]
+
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    @property
+    def alive(self) -> bool:
+        """zygote 进程是否仍在运行"""
+        return self._process.is_alive() and self._reader.is_alive()
+
+    def _read_loop(self) -> None:
+        """接收 zygote 消息并分发给对应任务"""
+        while True:
+            try:
+                kind, job_id, payload = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            if kind == "started":
+                job.pid = payload
+                job.started.set()
+            else:
+                job.exit_reply = payload
+                job.started.set()
+                job.done.set()
+
+        # zygote 退出后让所有等待中的任务失败
+        for job in list(self._jobs.values()):
+            job.started.set()
+            job.done.set()
+
+    def execute(self, code: str, settings: SandboxSettings, token: Optional[CancelToken] = None,
+                output: Optional[OutputSink] = None,
+                on_isolation: Optional[Callable[[Dict[str, Any]], None]] = None) -> Tuple[Any, ResourceUsage]:
+        """从 zygote fork 子进程执行代码
+
+        Args:
+            code: 要执行的代码
+            settings: 沙箱配置
+            token: 取消令牌，取消时终止子进程
+            output: 接收 print 输出的回调，子进程的输出在产生时经结果管道逐块转发，
+                为 None 时输出到子进程的控制台
+            on_isolation: 接收隔离报告的回调，isolated 模式的子进程完成隔离后调用（执行失败时也调用），
+                参数同 isolate 的返回值
+
+        Returns:
+            Tuple[Any, ResourceUsage]: 执行结果和子进程的资源使用情况
+
+        Raises:
+            ResourceLimitExceeded: 资源使用超出限制（子进程会被终止）
+            WorkerError: 代码执行出错
+            SandboxError: zygote 进程异常
+        """
+        if token is not None:
+            token.raise_if_cancelled()
+        job_id = next(self._ids)
+        job = self._jobs[job_id] = _Job(output, on_isolation)
+        kill = None
+        peak_memory_mb = 0.0
+        start = time.monotonic()
+        read_fd, write_fd = os.pipe()
+        try:
+            try:
+                with self._send_lock:
+                    self._conn.send((job_id, code, settings, output is not None))
+                    send_handle(self._conn, write_fd, self._process.pid)
+            finally:
+                os.close(write_fd)
+            job.started.wait()
+            if job.pid is None:
+                raise SandboxError("zygote 进程异常退出")
+            if token is not None:
+                kill = functools.partial(_kill, job.pid)
+                token.add_callback(kill)
+
+            try:
+                if is_kernel_enforced(settings):
+                    # 内存和 CPU 由内核限制，这里只等待墙钟超时
+                    if not job.read(read_fd, settings.max_execution_time):
+                        _kill(job.pid)
+                        raise ResourceLimitExceeded(timeout_message(settings))
+                else:
+                    peak_memory_mb = self._supervise(job, settings, read_fd)
+            except ProtocolError:
+                _kill(job.pid)
+                raise SandboxError("子进程发来的执行结果无效")
+        finally:
+            os.close(read_fd)
+            if kill is not None:
+                token.remove_callback(kill)
+
+        try:
+            if token is not None:
+                token.raise_if_cancelled()
+            reply = job.reply
+            if reply is None:
+                # 子进程未写回结果就退出，由 zygote 回报退出状态
+                job.done.wait()
+                reply = job.exit_reply
+            if reply is None:
+                raise SandboxError("zygote 进程异常退出")
+        finally:
+            self._jobs.pop(job_id, None)
+        return _unpack_reply(reply, start, peak_memory_mb)
+
+    def _supervise(self, job: _Job, settings: SandboxSettings, read_fd: int) -> float:
+        """在共享监控服务中登记子进程并读取结果管道直到子进程退出，超限时终止子进程
+
+        Returns:
+            float: 采样到的内存峰值（MB）
+        """
+        try:
+            sampler = ProcessSampler(job.pid)
+            execution = get_monitor().register(MonitoredExecution(
+                sampler,
+                settings,
+                lambda message: _kill(job.pid)
+            ))
+        except psutil.NoSuchProcess:
+            job.read(read_fd)
+            return 0.0
+
+        try:
+            job.read(read_fd)
+        finally:
+            get_monitor().unregister(execution)
+        if execution.breach:
+            raise ResourceLimitExceeded(execution.breach)
+        return sampler.peak_memory_mb
+
+    def format_startup_report(self) -> str:
+        """生成启动延迟报告
+
+        Returns:
+            str: 每个模块预加载节省的导入耗时和共享内存
+        """
+        lines = [f"{'模块':<20}{'导入耗时(ms)':>14}{'共享内存(MB)':>14}"]
+        for item in self.startup_report:
+            if item['error']:
+                lines.append(f"{item['module']:<20}  导入失败: {item['error']}")
+            else:
+                lines.append(f"{item['module']:<20}{item['import_ms']:>14.2f}{item['memory_mb']:>14.2f}")
+        total_ms = sum(item['import_ms'] for item in self.startup_report if not item['error'])
+        total_mb = sum(item['memory_mb'] for item in self.startup_report if not item['error'])
+        lines.append(f"{'合计（每次执行节省）':<20}{total_ms:>14.2f}{total_mb:>14.2f}")
+        lines.append(f"isolated 模式: {format_isolation(self.isolation_report)}")
+        return "\n".join(lines)
+
+    def shutdown(self) -> None:
+        """关闭 zygote 进程"""
+        try:
+            with self._send_lock:
+                self._conn.send(None)
+            self._process.join(timeout=1.0)
+        except Exception:
+            pass
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join(timeout=1.0)
+        self._conn.close()
+
+
+_zygotes: Dict[Tuple[str, ...], ZygoteServer] = {}
+_zygotes_lock = threading.Lock()
+
+
+def get_zygote(modules: List[str]) -> ZygoteServer:
+    """获取预加载了指定模块的共享 zygote 进程
+
+    Args:
+        modules: 需要预加载的模块
+
+    Returns:
+        ZygoteServer: 对应模块集合的 zygote，已退出时自动重启
+    """
+    key = tuple(sorted(set(modules)))
+    with _zygotes_lock:
+        zygote = _zygotes.get(key)
+        if zygote is None or not zygote.alive:
+            zygote = _zygotes[key] = ZygoteServer(list(key))
+        return zygote
+
+
+@atexit.register
+def shutdown_zygotes() -> None:
+    """关闭全部共享 zygote 进程"""
+    with _zygotes_lock:
+        zygotes = list(_zygotes.values())
+        _zygotes.clear()
+    for zygote in zygotes:
+        zygote.shutdown()
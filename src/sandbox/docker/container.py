@@ -0,0 +1,246 @@
+"""
+Docker 执行器容器模块
+启动运行 sandbox.docker.executor 执行循环的容器，通过附加的标准输入输出按帧协议交换任务
+"""
+
+import socket
+import struct
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from sandbox.config.settings import SandboxSettings
+from sandbox.core.accounting import ResourceUsage, record_imports
+from sandbox.core.cancel import CancelToken
+from sandbox.core.stream import OutputSink
+from sandbox.docker.protocol import FrameDecoder, ProtocolError, encode
+from sandbox.docker.stats import ContainerStats, SampleCallback
+from sandbox.exceptions import SandboxError, ResourceLimitExceeded
+
+# 容器内 Python 启动和 sandbox 导入的最长等待时间（秒）
+STARTUP_TIMEOUT = 30.0
+# 健康检查等待 pong 的时间（秒）
+PING_TIMEOUT = 5.0
+# 等待结果时在 max_execution_time 之外预留的时间（秒）
+RESULT_GRACE = 2.0
+
+SERVE_COMMAND = ["python", "-c", "from sandbox.docker.executor import serve; serve()"]
+
+_STDOUT = 1
+
+
+class ContainerStartError(SandboxError):
+    """容器无法启动，代码尚未开始执行，可以换到其他节点重试"""
+    pass
+
+
+class _AttachedStream:
+    """附加到容器标准输入输出的消息流
+
+    未分配 TTY 时 Docker 会把标准输出和标准错误复用在同一连接上，每帧带 8 字节头
+    （流类型 + 长度）。这里先拆出标准输出，再按协议解出消息。
+    """
+
+    def __init__(self, container):
+        self._socket = container.attach_socket(params={'stdin': 1, 'stdout': 1, 'stream': 1})
+        self._sock = getattr(self._socket, '_sock', self._socket)
+        self._raw = b""
+        self._decoder = FrameDecoder()
+        self._messages = []
+
+    def send(self, message: Dict[str, Any]) -> None:
+        self._sock.sendall(encode(message))
+
+    def receive(self, deadline: float) -> Dict[str, Any]:
+        """读取一条消息
+
+        Args:
+            deadline: time.monotonic() 截止时间
+
+        Raises:
+            TimeoutError: 超时
+            EOFError: 容器已退出
+        """
+        while not self._messages:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError()
+            self._sock.settimeout(remaining)
+            try:
+                data = self._sock.recv(65536)
+            except socket.timeout:
+                raise TimeoutError()
+            if not data:
+                raise EOFError()
+            self._raw += data
+            while len(self._raw) >= 8:
+                stream_type, size = struct.unpack(">BxxxL", self._raw[:8])
+                if len(self._raw) < 8 + size:
+                    break
+                if stream_type == _STDOUT:
+                    self._messages.extend(self._decoder.feed(self._raw[8:8 + size]))
+                self._raw = self._raw[8 + size:]
+        return self._messages.pop(0)
+
+    def close(self) -> None:
+        try:
+            self._socket.close()
+        except Exception:
+            pass
+
+
+class ExecutorContainer:
+    """运行执行循环的容器，可连续执行多个任务"""
+
+    def __init__(self, client, image: str, settings: SandboxSettings):
+        """启动容器并等待执行循环就绪
+
+        Args:
+            client: Docker 客户端
+            image: 容器镜像
+            settings: 沙箱配置，提供容器级的资源限制
+
+        Raises:
+            ContainerStartError: 容器启动失败
+        """
+        self.executions = 0
+        self.healthy = True
+        try:
+            self.container = client.containers.run(
+                image=image,
+                command=SERVE_COMMAND,
+                mem_limit=f"{settings.max_memory_mb + 50}m",  # 添加额外的内存供容器本身使用
+                cpu_period=100000,
+                cpu_quota=int(100000 * settings.max_cpu_percent / 100),
+                detach=True,
+                stdin_open=True,
+                network_mode="none" if not settings.network_access else "bridge"
+            )
+        except Exception as e:
+            raise ContainerStartError(f"Docker容器启动失败: {e}")
+        self.stream = None
+        try:
+            self.stream = _AttachedStream(self.container)
+            if not self.ping(STARTUP_TIMEOUT):
+                raise ContainerStartError("Docker容器启动失败: 执行循环无响应")
+        except ContainerStartError:
+            self.remove()
+            raise
+        except Exception as e:
+            self.remove()
+            raise ContainerStartError(f"Docker容器启动失败: {e}")
+        self.stats = ContainerStats(self.container) if settings.docker_stats else None
+
+    def ping(self, timeout: float = PING_TIMEOUT) -> bool:
+        """健康检查：执行循环能否在超时内响应
+
+        Returns:
+            bool: 是否健康
+        """
+        try:
+            self.stream.send({"type": "ping"})
+            return self.stream.receive(time.monotonic() + timeout).get('type') == "pong"
+        except (TimeoutError, EOFError, OSError, ProtocolError):
+            self.healthy = False
+            return False
+
+    def run(self, code: str, settings: SandboxSettings, token: Optional[CancelToken] = None,
+            output: Optional[OutputSink] = None,
+            on_sample: Optional[SampleCallback] = None) -> Tuple[Any, ResourceUsage]:
+        """在容器中执行一个任务
+
+        执行超时、容器退出或资源超限后 healthy 置为 False，调用方应删除容器。
+
+        Args:
+            code: 要执行的代码
+            settings: 沙箱配置
+            token: 取消令牌，取消时终止容器
+            output: 接收 print 输出的回调
+            on_sample: 接收容器资源采样点的回调（docker_stats 启用时）
+
+        Returns:
+            Tuple[Any, ResourceUsage]: 执行结果和由容器统计得到的资源使用
+
+        Raises:
+            ResourceLimitExceeded: 资源使用超出限制
+            SandboxError: 代码执行出错或容器异常退出
+        """
+        if self.stats is None:
+            started = time.monotonic()
+            value = self._run(code, settings, token, output)
+            return value, ResourceUsage(wall_time=time.monotonic() - started)
+        with self.stats.record(on_sample) as recorder:
+            value = self._run(code, settings, token, output)
+        return value, recorder.usage()
+
+    def _run(self, code: str, settings: SandboxSettings, token: Optional[CancelToken],
+             output: Optional[OutputSink]) -> Any:
+        job_id = str(uuid.uuid4())
+        deadline = time.monotonic() + settings.max_execution_time + RESULT_GRACE
+        if token is not None:
+            token.add_callback(self.kill)
+        try:
+            self.stream.send({
+                "type": "job",
+                "id": job_id,
+                "code": code,
+                "settings": settings.__dict__,
+                "stream": output is not None
+            })
+            while True:
+                message = self.stream.receive(deadline)
+                if message.get('id') != job_id:
+                    continue
+                if message['type'] == "output":
+                    if output is not None:
+                        output(message['kind'], message['data'])
+                    continue
+                break
+        except TimeoutError:
+            self.healthy = False
+            self.kill()
+            raise ResourceLimitExceeded(f"执行时间超出限制: 超过 {settings.max_execution_time}秒")
+        except (EOFError, OSError, ProtocolError):
+            self.healthy = False
+            if token is not None:
+                token.raise_if_cancelled()
+            if self.oom_killed():
+                raise ResourceLimitExceeded("内存使用超出限制: 容器内存耗尽")
+            raise SandboxError("Docker容器异常退出")
+        finally:
+            if token is not None:
+                token.remove_callback(self.kill)
+            self.executions += 1
+
+        if message['type'] == "error":
+            if message.get('error_type') == ResourceLimitExceeded.__name__:
+                # 容器内的监控已判定超限，进程状态不再可信
+                self.healthy = False
+                raise ResourceLimitExceeded(message['error'])
+            raise SandboxError(message['error'])
+        record_imports(message.get('imported_modules', ()))
+        return message.get('result')
+
+    def oom_killed(self) -> bool:
+        """容器是否因内存耗尽被终止"""
+        try:
+            self.container.reload()
+            return bool(self.container.attrs['State'].get('OOMKilled'))
+        except Exception:
+            return False
+
+    def kill(self) -> None:
+        """强制终止容器"""
+        try:
+            self.container.kill()
+        except Exception:
+            pass
+
+    def remove(self) -> None:
+        """终止并删除容器"""
+        if self.stream is not None:
+            self.stream.close()
+        try:
+            self.container.remove(force=True)
+        except Exception:
+            pass
@@ -0,0 +1,215 @@
+"""
+异步调度模块
+在事件循环中按优先级和提交顺序（同一优先级内 FIFO）调度执行任务，同时执行的任务数有上限，调用方得到 asyncio.Future
+"""
+
+import asyncio
+from collections import defaultdict, deque
+from concurrent.futures import Executor
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from sandbox.core.cancel import CancelToken
+from sandbox.exceptions import SandboxError, ResourceLimitExceeded
+
+# 以 (代码, 取消令牌, *submit 的附加参数) 调用的阻塞执行函数，取消令牌被取消时应尽快终止执行并抛出其原因
+RunFunction = Callable[..., Any]
+
+# 排队中的任务：(Future, 代码, 超时时间, 附加参数)
+_Item = Tuple[asyncio.Future, str, float, tuple]
+
+# 执行容器的任务的超时在 max_execution_time 之外为获取和启动容器预留的时间（秒）
+STARTUP_GRACE = 5
+
+
+class AsyncDispatcher:
+    """绑定到一个事件循环的有界调度器
+
+    - 固定数量的 worker 协程从队列中取任务，保证同时执行的任务不超过 max_in_flight
+    - 优先级数值小的任务先执行，同一优先级内按提交顺序；priority_limits 可以限制某个优先级
+      同时执行的任务数，为其他优先级保留名额（例如批量任务占满时交互任务仍能立即开始）
+    - 阻塞的执行函数在线程池中运行；超时或 Future 被取消时通过取消令牌终止执行，
+      并等待执行线程真正结束后才释放名额，被终止的容器不会在后台继续占用资源。
+      设置 cancel_grace 时最多等待这么久：线程内执行的代码可能不响应取消（例如阻塞在
+      time.sleep 中），超出后放弃该线程并释放名额，放弃的线程最多 max_abandoned 个，
+      达到上限后恢复为一直等待，线程池需为它们多留 max_abandoned 个线程
+    - 队列已满时 submit 直接抛出 SandboxError，而不是无限堆积
+    """
+
+    def __init__(self, run: RunFunction, max_in_flight: int, max_queued: int = 0,
+                 executor: Optional[Executor] = None, priority_limits: Optional[Dict[int, int]] = None,
+                 cancel_grace: Optional[float] = None, max_abandoned: int = 0):
+        """
+        Args:
+            run: 阻塞的执行函数
+            max_in_flight: 同时执行的最大任务数
+            max_queued: 排队等待的最大任务数，0 表示不限
+            executor: 运行执行函数的线程池，为 None 时使用事件循环的默认线程池
+            priority_limits: 各优先级同时执行的最大任务数，未列出的优先级只受 max_in_flight 限制
+            cancel_grace: 取消后等待执行线程结束的最长时间（秒），为 None 时一直等待
+            max_abandoned: 最多放弃的（取消后仍在运行的）执行线程数
+        """
+        self._run = run
+        self.max_in_flight = max(max_in_flight, 1)
+        self.max_queued = max(max_queued, 0)
+        self.priority_limits = dict(priority_limits or {})
+        self.cancel_grace = cancel_grace
+        self.max_abandoned = max(max_abandoned, 0)
+        self._abandoned: Set[asyncio.Future] = set()
+        self._executor = executor
+        self._pending: Dict[int, Deque[_Item]] = {}
+        self._running: Dict[int, int] = defaultdict(int)
+        # 队列或执行状态变化时置位；检查与等待之间不会让出事件循环，不会丢失唤醒
+        self._changed = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+        self.in_flight = 0
+
+    @property
+    def abandoned(self) -> int:
+        """已放弃、仍在后台运行的执行线程数"""
+        return len(self._abandoned)
+
+    @property
+    def queued(self) -> int:
+        """排队等待的任务数"""
+        return sum(len(items) for items in self._pending.values())
+
+    def queued_at(self, priority: int) -> int:
+        """某个优先级排队等待的任务数"""
+        return len(self._pending.get(priority, ()))
+
+    def running_at(self, priority: int) -> int:
+        """某个优先级正在执行的任务数"""
+        return self._running[priority]
+
+    def submit(self, code: str, timeout: float, *args: Any, priority: int = 0) -> asyncio.Future:
+        """提交一个任务，必须在事件循环中调用
+
+        Args:
+            code: 要执行的代码
+            timeout: 从开始执行起算的超时时间（秒），排队时间不计入
+            *args: 原样传给执行函数的附加参数
+            priority: 优先级，数值小者先执行
+
+        Returns:
+            asyncio.Future: 执行结果；超时时为 ResourceLimitExceeded，取消 Future 会终止执行
+
+        Raises:
+            SandboxError: 排队的任务数已达上限
+        """
+        loop = asyncio.get_running_loop()
+        if not self._workers:
+            self._workers = [loop.create_task(self._worker()) for _ in range(self.max_in_flight)]
+        if self.max_queued and self.queued >= self.max_queued:
+            raise SandboxError(f"排队的执行任务过多: 已有 {self.queued} 个任务等待")
+        future = loop.create_future()
+        item = (future, code, timeout, args)
+        self._pending.setdefault(priority, deque()).append(item)
+        # 排队中的任务被取消时立即让出队列名额
+        future.add_done_callback(lambda f: f.cancelled() and self._discard(priority, item))
+        self._changed.set()
+        return future
+
+    def _discard(self, priority: int, item: _Item) -> None:
+        items = self._pending.get(priority)
+        if items is not None and item in items:
+            items.remove(item)
+            self._changed.set()
+
+    def _pop(self) -> Optional[Tuple[int, _Item]]:
+        """取出可以开始执行的优先级最高的任务"""
+        for priority in sorted(self._pending):
+            items = self._pending[priority]
+            if items and self._running[priority] < self.priority_limits.get(priority, self.max_in_flight):
+                return priority, items.popleft()
+        return None
+
+    async def _worker(self) -> None:
+        while True:
+            entry = self._pop()
+            if entry is None:
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+            priority, (future, code, timeout, args) = entry
+            if future.done():
+                continue
+            self.in_flight += 1
+            self._running[priority] += 1
+            try:
+                await self._execute(future, code, timeout, args)
+            finally:
+                self.in_flight -= 1
+                self._running[priority] -= 1
+                self._changed.set()
+
+    async def _execute(self, future: asyncio.Future, code: str, timeout: float, args: tuple) -> None:
+        token = CancelToken()
+        on_cancel = lambda f: f.cancelled() and token.cancel(SandboxError("执行已取消"))
+        future.add_done_callback(on_cancel)
+        task = asyncio.get_running_loop().run_in_executor(self._executor, self._run, code, token, *args)
+        try:
+            # 不使用 wait_for：它在任务恰好完成时会吞掉取消，worker 无法随事件循环退出
+            await asyncio.wait([task], timeout=timeout)
+            if not task.done():
+                token.cancel(ResourceLimitExceeded(f"执行时间超出限制: {timeout:.2f}秒"))
+                # 等待执行线程响应取消并结束
+                await self._wait_cancelled(task)
+        except asyncio.CancelledError:
+            # 调度器所在的事件循环正在关闭
+            token.cancel(SandboxError("执行已取消"))
+            raise
+        finally:
+            future.remove_done_callback(on_cancel)
+
+        if future.done():
+            return
+        if not task.done():
+            # 执行线程已被放弃
+            future.set_exception(token.reason)
+            return
+        error = task.exception()
+        if isinstance(token.reason, ResourceLimitExceeded):
+            future.set_exception(token.reason)
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(task.result())
+
+    async def _wait_cancelled(self, task: asyncio.Future) -> None:
+        """等待已取消的执行线程结束，超出 cancel_grace 时放弃该线程"""
+        if self.cancel_grace is None:
+            await asyncio.wait([task])
+            return
+        await asyncio.wait([task], timeout=self.cancel_grace)
+        if task.done():
+            return
+        if len(self._abandoned) < self.max_abandoned:
+            # 线程继续在后台运行到结束，名额交给下一个任务
+            self._abandoned.add(task)
+            task.add_done_callback(self._forget)
+            return
+        await asyncio.wait([task])
+
+    def _forget(self, task: asyncio.Future) -> None:
+        """放弃的执行线程结束，结果已无人等待"""
+        self._abandoned.discard(task)
+        if not task.cancelled():
+            task.exception()
+
+    async def join(self) -> None:
+        """等待队列中的任务全部完成"""
+        while self.queued or self.in_flight:
+            self._changed.clear()
+            await self._changed.wait()
+
+    async def close(self) -> None:
+        """取消排队中的任务并停止 worker，正在执行的任务完成后返回"""
+        for items in list(self._pending.values()):
+            for future, _, _, _ in list(items):
+                future.cancel()
+        self._pending.clear()
+        await self.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
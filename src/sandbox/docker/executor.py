@@ -1,50 +1,89 @@
 """
 Docker容器内代码执行器
+
+入口只导入标准库和通信协议，启动后立即响应消息；沙箱及其依赖（psutil 等）在后台线程中预热，
+最迟在第一个任务到达时加载完成。容器内不创建安全日志，执行记录由主机侧负责。
 """
 
 import os
-import json
 import sys
-import traceback
-from sandbox.core.sandbox import Sandbox
-from sandbox.config.settings import SandboxSettings
+import threading
+from sandbox.docker.protocol import read_message, write_message
+
+# 容器启动到执行循环可响应消息的目标时间（秒）
+STARTUP_BUDGET = 0.05
+
+_sandbox = None
+_sandbox_lock = threading.Lock()
+
+
+def _get_sandbox():
+    """获取复用的沙箱实例，首次调用时导入"""
+    global _sandbox
+    with _sandbox_lock:
+        if _sandbox is None:
+            from sandbox.core.sandbox import Sandbox
+            from sandbox.config.settings import SandboxSettings
+            _sandbox = Sandbox(SandboxSettings(), enable_logging=False)
+        return _sandbox
+
+
+def _run_job(message: dict, send) -> None:
+    """执行一个任务并回写结果或错误
 
-def run_code(execution_id: str) -> None:
-    """在Docker容器内执行代码
-    
     Args:
-        execution_id: 执行ID，用于标识相关文件
+        message: job 消息
+        send: 发送消息的函数
     """
-    # 设置文件路径
-    temp_dir = "/app/temp"
-    code_file = os.path.join(temp_dir, f"{execution_id}.py")
-    settings_file = os.path.join(temp_dir, f"{execution_id}.json")
-    result_file = os.path.join(temp_dir, f"{execution_id}_result.json")
-    
+    job_id = message['id']
+    sink = None
+    if message.get('stream'):
+        sink = lambda kind, data: send({"type": "output", "id": job_id, "kind": kind, "data": data})
+
     try:
-        # 读取代码
-        with open(code_file, 'r') as f:
-            code = f.read()
-        
-        # 读取设置
-        with open(settings_file, 'r') as f:
-            settings_dict = json.load(f)
-            settings = SandboxSettings(**settings_dict)
-        
-        # 创建沙箱并执行代码
-        sandbox = Sandbox(settings, enable_logging=True)
-        result = sandbox.execute(code)
-        
-        # 写入结果
-        with open(result_file, 'w') as f:
-            json.dump({"result": result}, f)
-            
+        from sandbox.config.settings import SandboxSettings
+        sandbox = _get_sandbox()
+        sandbox.update_settings(SandboxSettings(**message['settings']))
+        execution = sandbox._execute(message['code'], output=sink)
+        send({"type": "result", "id": job_id, "result": execution.value,
+              "imported_modules": sorted(execution.imported_modules)})
     except Exception as e:
-        # 捕获异常并写入错误信息
+        import traceback
+        # 捕获异常并回写错误信息
         error_message = f"{type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
-        with open(result_file, 'w') as f:
-            json.dump({"error": error_message}, f)
-        
+        send({"type": "error", "id": job_id, "error_type": type(e).__name__, "error": error_message})
+
         # 打印错误信息
         print(error_message, file=sys.stderr)
-        sys.exit(1)
\ No newline at end of file
+
+
+def serve() -> None:
+    """常驻执行循环
+
+    从标准输入读取带长度前缀的消息，逐个执行任务并通过标准输出回写，
+    标准输入关闭时退出。标准输出只用于协议消息，沙箱代码和其他输出被重定向到标准错误。
+    """
+    protocol_in = sys.stdin.buffer
+    protocol_out = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    lock = threading.Lock()
+
+    def send(message: dict) -> None:
+        with lock:
+            write_message(protocol_out, message)
+
+    threading.Thread(target=_get_sandbox, name="sandbox-warmup", daemon=True).start()
+    while True:
+        message = read_message(protocol_in)
+        if message is None:
+            break
+        if message.get('type') == "ping":
+            send({"type": "pong"})
+        elif message.get('type') == "job":
+            _run_job(message, send)
+
+
+if __name__ == "__main__":
+    serve()
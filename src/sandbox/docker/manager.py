@@ -3,13 +3,20 @@ Docker容器管理模块，用于在Docker容器中执行代码
 """
 
 import docker
-import os
-import tempfile
+import asyncio
+import threading
 import uuid
-import json
-from typing import Dict, Any, Optional
+import weakref
+from dataclasses import fields, replace
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Iterator
 from sandbox.config.settings import SandboxSettings
-from sandbox.exceptions import SandboxError
+from sandbox.core.accounting import ExecutionResult, track_imports
+from sandbox.core.cancel import CancelToken
+from sandbox.core.stream import OutputSink, StreamChunk, stream_execution
+from sandbox.docker.dispatcher import STARTUP_GRACE, AsyncDispatcher
+from sandbox.docker.scheduler import DockerEndpoint, DockerScheduler
+from sandbox.docker.stats import SampleCallback
 
 class DockerSandbox:
     """Docker沙箱容器管理类"""
@@ -21,16 +28,22 @@ class DockerSandbox:
             settings: 沙箱配置，如果为None则使用默认配置
         """
         self.settings = settings or SandboxSettings()
-        self.client = docker.from_env()
         self.image_name = "sandbox-interpreter:latest"
+        if self.settings.docker_endpoints:
+            endpoints = [DockerEndpoint(url, docker.DockerClient(base_url=url))
+                         for url in self.settings.docker_endpoints]
+        else:
+            endpoints = [DockerEndpoint("local", docker.from_env())]
+        self.client = endpoints[0].client
+        self.scheduler = DockerScheduler(endpoints, self.image_name, self.settings)
+        self._dispatchers = weakref.WeakKeyDictionary()
+        self._executor = None
+        self._executor_lock = threading.Lock()
         self._ensure_image_exists()
     
     def _ensure_image_exists(self) -> None:
-        """确保Docker镜像存在"""
-        try:
-            self.client.images.get(self.image_name)
-        except docker.errors.ImageNotFound:
-            raise SandboxError(f"Docker镜像 {self.image_name} 不存在，请先构建镜像")
+        """确保Docker镜像存在，缺少镜像的节点暂不参与调度"""
+        self.scheduler.check_image()
     
     def execute(self, code: str) -> Any:
         """在Docker容器中执行代码
@@ -41,85 +54,118 @@ class DockerSandbox:
         Returns:
             执行结果
         """
-        # 创建临时目录用于文件交换
-        temp_dir = tempfile.mkdtemp()
-        try:
-            # 创建唯一的执行ID
-            execution_id = str(uuid.uuid4())
-            
-            # 准备代码和设置文件
-            code_file = os.path.join(temp_dir, f"{execution_id}.py")
-            settings_file = os.path.join(temp_dir, f"{execution_id}.json")
-            result_file = os.path.join(temp_dir, f"{execution_id}_result.json")
-            
-            # 写入代码文件
-            with open(code_file, 'w') as f:
-                f.write(code)
-            
-            # 写入设置文件
-            with open(settings_file, 'w') as f:
-                json.dump(self.settings.__dict__, f)
-            
-            # 运行Docker容器
-            container = self.client.containers.run(
-                image=self.image_name,
-                command=f"python -c \"from sandbox.docker.executor import run_code; run_code('{execution_id}')\"",
-                volumes={
-                    temp_dir: {'bind': '/app/temp', 'mode': 'rw'}
-                },
-                mem_limit=f"{self.settings.max_memory_mb + 50}m",  # 添加额外的内存供容器本身使用
-                cpu_period=100000,
-                cpu_quota=int(100000 * self.settings.max_cpu_percent / 100),
-                detach=True,
-                network_mode="none" if not self.settings.network_access else "bridge",
-                remove=True
-            )
-            
-            # 等待容器执行完成
-            result = container.wait(timeout=self.settings.max_execution_time + 5)
-            
-            # 检查执行状态
-            if result['StatusCode'] != 0:
-                # 获取容器日志
-                logs = container.logs().decode('utf-8')
-                raise SandboxError(f"Docker容器执行失败: {logs}")
-            
-            # 读取执行结果
-            if os.path.exists(result_file):
-                with open(result_file, 'r') as f:
-                    result_data = json.load(f)
-                    
-                if 'error' in result_data:
-                    raise SandboxError(result_data['error'])
-                    
-                return result_data.get('result')
-            else:
-                raise SandboxError("执行结果文件不存在")
-                
-        finally:
-            # 清理临时文件
-            import shutil
-            shutil.rmtree(temp_dir, ignore_errors=True)
+        return self._execute(code).value
     
-    def execute_async(self, code: str, callback=None):
-        """异步执行代码
+    def run(self, code: str, on_sample: Optional[SampleCallback] = None,
+            settings: Optional[SandboxSettings] = None) -> ExecutionResult:
+        """在Docker容器中执行代码并返回包含容器资源使用情况的结果
         
         Args:
             code: 要执行的代码
-            callback: 执行完成后的回调函数
+            on_sample: 接收容器资源采样点的回调，采样点格式与 Web 界面的 /resource_data 相同
+            settings: 本次执行的设置，见 _execute
+        
+        Returns:
+            ExecutionResult: 执行ID、__result__ 的值及容器的墙钟时间、CPU 时间、内存和 CPU 峰值
+        """
+        return self._execute(code, on_sample=on_sample, settings=settings)
+    
+    def _execute(self, code: str, token: Optional[CancelToken] = None,
+                 output: Optional[OutputSink] = None,
+                 on_sample: Optional[SampleCallback] = None,
+                 settings: Optional[SandboxSettings] = None) -> ExecutionResult:
+        """在Docker容器中执行代码，可通过取消令牌终止容器
+        
+        Args:
+            code: 要执行的代码
+            token: 取消令牌，取消时强制终止容器
+            output: 接收 print 输出的回调
+            on_sample: 接收容器资源采样点的回调
+            settings: 本次执行的资源限制、模块白名单等设置，默认使用创建时的设置；
+                其中 docker_ 开头的项（节点、容器池、stats 等）总是使用创建时的设置
+        
+        Returns:
+            ExecutionResult: 执行结果
         """
-        import threading
+        if token is not None:
+            token.raise_if_cancelled()
+        if settings is not None:
+            settings = replace(settings, **{f.name: getattr(self.settings, f.name)
+                                            for f in fields(self.settings) if f.name.startswith("docker_")})
+        
+        with track_imports() as imported:
+            value, usage = self.scheduler.execute(code, token, output, on_sample, settings)
+        return ExecutionResult(str(uuid.uuid4()), value, usage, frozenset(imported))
+    
+    def execute_stream(self, code: str) -> Iterator[StreamChunk]:
+        """在Docker容器中执行代码并在产生输出时逐块返回
         
-        def _execute_thread():
-            try:
-                result = self.execute(code)
-                if callback:
-                    callback(result=result, error=None)
-            except Exception as e:
-                if callback:
-                    callback(result=None, error=str(e))
+        Args:
+            code: 要执行的代码
         
-        thread = threading.Thread(target=_execute_thread)
-        thread.daemon = True
-        thread.start()
-        return thread
\ No newline at end of file
+        Yields:
+            StreamChunk: stdout / stderr / result 输出块，最后一块为 __result__ 的值
+        """
+        return stream_execution(
+            lambda token, output: self._execute(code, token, output).value,
+            self.settings.stream_buffer_size
+        )
+    
+    def submit(self, code: str, timeout: Optional[float] = None) -> "asyncio.Future":
+        """提交异步执行任务，必须在事件循环中调用
+
+        任务按提交顺序排队，同时运行的容器数不超过 max_concurrency；
+        超时或 Future 被取消时强制终止容器。
+
+        Args:
+            code: 要执行的代码
+            timeout: 从开始执行起算的超时时间（秒），默认使用 max_execution_time 再预留 5 秒容器启动时间
+
+        Returns:
+            asyncio.Future: 执行结果，超时时为 ResourceLimitExceeded
+
+        Raises:
+            SandboxError: 排队的任务数超过 docker_max_queued
+        """
+        if timeout is None:
+            timeout = self.settings.max_execution_time + STARTUP_GRACE
+        return self._get_dispatcher().submit(code, timeout)
+
+    async def execute_async(self, code: str, timeout: Optional[float] = None) -> Any:
+        """异步执行代码，等价于 await submit(code, timeout)
+
+        Args:
+            code: 要执行的代码
+            timeout: 超时时间（秒），默认使用 max_execution_time 再预留 5 秒容器启动时间
+
+        Returns:
+            执行结果
+
+        Raises:
+            SandboxError: 如果执行出错或排队的任务过多
+            ResourceLimitExceeded: 如果执行超时
+        """
+        return await self.submit(code, timeout)
+
+    def _get_dispatcher(self) -> AsyncDispatcher:
+        """获取当前事件循环对应的调度器"""
+        loop = asyncio.get_running_loop()
+        dispatcher = self._dispatchers.get(loop)
+        if dispatcher is None:
+            dispatcher = self._dispatchers[loop] = AsyncDispatcher(
+                lambda code, token: self._execute(code, token).value,
+                self.settings.max_concurrency,
+                self.settings.docker_max_queued,
+                self._get_executor()
+            )
+        return dispatcher
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """获取异步执行使用的有界线程池"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.settings.max_concurrency,
+                    thread_name_prefix="docker-exec"
+                )
+            return self._executor
\ No newline at end of file
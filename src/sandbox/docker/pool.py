@@ -0,0 +1,208 @@
+"""
+Docker 预启动容器池模块
+容器内运行常驻的 sandbox.docker.executor 执行循环，一个容器连续执行多个任务
+"""
+
+import atexit
+import queue
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from sandbox.config.settings import SandboxSettings
+from sandbox.core.accounting import ResourceUsage
+from sandbox.core.cancel import CancelToken
+from sandbox.core.stream import OutputSink
+from sandbox.docker.container import ExecutorContainer
+from sandbox.docker.stats import SampleCallback
+from sandbox.exceptions import SandboxError
+
+# 后台启动容器失败后重试的间隔（秒）
+FILL_RETRY_INTERVAL = 1.0
+
+
+class ContainerPool:
+    """预启动的常驻容器池
+
+    - 预启动：创建后由后台线程启动 size 个容器，容器被删除后在后台补充
+    - 健康检查：后台线程定期 ping 空闲容器，无响应的容器被替换
+    - 回收：容器执行 recycle_after 次后替换，避免残留状态累积
+    - 超限替换：执行超时、内存耗尽或容器内报告资源超限时替换容器
+    """
+
+    def __init__(self, client, image: str, settings: SandboxSettings):
+        """
+        Args:
+            client: Docker 客户端
+            image: 容器镜像
+            settings: 沙箱配置，提供容器的资源限制、池大小和回收策略
+        """
+        self.client = client
+        self.image = image
+        self.settings = settings
+        self.size = settings.docker_pool_size
+        self._idle: "queue.Queue[ExecutorContainer]" = queue.Queue()
+        self._count = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._fill_thread = threading.Thread(target=self._fill_loop, name="docker-pool-fill", daemon=True)
+        self._fill_thread.start()
+        self._health_thread = threading.Thread(target=self._health_loop, name="docker-pool-health", daemon=True)
+        self._health_thread.start()
+
+    def _reserve(self) -> bool:
+        """未达到池大小时占用一个容器名额"""
+        with self._lock:
+            if self._closed or self._count >= self.size:
+                return False
+            self._count += 1
+            return True
+
+    def _create(self) -> ExecutorContainer:
+        try:
+            return ExecutorContainer(self.client, self.image, self.settings)
+        except Exception:
+            with self._lock:
+                self._count -= 1
+            raise
+
+    def _fill_loop(self) -> None:
+        """在后台启动容器直到达到池大小，容器被删除后再补充"""
+        while not self._stop.is_set():
+            self._wake.clear()
+            failed = False
+            while not failed and self._reserve():
+                try:
+                    container = self._create()
+                except Exception:
+                    # 节点暂时无法启动容器，稍后重试；执行时按需启动会把错误报告给调用方
+                    failed = True
+                else:
+                    self._release(container)
+            self._wake.wait(FILL_RETRY_INTERVAL if failed else None)
+
+    def _acquire(self, token: Optional[CancelToken]) -> ExecutorContainer:
+        """获取空闲容器，后台尚未补足且未达到池大小时直接启动新容器"""
+        while True:
+            if token is not None:
+                token.raise_if_cancelled()
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self._closed:
+                raise SandboxError("Docker容器池已关闭")
+            if self._reserve():
+                return self._create()
+            try:
+                return self._idle.get(timeout=self.settings.check_interval)
+            except queue.Empty:
+                continue
+
+    def _release(self, container: ExecutorContainer) -> None:
+        if self._closed:
+            self._discard(container)
+        else:
+            self._idle.put(container)
+
+    def _discard(self, container: ExecutorContainer) -> None:
+        """删除容器，由后台线程启动新容器替换"""
+        container.remove()
+        with self._lock:
+            self._count -= 1
+        self._wake.set()
+
+    def execute(self, code: str, settings: SandboxSettings, token: Optional[CancelToken] = None,
+                output: Optional[OutputSink] = None,
+                on_sample: Optional[SampleCallback] = None) -> Tuple[Any, ResourceUsage]:
+        """在空闲容器中执行代码
+
+        Args:
+            code: 要执行的代码
+            settings: 沙箱配置
+            token: 取消令牌，取消时终止并替换执行中的容器
+            output: 接收 print 输出的回调
+            on_sample: 接收容器资源采样点的回调
+
+        Returns:
+            Tuple[Any, ResourceUsage]: 执行结果和资源使用
+
+        Raises:
+            ResourceLimitExceeded: 资源使用超出限制（对应容器会被替换）
+            SandboxError: 代码执行出错或容器异常退出
+        """
+        container = self._acquire(token)
+        try:
+            return container.run(code, settings, token, output, on_sample)
+        finally:
+            if not container.healthy or container.executions >= settings.docker_recycle_after:
+                self._discard(container)
+            else:
+                self._release(container)
+
+    def _health_loop(self) -> None:
+        """定期检查空闲容器"""
+        while not self._stop.wait(self.settings.docker_health_interval):
+            checked: List[ExecutorContainer] = []
+            while True:
+                try:
+                    checked.append(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+            for container in checked:
+                if container.ping():
+                    self._release(container)
+                else:
+                    self._discard(container)
+
+    def shutdown(self) -> None:
+        """关闭容器池并删除全部容器"""
+        self._closed = True
+        self._stop.set()
+        self._wake.set()
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+def endpoint_key(client) -> str:
+    """Docker 客户端连接的守护进程地址，不同节点使用各自的容器池"""
+    api = getattr(client, 'api', None)
+    return getattr(api, 'base_url', None) or str(id(client))
+
+
+_pools: Dict[Tuple, ContainerPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_container_pool(client, image: str, settings: SandboxSettings) -> ContainerPool:
+    """获取与节点、镜像和容器级资源限制对应的共享容器池
+
+    Args:
+        client: Docker 客户端
+        image: 容器镜像
+        settings: 沙箱配置
+
+    Returns:
+        ContainerPool: 共享容器池
+    """
+    key = (endpoint_key(client), image, settings.max_memory_mb, settings.max_cpu_percent, settings.network_access,
+           settings.docker_pool_size)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ContainerPool(client, image, settings)
+        return pool
+
+
+@atexit.register
+def shutdown_container_pools() -> None:
+    """关闭全部共享容器池"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
@@ -0,0 +1,151 @@
+"""
+Docker 执行器通信协议
+每条消息是 4 字节大端长度前缀加 UTF-8 JSON 正文，经容器附加的标准输入输出传输
+
+主机 -> 容器:
+    {"type": "job", "id", "code", "settings", "stream"}  执行代码
+    {"type": "ping"}                                     健康检查
+容器 -> 主机:
+    {"type": "output", "id", "kind", "data"}             流式输出（job 的 stream 为真时）
+    {"type": "result", "id", "result"}                   执行成功
+    {"type": "error", "id", "error_type", "error"}       执行失败
+    {"type": "pong"}
+
+容器内运行的是不可信代码，因此使用 JSON 而不是 pickle；结果无法序列化为 JSON 时返回其 repr。
+工作进程池和 zygote 子进程回传结果时也使用同样的消息正文（encode_body / decode_body）。
+本模块只依赖标准库，供容器内的执行器直接导入。
+"""
+
+import json
+import struct
+from typing import Any, BinaryIO, Dict, List, Optional
+
+_HEADER = struct.Struct(">I")
+
+# 单条消息的最大长度，防止损坏或恶意的长度前缀耗尽内存
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    """消息格式错误"""
+    pass
+
+
+def encode_body(message: Dict[str, Any]) -> bytes:
+    """把消息编码为 JSON 正文（不带长度前缀），无法序列化的值写为其 repr
+
+    Args:
+        message: 消息内容
+
+    Returns:
+        bytes: UTF-8 JSON
+    """
+    return json.dumps(message, ensure_ascii=False, default=repr).encode('utf-8')
+
+
+def encode(message: Dict[str, Any]) -> bytes:
+    """编码一条消息
+
+    Args:
+        message: 消息内容
+
+    Returns:
+        bytes: 带长度前缀的消息
+    """
+    body = encode_body(message)
+    return _HEADER.pack(len(body)) + body
+
+
+def decode_body(body: bytes) -> Dict[str, Any]:
+    """解码 JSON 正文
+
+    Args:
+        body: UTF-8 JSON
+
+    Returns:
+        Dict[str, Any]: 消息内容
+
+    Raises:
+        ProtocolError: 正文不是 JSON 对象
+    """
+    try:
+        message = json.loads(body.decode('utf-8'))
+    except ValueError as e:
+        raise ProtocolError(f"无效的消息: {e}")
+    if not isinstance(message, dict):
+        raise ProtocolError("无效的消息: 不是 JSON 对象")
+    return message
+
+
+def _check_size(size: int) -> None:
+    if size > MAX_MESSAGE_SIZE:
+        raise ProtocolError(f"消息过大: {size} 字节")
+
+
+class FrameDecoder:
+    """增量解码：从任意切分的字节块中解出完整消息"""
+
+    def __init__(self):
+        self._buffer = b""
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        """追加数据并返回已完整的消息
+
+        Args:
+            data: 新读取的字节
+
+        Returns:
+            List[Dict[str, Any]]: 解出的消息，可能为空
+        """
+        self._buffer += data
+        messages = []
+        while len(self._buffer) >= _HEADER.size:
+            (size,) = _HEADER.unpack_from(self._buffer)
+            _check_size(size)
+            end = _HEADER.size + size
+            if len(self._buffer) < end:
+                break
+            messages.append(decode_body(self._buffer[_HEADER.size:end]))
+            self._buffer = self._buffer[end:]
+        return messages
+
+
+def read_message(stream: BinaryIO) -> Optional[Dict[str, Any]]:
+    """从阻塞的二进制流中读取一条消息
+
+    Args:
+        stream: 二进制输入流
+
+    Returns:
+        Optional[Dict[str, Any]]: 消息，流结束时返回 None
+    """
+    header = _read_exact(stream, _HEADER.size)
+    if header is None:
+        return None
+    (size,) = _HEADER.unpack(header)
+    _check_size(size)
+    body = _read_exact(stream, size)
+    if body is None:
+        raise ProtocolError("消息不完整")
+    return decode_body(body)
+
+
+def write_message(stream: BinaryIO, message: Dict[str, Any]) -> None:
+    """向二进制流写入一条消息并立即刷新
+
+    Args:
+        stream: 二进制输出流
+        message: 消息内容
+    """
+    stream.write(encode(message))
+    stream.flush()
+
+
+def _read_exact(stream: BinaryIO, size: int) -> Optional[bytes]:
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
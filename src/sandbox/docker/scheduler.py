@@ -0,0 +1,215 @@
+"""
+Docker 多节点调度模块
+把每次执行放到负载最低的 Docker 守护进程上，节点故障时换到其他节点重试
+"""
+
+import threading
+import time
+from typing import Any, List, Optional, Set, Tuple
+
+from sandbox.config.settings import SandboxSettings
+from sandbox.core.accounting import ResourceUsage
+from sandbox.core.cancel import CancelToken
+from sandbox.core.stream import OutputSink
+from sandbox.docker.container import ContainerStartError, ExecutorContainer
+from sandbox.docker.pool import get_container_pool
+from sandbox.docker.stats import SampleCallback
+from sandbox.exceptions import SandboxError
+
+_MB = 1024 * 1024
+
+
+class DockerEndpoint:
+    """一个 Docker 守护进程及其负载"""
+
+    def __init__(self, name: str, client):
+        """
+        Args:
+            name: 节点名称（守护进程地址）
+            client: 连接该节点的 Docker 客户端
+        """
+        self.name = name
+        self.client = client
+        self.in_flight = 0  # 本进程放在该节点上、尚未结束的执行数
+        self.memory_mb = 0.0  # 节点报告的总内存（MB）
+        self.info_time = 0.0  # 上次读取节点信息的时间
+        self.down_until = 0.0  # 节点被判定故障后暂停使用的截止时间
+        self.failures = 0
+
+    def available(self, now: float) -> bool:
+        return self.down_until <= now
+
+    def free_memory_mb(self, container_mb: float) -> float:
+        """节点内存减去本进程在该节点上执行中的容器的内存上限"""
+        return self.memory_mb - self.in_flight * container_mb
+
+    def __repr__(self) -> str:
+        return f"DockerEndpoint({self.name!r}, in_flight={self.in_flight})"
+
+
+class DockerScheduler:
+    """在多个 Docker 节点之间调度执行
+
+    - 选择：优先选择剩余内存（节点报告的总内存减去执行中容器的内存上限）能容纳新容器的节点，
+      其中执行中任务最少者优先，相同时剩余内存多者优先
+    - 故障：容器无法在节点上启动（守护进程不可达、镜像缺失等）时，该节点在
+      docker_health_interval 秒内不再被选择，本次执行换到其他节点重试，每个节点最多尝试一次。
+      代码开始执行后的错误不重试
+    """
+
+    def __init__(self, endpoints: List[DockerEndpoint], image: str, settings: SandboxSettings):
+        """
+        Args:
+            endpoints: Docker 节点
+            image: 容器镜像，所有节点上都需要存在
+            settings: 沙箱配置，执行时未指定设置时使用；节点健康检查间隔总是取自这里
+
+        Raises:
+            SandboxError: 没有节点
+        """
+        if not endpoints:
+            raise SandboxError("没有配置Docker节点")
+        self.endpoints = endpoints
+        self.image = image
+        self.settings = settings
+        self._lock = threading.Lock()
+
+    def _container_mb(self, settings: Optional[SandboxSettings] = None) -> float:
+        return (settings or self.settings).max_memory_mb + 50
+
+    def _refresh(self, endpoint: DockerEndpoint, now: float) -> None:
+        """读取节点报告的内存，需要与守护进程往返一次，不能在持有锁时调用"""
+        try:
+            endpoint.memory_mb = endpoint.client.info().get('MemTotal', 0) / _MB
+        except Exception:
+            self.mark_down(endpoint)
+
+    def refresh(self, exclude: Set[DockerEndpoint] = frozenset()) -> None:
+        """刷新超过 docker_health_interval 未更新的节点信息
+
+        锁内只认领要刷新的节点（并发的调用不会重复刷新同一节点），读取在锁外进行，
+        守护进程响应慢时不会阻塞其他执行的节点选择。
+
+        Args:
+            exclude: 不需要刷新的节点
+        """
+        now = time.monotonic()
+        wall = time.time()
+        stale = []
+        with self._lock:
+            for endpoint in self.endpoints:
+                if endpoint in exclude or not endpoint.available(now):
+                    continue
+                if endpoint.info_time and wall - endpoint.info_time < self.settings.docker_health_interval:
+                    continue
+                endpoint.info_time = wall
+                stale.append(endpoint)
+        for endpoint in stale:
+            self._refresh(endpoint, wall)
+
+    def mark_down(self, endpoint: DockerEndpoint) -> None:
+        """把节点标记为故障，暂停使用 docker_health_interval 秒"""
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.down_until = time.monotonic() + self.settings.docker_health_interval
+
+    def _select(self, exclude: Set[DockerEndpoint],
+                settings: Optional[SandboxSettings] = None) -> Optional[DockerEndpoint]:
+        """按已读取的节点信息选择负载最低的可用节点，调用方持有锁"""
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e not in exclude and e.available(now)]
+        if not candidates:
+            return None
+        container_mb = self._container_mb(settings)
+        fitting = [e for e in candidates if e.free_memory_mb(container_mb) >= container_mb]
+        return min(fitting or candidates,
+                   key=lambda e: (e.in_flight, -e.free_memory_mb(container_mb)))
+
+    def choose(self, exclude: Set[DockerEndpoint] = frozenset()) -> Optional[DockerEndpoint]:
+        """刷新节点信息并选择负载最低的可用节点
+
+        Args:
+            exclude: 本次执行已经失败过的节点
+
+        Returns:
+            Optional[DockerEndpoint]: 选中的节点，没有可用节点时返回 None
+        """
+        self.refresh(exclude)
+        with self._lock:
+            return self._select(exclude)
+
+    def check_image(self) -> None:
+        """确认各节点上存在镜像，缺少镜像或不可达的节点被标记为故障
+
+        Raises:
+            SandboxError: 所有节点上都没有镜像
+        """
+        found = False
+        for endpoint in self.endpoints:
+            try:
+                endpoint.client.images.get(self.image)
+                found = True
+            except Exception:
+                self.mark_down(endpoint)
+        if not found:
+            raise SandboxError(f"Docker镜像 {self.image} 不存在，请先构建镜像")
+
+    def execute(self, code: str, token: Optional[CancelToken] = None, output: Optional[OutputSink] = None,
+                on_sample: Optional[SampleCallback] = None,
+                settings: Optional[SandboxSettings] = None) -> Tuple[Any, ResourceUsage]:
+        """在负载最低的节点上执行代码
+
+        Args:
+            code: 要执行的代码
+            token: 取消令牌
+            output: 接收 print 输出的回调
+            on_sample: 接收容器资源采样点的回调
+            settings: 本次执行的设置，默认使用调度器的设置
+
+        Returns:
+            Tuple[Any, ResourceUsage]: 执行结果和资源使用
+
+        Raises:
+            SandboxError: 所有节点都无法启动容器，或代码执行出错
+            ResourceLimitExceeded: 资源使用超出限制
+        """
+        settings = settings or self.settings
+        tried: Set[DockerEndpoint] = set()
+        error: Optional[Exception] = None
+        while True:
+            if token is not None:
+                token.raise_if_cancelled()
+            self.refresh(tried)
+            with self._lock:
+                endpoint = self._select(tried, settings)
+                if endpoint is None:
+                    break
+                endpoint.in_flight += 1
+            try:
+                return self._execute_on(endpoint, code, token, output, on_sample, settings)
+            except ContainerStartError as e:
+                self.mark_down(endpoint)
+                tried.add(endpoint)
+                error = e
+            finally:
+                with self._lock:
+                    endpoint.in_flight -= 1
+        if error is not None:
+            raise SandboxError(f"所有Docker节点都无法执行: {error}")
+        raise SandboxError("没有可用的Docker节点")
+
+    def _execute_on(self, endpoint: DockerEndpoint, code: str, token: Optional[CancelToken],
+                    output: Optional[OutputSink], on_sample: Optional[SampleCallback],
+                    settings: SandboxSettings) -> Tuple[Any, ResourceUsage]:
+        """在指定节点上执行，容器无法启动时抛出 ContainerStartError"""
+        if settings.docker_pool_size > 0:
+            # 交给该节点上预启动的常驻容器执行
+            return get_container_pool(endpoint.client, self.image, settings).execute(
+                code, settings, token, output, on_sample)
+
+        # 启动新容器执行一个任务，代码、设置和结果经附加的标准输入输出传输
+        container = ExecutorContainer(endpoint.client, self.image, settings)
+        try:
+            return container.run(code, settings, token, output, on_sample)
+        finally:
+            container.remove()
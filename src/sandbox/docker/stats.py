@@ -0,0 +1,178 @@
+"""
+Docker 容器资源统计模块
+读取 Docker stats 流，转换为与 Web 界面 /resource_data 相同格式的内存/CPU 时间序列
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from sandbox.core.accounting import ResourceUsage
+
+# 接收一个资源采样点的回调：{'timestamp', 'memory_mb', 'cpu_percent', 'elapsed_time'}
+SampleCallback = Callable[[Dict[str, float]], None]
+
+
+def memory_mb(stats: Dict[str, Any]) -> float:
+    """容器内存使用（MB），与 docker stats 命令一致，不计可回收的文件缓存
+
+    Args:
+        stats: Docker stats 接口返回的一条统计
+
+    Returns:
+        float: 内存使用（MB）
+    """
+    memory = stats.get('memory_stats') or {}
+    usage = memory.get('usage', 0)
+    detail = memory.get('stats') or {}
+    # cgroup v1 为 total_inactive_file，cgroup v2 为 inactive_file
+    for key in ('total_inactive_file', 'inactive_file'):
+        if key in detail:
+            usage -= min(detail[key], usage)
+            break
+    return usage / 1024 / 1024
+
+
+def cpu_percent(stats: Dict[str, Any]) -> float:
+    """两次统计之间的 CPU 使用率（%），与 docker stats 命令一致，多核时可超过 100
+
+    Args:
+        stats: Docker stats 接口返回的一条统计，precpu_stats 为上一次统计
+
+    Returns:
+        float: CPU 使用率，缺少上一次统计时为 0
+    """
+    cpu = stats.get('cpu_stats') or {}
+    precpu = stats.get('precpu_stats') or {}
+    cpu_delta = _total_usage(cpu) - _total_usage(precpu)
+    system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+    if cpu_delta <= 0 or system_delta <= 0 or not precpu.get('system_cpu_usage'):
+        return 0.0
+    online_cpus = cpu.get('online_cpus') or len((cpu.get('cpu_usage') or {}).get('percpu_usage') or []) or 1
+    return cpu_delta / system_delta * online_cpus * 100
+
+
+def _total_usage(cpu_stats: Dict[str, Any]) -> int:
+    """累计 CPU 时间（纳秒）"""
+    return (cpu_stats.get('cpu_usage') or {}).get('total_usage', 0)
+
+
+class StatsRecorder:
+    """一次执行期间的容器资源采样，记录时间序列和峰值"""
+
+    def __init__(self, on_sample: Optional[SampleCallback] = None):
+        """
+        Args:
+            on_sample: 每得到一个采样点时调用
+        """
+        self.on_sample = on_sample
+        self.start_time = time.time()
+        self.samples: List[Dict[str, float]] = []
+        self.peak_memory_mb = 0.0
+        self.peak_cpu_percent = 0.0
+        self._first_cpu: Optional[int] = None
+        self._last_cpu: Optional[int] = None
+
+    def add(self, stats: Dict[str, Any]) -> None:
+        """加入一条 Docker 统计
+
+        Args:
+            stats: Docker stats 接口返回的一条统计
+        """
+        now = time.time()
+        sample = {
+            'timestamp': now,
+            'memory_mb': memory_mb(stats),
+            'cpu_percent': cpu_percent(stats),
+            'elapsed_time': now - self.start_time
+        }
+        self.samples.append(sample)
+        self.peak_memory_mb = max(self.peak_memory_mb, sample['memory_mb'])
+        self.peak_cpu_percent = max(self.peak_cpu_percent, sample['cpu_percent'])
+
+        total = _total_usage(stats.get('cpu_stats') or {})
+        if self._first_cpu is None:
+            # 以执行开始前的一次统计为起点
+            self._first_cpu = _total_usage(stats.get('precpu_stats') or {}) or total
+        self._last_cpu = total
+
+        if self.on_sample is not None:
+            self.on_sample(sample)
+
+    def usage(self) -> ResourceUsage:
+        """根据采样计算本次执行的资源使用
+
+        Returns:
+            ResourceUsage: 墙钟时间、采样区间内的容器 CPU 时间以及内存和 CPU 峰值
+        """
+        cpu_time = 0.0
+        if self._first_cpu is not None and self._last_cpu is not None:
+            cpu_time = max(self._last_cpu - self._first_cpu, 0) / 1e9
+        return ResourceUsage(
+            wall_time=time.time() - self.start_time,
+            cpu_time=cpu_time,
+            peak_memory_mb=self.peak_memory_mb,
+            peak_cpu_percent=self.peak_cpu_percent
+        )
+
+
+class ContainerStats:
+    """容器生命周期内的 stats 流
+
+    每个容器只打开一个流（Docker 约每秒推送一条），执行期间把统计交给当前的 StatsRecorder。
+    容器删除后流结束，读取线程随之退出。
+    """
+
+    def __init__(self, container):
+        """
+        Args:
+            container: docker SDK 的容器对象
+        """
+        self.container = container
+        self._recorder: Optional[StatsRecorder] = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._read, name="docker-stats", daemon=True)
+        self._thread.start()
+
+    def _read(self) -> None:
+        try:
+            for stats in self.container.stats(stream=True, decode=True):
+                with self._lock:
+                    recorder = self._recorder
+                    if recorder is not None:
+                        recorder.add(stats)
+        except Exception:
+            # 容器已删除或守护进程断开
+            pass
+
+    @contextmanager
+    def record(self, on_sample: Optional[SampleCallback] = None):
+        """在上下文内记录容器统计
+
+        执行时间短于 Docker 的推送间隔时流中没有统计，结束时补取一次快照，至少得到内存使用。
+
+        Args:
+            on_sample: 每得到一个采样点时调用
+
+        Yields:
+            StatsRecorder: 本次执行的采样记录
+        """
+        recorder = StatsRecorder(on_sample)
+        with self._lock:
+            self._recorder = recorder
+        try:
+            yield recorder
+        finally:
+            with self._lock:
+                self._recorder = None
+            if not recorder.samples:
+                snapshot = self._snapshot()
+                if snapshot is not None:
+                    recorder.add(snapshot)
+
+    def _snapshot(self) -> Optional[Dict[str, Any]]:
+        try:
+            return self.container.stats(stream=False, one_shot=True)
+        except Exception:
+            return None
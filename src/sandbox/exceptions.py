@@ -12,4 +12,8 @@ class ResourceLimitExceeded(SandboxError):
 
 class SecurityError(SandboxError):
     """安全错误"""
-    pass 
\ No newline at end of file
+    pass 
+
+class SessionClosed(SandboxError):
+    """会话已关闭或已因空闲超时被回收"""
+    pass
\ No newline at end of file
@@ -0,0 +1,457 @@
+"""
+结构化审计日志模块
+
+每条审计记录是一行 JSON（JSONL），包含 ts、level、event、execution_id 及事件字段。
+记录写入分段文件 audit-<写入者>-<序号>.jsonl，超过大小或时长时轮转；关闭的分段按块压缩为
+audit-<写入者>-<序号>.jsonl.gz，每块是一个独立的 gzip 成员（整个文件仍可用 zcat 读取）。
+
+多个进程可以写入同一目录：每个 AuditLog 有唯一的写入者标识（进程号加随机后缀），只写自己的分段，
+并在存活期间持有 audit-<写入者>.lock 的文件锁。启动时只压缩锁已释放（写入者已退出）的写入者留下的
+未压缩分段。轮转时关闭的分段交给后台线程压缩，压缩期间写入不受影响，查询端可以直接读取未压缩的分段。
+
+目录中的 index.jsonl 是索引，每行一项：
+    {"type": "execution", "id", "writer", "segment", "offset", "ts"}      执行的第一条记录（start 事件）在分段中的位置
+    {"type": "segment", "writer", "segment", "first_ts", "last_ts", "blocks"}  已压缩分段的时间范围和块表
+块表是 [未压缩偏移, 压缩偏移] 列表，按执行ID 查询时只需解压记录所在的块及其后的块。
+"""
+
+import bisect
+import glob
+import gzip
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+import zlib
+import logging
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import psutil
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 flock，按进程是否存在判断写入者是否已退出
+    fcntl = None
+
+INDEX_FILE = "index.jsonl"
+# 压缩分段时每块的未压缩大小（字节），块越小按位置读取时解压的数据越少
+BLOCK_SIZE = 1024 * 1024
+
+# 写入者标识为空的是旧版本写入的 audit-<序号>.jsonl 分段
+_SEGMENT_PATTERN = re.compile(r"audit-(?:(\d+-[0-9a-f]+)-)?(\d+)\.jsonl(\.gz)?$")
+
+# 分段的键：(写入者, 序号)
+SegmentKey = Tuple[str, int]
+
+
+def _segment_name(writer: str, seq: int) -> str:
+    return f"audit-{writer}-{seq:06d}.jsonl"
+
+
+def _lock_path(directory: str, writer: str) -> str:
+    return os.path.join(directory, f"audit-{writer}.lock")
+
+
+def _scan_segments(directory: str) -> Dict[SegmentKey, str]:
+    """目录中的分段文件，键为 (写入者, 序号)"""
+    segments = {}
+    for path in glob.glob(os.path.join(directory, "audit-*.jsonl*")):
+        match = _SEGMENT_PATTERN.search(path)
+        if match:
+            segments[(match.group(1) or "", int(match.group(2)))] = path
+    return segments
+
+
+def _claim_writer(directory: str, writer: str) -> Optional[IO[bytes]]:
+    """获取写入者的文件锁
+
+    Returns:
+        Optional[IO[bytes]]: 持有锁的文件，写入者仍在运行（或正被其他进程恢复）时为 None
+    """
+    if fcntl is None:
+        pid = writer.split("-")[0]
+        if pid and psutil.pid_exists(int(pid)):
+            return None
+        return open(_lock_path(directory, writer), 'ab')
+    lock_file = open(_lock_path(directory, writer), 'ab')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _dumps(record: Dict[str, Any]) -> bytes:
+    return (json.dumps(record, ensure_ascii=False, default=repr) + "\n").encode('utf-8')
+
+
+class AuditLog:
+    """审计日志的写入端，线程安全"""
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 1024 * 1024, max_age: float = 3600.0):
+        """
+        Args:
+            directory: 审计日志目录
+            max_bytes: 分段达到该大小（字节）后轮转
+            max_age: 分段打开超过该时长（秒）后轮转
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # 后台压缩线程也写索引，索引的写入另用一把锁
+        self._index_lock = threading.Lock()
+        self._compress_queue: "queue.Queue" = queue.Queue()
+        self._compressor: Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+        self.writer = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # 存活期间一直持有，其他进程据此判断本写入者的分段是否仍在写入
+        self._writer_lock = _claim_writer(directory, self.writer)
+        self._index = open(os.path.join(directory, INDEX_FILE), 'ab')
+        self._recover()
+        self._file = None
+        self._open_segment(1)
+
+    def _recover(self) -> None:
+        """压缩已退出的写入者（包括未正常关闭的进程）留下的未压缩分段"""
+        writers = {writer for (writer, _), path in _scan_segments(self.directory).items()
+                   if writer != self.writer and not path.endswith(".gz")}
+        for writer in sorted(writers):
+            lock_file = _claim_writer(self.directory, writer)
+            if lock_file is None:
+                continue
+            try:
+                # 持有锁后重新扫描，其他进程可能已经压缩了部分分段
+                for (owner, seq), path in sorted(_scan_segments(self.directory).items()):
+                    if owner == writer and not path.endswith(".gz"):
+                        self._close_segment(writer, seq, path, *_time_range(path))
+                os.remove(lock_file.name)
+            finally:
+                lock_file.close()
+
+    def _open_segment(self, seq: int) -> None:
+        self.seq = seq
+        self.path = os.path.join(self.directory, _segment_name(self.writer, seq))
+        self._file = open(self.path, 'ab')
+        self._size = self._file.tell()
+        self._opened = time.time()
+        self._first_ts: Optional[float] = None
+        self._last_ts: Optional[float] = None
+
+    def _close_segment(self, writer: str, seq: int, path: str, first_ts: Optional[float],
+                       last_ts: Optional[float]) -> None:
+        blocks = compress_segment(path)
+        with self._index_lock:
+            self._index.write(_dumps({
+                'type': "segment", 'writer': writer, 'segment': seq, 'first_ts': first_ts, 'last_ts': last_ts,
+                'blocks': blocks
+            }))
+            self._index.flush()
+
+    def _compress_pending(self) -> None:
+        """后台线程：依次压缩轮转下来的分段，收到 None 时退出"""
+        while True:
+            segment = self._compress_queue.get()
+            if segment is None:
+                return
+            try:
+                self._close_segment(*segment)
+            except OSError:
+                # 分段保持未压缩，查询端照常读取，写入者退出后由下一个启动的写入者恢复
+                pass
+
+    def write(self, records: Iterable[Dict[str, Any]]) -> None:
+        """追加记录并刷新到磁盘，需要时先轮转
+
+        Args:
+            records: 审计记录，应包含 ts（时间戳）；start 事件的记录会写入索引
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            for record in records:
+                ts = record.get('ts', time.time())
+                if self._size and (self._size >= self.max_bytes or ts - self._opened >= self.max_age):
+                    self._rotate()
+                line = _dumps(record)
+                if record.get('event') == "start" and record.get('execution_id'):
+                    with self._index_lock:
+                        self._index.write(_dumps({
+                            'type': "execution", 'id': record['execution_id'], 'writer': self.writer,
+                            'segment': self.seq, 'offset': self._size, 'ts': ts
+                        }))
+                self._file.write(line)
+                self._size += len(line)
+                if self._first_ts is None:
+                    self._first_ts = ts
+                self._last_ts = ts
+            self._file.flush()
+            with self._index_lock:
+                self._index.flush()
+
+    def _rotate(self) -> None:
+        """关闭当前分段并打开下一个，压缩交给后台线程，不在持有写入锁时进行"""
+        self._file.close()
+        if self._compressor is None:
+            self._compressor = threading.Thread(target=self._compress_pending, name="audit-compress", daemon=True)
+            self._compressor.start()
+        self._compress_queue.put((self.writer, self.seq, self.path, self._first_ts, self._last_ts))
+        self._open_segment(self.seq + 1)
+
+    def rotate(self) -> None:
+        """立即轮转当前分段（当前分段为空时不轮转）"""
+        with self._lock:
+            if self._file is not None and self._size:
+                self._rotate()
+
+    def close(self) -> None:
+        """关闭当前分段，非空时压缩；等待后台线程压缩完已轮转的分段"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+            if self._compressor is not None:
+                self._compress_queue.put(None)
+                self._compressor.join()
+            if self._size:
+                self._close_segment(self.writer, self.seq, self.path, self._first_ts, self._last_ts)
+            else:
+                os.remove(self.path)
+            self._index.close()
+            if self._writer_lock is not None:
+                os.remove(self._writer_lock.name)
+                self._writer_lock.close()
+
+
+def _time_range(path: str) -> Tuple[Optional[float], Optional[float]]:
+    first_ts = last_ts = None
+    for _, record in _read_lines(path, None, 0):
+        ts = record.get('ts')
+        if ts is not None:
+            first_ts = ts if first_ts is None else first_ts
+            last_ts = ts
+    return first_ts, last_ts
+
+
+def compress_segment(path: str, block_size: int = BLOCK_SIZE) -> List[List[int]]:
+    """按块压缩分段，每块在行边界结束，是一个独立的 gzip 成员
+
+    Args:
+        path: 未压缩的分段文件，压缩后被删除
+        block_size: 每块的未压缩大小（字节）
+
+    Returns:
+        List[List[int]]: 块表，每项为 [未压缩偏移, 压缩偏移]
+    """
+    blocks = []
+    offset = 0
+    temp_path = path + ".gz.tmp"
+    with open(path, 'rb') as src, open(temp_path, 'wb') as dst:
+        while True:
+            chunk = src.read(block_size)
+            if not chunk:
+                break
+            chunk += src.readline()
+            blocks.append([offset, dst.tell()])
+            dst.write(gzip.compress(chunk, mtime=0))
+            offset += len(chunk)
+    os.replace(temp_path, path + ".gz")
+    os.remove(path)
+    return blocks
+
+
+def _read_blocks(path: str, blocks: Optional[List[List[int]]], offset: int) -> Iterator[Tuple[int, bytes]]:
+    """从未压缩偏移 offset 所在的位置起读取分段数据，产出 (数据起始偏移, 数据)"""
+    if blocks is None:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                data = f.read(BLOCK_SIZE)
+                if not data:
+                    return
+                yield offset, data
+                offset += len(data)
+
+    if not blocks:
+        return
+    index = max(bisect.bisect_right([block[0] for block in blocks], offset) - 1, 0)
+    position = blocks[index][0]
+    with open(path, 'rb') as f:
+        f.seek(blocks[index][1])
+        decompressor = zlib.decompressobj(wbits=31)
+        while True:
+            compressed = f.read(BLOCK_SIZE)
+            if not compressed:
+                return
+            while compressed:
+                data = decompressor.decompress(compressed)
+                if data:
+                    yield position, data
+                    position += len(data)
+                if decompressor.eof:
+                    # 下一个 gzip 成员
+                    compressed = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits=31)
+                else:
+                    compressed = b""
+
+
+def _read_lines(path: str, blocks: Optional[List[List[int]]], offset: int) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """从未压缩偏移 offset 起逐条读取记录，产出 (记录偏移, 记录)；忽略末尾未写完的行"""
+    pending = b""
+    pending_offset = offset
+    for start, data in _read_blocks(path, blocks, offset):
+        if start + len(data) <= offset:
+            continue
+        if start < offset:
+            data = data[offset - start:]
+            start = offset
+        if not pending:
+            pending_offset = start
+        pending += data
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            line_offset = pending_offset
+            pending_offset += len(line) + 1
+            if line:
+                yield line_offset, json.loads(line.decode('utf-8'))
+
+
+class AuditReader:
+    """审计日志的查询端，可以在写入进程之外使用"""
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: 审计日志目录
+        """
+        self.directory = directory
+        self.executions: Dict[str, Tuple[SegmentKey, int, float]] = {}
+        self.segments: Dict[SegmentKey, Dict[str, Any]] = {}
+        # 索引中已读取部分的字节数
+        self._index_offset = 0
+        self.refresh()
+
+    def refresh(self) -> None:
+        """读取索引中上次读取之后新增的项"""
+        path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size < self._index_offset:
+            # 索引被截断或替换，从头读取
+            self.executions.clear()
+            self.segments.clear()
+            self._index_offset = 0
+        with open(path, 'rb') as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._index_offset += len(line)
+                entry = json.loads(line.decode('utf-8'))
+                key = (entry.get('writer', ""), entry['segment'])
+                if entry['type'] == "execution":
+                    self.executions[entry['id']] = (key, entry['offset'], entry['ts'])
+                elif entry['type'] == "segment":
+                    self.segments[key] = entry
+
+    def _records(self, key: SegmentKey, path: str, offset: int = 0) -> Iterator[Dict[str, Any]]:
+        if not path.endswith(".gz") and not os.path.exists(path) and os.path.exists(path + ".gz"):
+            # 扫描目录之后分段被后台线程压缩了
+            self.refresh()
+            path += ".gz"
+        blocks = self.segments[key]['blocks'] if path.endswith(".gz") and key in self.segments else None
+        if path.endswith(".gz") and blocks is None:
+            # 索引中没有块表时从头解压
+            blocks = [[0, 0]]
+        for _, record in _read_lines(path, blocks, offset):
+            yield record
+
+    def find(self, execution_id: str) -> List[Dict[str, Any]]:
+        """查询一次执行的全部审计记录
+
+        从索引记录的位置开始读取，直到该执行的 end 事件。
+
+        Args:
+            execution_id: 执行ID
+
+        Returns:
+            List[Dict[str, Any]]: 按写入顺序排列的记录，执行不存在时为空
+        """
+        location = self.executions.get(execution_id)
+        if location is None:
+            return []
+        (writer, seq), offset, _ = location
+        files = _scan_segments(self.directory)
+        found = []
+        # 一次执行的记录都由同一个写入者写入
+        for current in sorted(key for key in files if key[0] == writer and key[1] >= seq):
+            for record in self._records(current, files[current], offset if current[1] == seq else 0):
+                if record.get('execution_id') != execution_id:
+                    continue
+                found.append(record)
+                if record.get('event') == "end":
+                    return found
+        return found
+
+    def between(self, start: float, end: float) -> Iterator[Dict[str, Any]]:
+        """按时间范围查询审计记录，只读取时间范围有交集的分段
+
+        Args:
+            start: 起始时间戳（含）
+            end: 结束时间戳（含）
+
+        Yields:
+            Dict[str, Any]: ts 在范围内的记录
+        """
+        files = _scan_segments(self.directory)
+        for key in sorted(files):
+            entry = self.segments.get(key)
+            if entry is not None and entry['first_ts'] is not None and (
+                    entry['last_ts'] < start or entry['first_ts'] > end):
+                continue
+            for record in self._records(key, files[key]):
+                if start <= record.get('ts', 0) <= end:
+                    yield record
+
+
+class AuditHandler(logging.Handler):
+    """把带 audit 字段的日志记录写入审计日志，其他记录被忽略"""
+
+    def __init__(self, audit_log: AuditLog):
+        """
+        Args:
+            audit_log: 审计日志写入端
+        """
+        super().__init__()
+        self.audit_log = audit_log
+
+    @staticmethod
+    def to_record(record: logging.LogRecord) -> Optional[Dict[str, Any]]:
+        audit = getattr(record, 'audit', None)
+        if audit is None:
+            return None
+        return {'ts': record.created, 'level': record.levelname, **audit}
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.emit_batch([record])
+
+    def emit_batch(self, records: List[logging.LogRecord]) -> None:
+        """一次写入多条记录，只刷新一次"""
+        try:
+            self.audit_log.write([r for r in map(self.to_record, records) if r is not None])
+        except Exception:
+            self.handleError(records[-1])
+
+    def close(self) -> None:
+        self.audit_log.close()
+        super().close()
@@ -1,51 +1,341 @@
 """
 安全日志记录模块，用于详细记录代码执行过程
+
+异步模式下记录日志只把记录放入有界队列，由后台线程批量格式化并写入文件和控制台。
+队列满时的丢弃策略：
+- INFO 及以下的记录（执行过程、资源采样）直接丢弃
+- WARNING 及以上的记录（访问拒绝、执行错误）最多等待 BLOCK_TIMEOUT 秒，仍没有空间时丢弃
+- 丢弃的条数由写入线程汇总为一条 WARNING 记录，写在下一批日志中
 """
 
+import atexit
 import logging
 import os
+import queue
+import threading
 import time
 import json
-from typing import Dict, Any, Optional
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Tuple
 
-class SecurityLogger:
-    """安全日志记录类"""
-    
-    def __init__(self, log_dir: str = "./logs", level: int = logging.INFO):
-        """初始化安全日志记录器
-        
+from sandbox.core.isolation import format_isolation, missing_steps
+from sandbox.logging.audit import AuditHandler, AuditLog
+
+# 队列满时 WARNING 及以上的记录最多等待的时间（秒）
+BLOCK_TIMEOUT = 0.05
+# 写入线程每批最多写入的记录数
+BATCH_SIZE = 256
+
+_STOP = object()
+
+
+class _JsonText:
+    """在格式化时才序列化为 JSON，避免在执行线程上调用 json.dumps"""
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __str__(self) -> str:
+        return json.dumps(self.value, indent=2, default=repr)
+
+
+class QueueLogHandler(logging.Handler):
+    """把日志记录放入有界队列的处理器，队列满时按模块说明的策略丢弃"""
+
+    def __init__(self, maxsize: int):
+        """
         Args:
-            log_dir: 日志文件目录
-            level: 日志记录级别
+            maxsize: 队列最多容纳的记录数
         """
-        self.log_dir = log_dir
-        
-        # 创建日志目录
+        super().__init__()
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max(maxsize, 1))
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # 不持有处理器锁，多个执行线程可以同时入队
+        if not self.filter(record):
+            return False
+        self.emit(record)
+        return True
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if record.levelno >= logging.WARNING:
+            try:
+                self.queue.put(record, timeout=BLOCK_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+        with self._dropped_lock:
+            self.dropped += 1
+
+    def take_dropped(self) -> int:
+        """取出并清零丢弃计数"""
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class _BatchWriter(threading.Thread):
+    """从队列中批量取出记录，每批对每个输出只写入和刷新一次"""
+
+    def __init__(self, source: QueueLogHandler, targets: List[logging.Handler]):
+        super().__init__(name="security-log-writer", daemon=True)
+        self.source = source
+        self.targets = targets
+
+    def run(self) -> None:
+        source_queue = self.source.queue
+        while True:
+            batch = [source_queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(source_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in batch
+            records = [record for record in batch if record is not _STOP]
+            dropped = self.source.take_dropped()
+            if dropped:
+                records.append(logging.makeLogRecord({
+                    'name': "sandbox_security",
+                    'levelno': logging.WARNING,
+                    'levelname': logging.getLevelName(logging.WARNING),
+                    'msg': f"日志队列已满，丢弃了 {dropped} 条日志"
+                }))
+            try:
+                self._write(records)
+            finally:
+                for _ in batch:
+                    source_queue.task_done()
+            if stop:
+                break
+
+    def _write(self, records: List[logging.LogRecord]) -> None:
+        for target in self.targets:
+            if isinstance(target, AuditHandler):
+                target.emit_batch(records)
+                continue
+            lines = []
+            for record in records:
+                if record.levelno < target.level:
+                    continue
+                try:
+                    lines.append(target.format(record) + target.terminator)
+                except Exception:
+                    target.handleError(record)
+            if not lines:
+                continue
+            target.acquire()
+            try:
+                target.stream.write("".join(lines))
+                target.flush()
+            except Exception:
+                target.handleError(records[-1])
+            finally:
+                target.release()
+
+
+class _LogSink:
+    """一个日志目录和一组输出选项在进程内唯一的输出：一个日志文件和一个控制台处理器，异步模式下还有一个写入线程"""
+
+    def __init__(self, logger: logging.Logger, log_dir: str, async_mode: bool, queue_size: int,
+                 audit: bool, audit_max_bytes: int, audit_max_age: float, variant: int = 0):
         os.makedirs(log_dir, exist_ok=True)
+        self.logger = logger
+        self.closed = False
         
-        # 设置文件日志
-        self.logger = logging.getLogger("sandbox_security")
-        self.logger.setLevel(level)
-        
-        # 创建日志文件处理器
+        # 创建日志文件处理器，同一目录下的其他输出选项使用带序号的文件
         timestamp = time.strftime("%Y%m%d-%H%M%S")
-        log_file = os.path.join(log_dir, f"security-{timestamp}.log")
+        suffix = f"-{variant}" if variant else ""
+        log_file = os.path.join(log_dir, f"security-{timestamp}-{os.getpid()}{suffix}.log")
         file_handler = logging.FileHandler(log_file)
         
         # 创建格式化器
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
         file_handler.setFormatter(formatter)
         
-        # 添加处理器到日志记录器
-        self.logger.addHandler(file_handler)
-        
         # 控制台输出
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(formatter)
-        self.logger.addHandler(console_handler)
+        targets = [file_handler, console_handler]
+        
+        if audit:
+            # 结构化审计日志，写入日志目录下的 audit 子目录
+            audit_log = AuditLog(os.path.join(log_dir, "audit"), audit_max_bytes, audit_max_age)
+            targets.append(AuditHandler(audit_log))
         
-        self.execution_id = None
-        self.start_time = None
+        self.queue_handler = None
+        self.writer = None
+        if async_mode:
+            # 文件、控制台和审计日志由写入线程负责，日志记录器上只有入队的处理器
+            self.queue_handler = QueueLogHandler(queue_size)
+            self.writer = _BatchWriter(self.queue_handler, targets)
+            self.writer.start()
+            self.handlers = [self.queue_handler]
+        else:
+            self.handlers = targets
+        self._targets = targets
+        for handler in self.handlers:
+            logger.addHandler(handler)
+
+    def flush(self) -> None:
+        if self.queue_handler is not None:
+            self.queue_handler.queue.join()
+
+    def close(self) -> None:
+        """写完已入队的日志，从日志记录器上移除处理器并关闭日志文件"""
+        self.closed = True
+        for handler in self.handlers:
+            self.logger.removeHandler(handler)
+        if self.writer is not None:
+            self.queue_handler.queue.put(_STOP)
+            self.writer.join()
+        for target in self._targets:
+            target.close()
+
+
+DEFAULT_LOG_DIR = "./logs"
+
+# (日志目录, 级别, 异步模式, 队列大小, 审计日志, 审计分段大小, 审计分段时长) -> 共享输出
+_SinkKey = Tuple[str, int, bool, int, bool, int, float]
+_sinks: Dict[_SinkKey, _LogSink] = {}
+_sinks_lock = threading.Lock()
+
+
+def get_log_sink(log_dir: str = DEFAULT_LOG_DIR, level: int = logging.INFO,
+                 async_mode: bool = False, queue_size: int = 10000, audit: bool = False,
+                 audit_max_bytes: int = 64 * 1024 * 1024, audit_max_age: float = 3600.0) -> _LogSink:
+    """获取日志目录和输出选项对应的共享输出，首次调用时创建
+
+    同一进程中输出选项相同的 SecurityLogger 共享输出，日志处理器和打开的文件数量不随沙箱数量增长，
+    只随不同的选项组合增长。同一目录下的第二组选项使用单独的日志记录器和带序号的日志文件，
+    各沙箱的级别、同步/异步模式和审计日志设置互不影响。
+
+    Args:
+        log_dir: 日志文件目录
+        level: 日志记录级别
+        async_mode: 是否异步写入
+        queue_size: 异步模式下队列最多容纳的记录数
+        audit: 是否同时写入结构化审计日志（见 sandbox.logging.audit）
+        audit_max_bytes: 审计日志分段的轮转大小（字节）
+        audit_max_age: 审计日志分段的轮转时长（秒）
+
+    Returns:
+        _LogSink: 共享输出
+    """
+    path = os.path.abspath(log_dir)
+    key = (path, level, async_mode, queue_size, audit, audit_max_bytes, audit_max_age)
+    sink = _sinks.get(key)
+    if sink is not None:
+        return sink
+    with _sinks_lock:
+        sink = _sinks.get(key)
+        if sink is None:
+            variant = sum(1 for other in _sinks if other[0] == path)
+            name = "sandbox_security" if log_dir == DEFAULT_LOG_DIR else f"sandbox_security.{path}"
+            if variant:
+                name = f"{name}.{variant}"
+            logger = logging.getLogger(name)
+            if name != "sandbox_security":
+                # 其他目录和其他选项使用子记录器，不向默认输出重复写入
+                logger.propagate = False
+            logger.setLevel(level)
+            sink = _sinks[key] = _LogSink(logger, log_dir, async_mode, queue_size,
+                                          audit, audit_max_bytes, audit_max_age, variant)
+        return sink
+
+
+def close_log_sink(log_dir: str = DEFAULT_LOG_DIR) -> None:
+    """关闭日志目录对应的全部共享输出，之后的日志会创建新的输出（新的日志文件）
+
+    Args:
+        log_dir: 日志文件目录
+    """
+    path = os.path.abspath(log_dir)
+    with _sinks_lock:
+        sinks = [_sinks.pop(key) for key in list(_sinks) if key[0] == path]
+    for sink in sinks:
+        sink.close()
+
+
+@atexit.register
+def shutdown_log_sinks() -> None:
+    """写完异步模式下尚未写入的日志并关闭全部共享输出"""
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+        _sinks.clear()
+    for sink in sinks:
+        sink.close()
+
+
+def _audit(event: str, execution_id: Optional[str], **fields) -> Dict[str, Any]:
+    """日志记录的 audit 字段，由审计日志处理器写为一条结构化记录"""
+    return {'audit': {'event': event, 'execution_id': execution_id, **fields}}
+
+
+# 当前上下文（线程或协程）中正在执行的代码：(执行ID, 开始时间)。
+# 并发执行各自所在的上下文互不影响，日志按上下文归属到对应的执行
+_current_execution: ContextVar[Optional[Tuple[str, float]]] = ContextVar("sandbox_execution", default=None)
+
+
+class SecurityLogger:
+    """安全日志记录类
+    
+    实例只保存配置，日志写入进程共享的输出（见 get_log_sink），可以为每个沙箱创建实例。
+    执行ID 保存在上下文变量中，同一实例上的并发执行分别归属；在其他线程中记录某次执行的日志时，
+    需要在该执行的上下文副本中调用（contextvars.copy_context().run）。
+    """
+    
+    def __init__(self, log_dir: str = DEFAULT_LOG_DIR, level: int = logging.INFO,
+                 async_mode: bool = False, queue_size: int = 10000, audit: bool = False,
+                 audit_max_bytes: int = 64 * 1024 * 1024, audit_max_age: float = 3600.0):
+        """初始化安全日志记录器
+        
+        Args:
+            log_dir: 日志文件目录
+            level: 日志记录级别
+            async_mode: 是否异步写入：记录日志时只入队，由后台线程批量写入
+            queue_size: 异步模式下队列最多容纳的记录数
+            audit: 是否同时写入结构化审计日志（日志目录下的 audit 子目录）
+            audit_max_bytes: 审计日志分段的轮转大小（字节）
+            audit_max_age: 审计日志分段的轮转时长（秒）
+        """
+        self.log_dir = log_dir
+        self._sink_options = {
+            'level': level, 'async_mode': async_mode, 'queue_size': queue_size,
+            'audit': audit, 'audit_max_bytes': audit_max_bytes, 'audit_max_age': audit_max_age
+        }
+        self._sink = get_log_sink(log_dir, **self._sink_options)
+    
+    def _get_sink(self) -> _LogSink:
+        """创建时获取的共享输出，被 close_log_sink 关闭后重新获取"""
+        sink = self._sink
+        if sink.closed:
+            sink = self._sink = get_log_sink(self.log_dir, **self._sink_options)
+        return sink
+    
+    @property
+    def logger(self) -> logging.Logger:
+        """共享输出所用的日志记录器"""
+        return self._get_sink().logger
+    
+    @property
+    def execution_id(self) -> Optional[str]:
+        """当前上下文中正在执行的代码的执行ID"""
+        current = _current_execution.get()
+        return current[0] if current is not None else None
+    
+    @property
+    def start_time(self) -> Optional[float]:
+        """当前上下文中正在执行的代码的开始时间"""
+        current = _current_execution.get()
+        return current[1] if current is not None else None
     
     def start_execution(self, execution_id: str, code: str, settings: Dict[str, Any]) -> None:
         """记录代码执行开始
@@ -55,12 +345,12 @@ class SecurityLogger:
             code: 要执行的代码
             settings: 沙箱设置
         """
-        self.execution_id = execution_id
-        self.start_time = time.time()
+        _current_execution.set((execution_id, time.time()))
         
-        self.logger.info(f"开始执行代码 [ID: {execution_id}]")
+        self.logger.info(f"开始执行代码 [ID: {execution_id}]", extra=_audit(
+            "start", execution_id, code=code, settings=dict(settings)))
         self.logger.info(f"代码内容:\n{code}")
-        self.logger.info(f"沙箱设置: {json.dumps(settings, indent=2)}")
+        self.logger.info("沙箱设置: %s", _JsonText(dict(settings)))
     
     def log_resource_usage(self, memory_mb: float, cpu_percent: float) -> None:
         """记录资源使用情况
@@ -70,7 +360,8 @@ class SecurityLogger:
             cpu_percent: CPU使用率(%)
         """
         if self.execution_id:
-            self.logger.info(f"资源使用 [ID: {self.execution_id}] - 内存: {memory_mb:.2f}MB, CPU: {cpu_percent:.2f}%")
+            self.logger.info("资源使用 [ID: %s] - 内存: %.2fMB, CPU: %.2f%%", self.execution_id, memory_mb, cpu_percent,
+                             extra=_audit("resource", self.execution_id, memory_mb=memory_mb, cpu_percent=cpu_percent))
     
     def log_file_access(self, path: str, operation: str, allowed: bool) -> None:
         """记录文件访问操作
@@ -81,7 +372,8 @@ class SecurityLogger:
             allowed: 是否允许访问
         """
         status = "允许" if allowed else "拒绝"
-        self.logger.warning(f"文件访问 [ID: {self.execution_id}] - {status} {operation} 文件 {path}")
+        self.logger.warning(f"文件访问 [ID: {self.execution_id}] - {status} {operation} 文件 {path}", extra=_audit(
+            "file_access", self.execution_id, path=path, operation=operation, allowed=allowed))
     
     def log_network_access(self, target: str, allowed: bool) -> None:
         """记录网络访问操作
@@ -91,7 +383,8 @@ class SecurityLogger:
             allowed: 是否允许访问
         """
         status = "允许" if allowed else "拒绝"
-        self.logger.warning(f"网络访问 [ID: {self.execution_id}] - {status} 访问 {target}")
+        self.logger.warning(f"网络访问 [ID: {self.execution_id}] - {status} 访问 {target}", extra=_audit(
+            "network_access", self.execution_id, target=target, allowed=allowed))
     
     def log_module_import(self, module: str, allowed: bool) -> None:
         """记录模块导入操作
@@ -101,7 +394,19 @@ class SecurityLogger:
             allowed: 是否允许导入
         """
         status = "允许" if allowed else "拒绝"
-        self.logger.info(f"模块导入 [ID: {self.execution_id}] - {status} 导入 {module}")
+        self.logger.info(f"模块导入 [ID: {self.execution_id}] - {status} 导入 {module}", extra=_audit(
+            "module_import", self.execution_id, module=module, allowed=allowed))
+    
+    def log_isolation(self, report: Dict[str, Any]) -> None:
+        """记录 isolated 模式下各隔离步骤是否生效，有步骤未生效时记录为 WARNING
+        
+        Args:
+            report: 隔离报告（见 sandbox.core.isolation.isolate）
+        """
+        missing = missing_steps(report)
+        level = logging.WARNING if missing else logging.INFO
+        self.logger.log(level, f"进程隔离 [ID: {self.execution_id}] - {format_isolation(report)}", extra=_audit(
+            "isolation", self.execution_id, missing=missing, **report))
     
     def log_error(self, error_type: str, message: str) -> None:
         """记录错误信息
@@ -110,7 +415,8 @@ class SecurityLogger:
             error_type: 错误类型
             message: 错误消息
         """
-        self.logger.error(f"执行错误 [ID: {self.execution_id}] - {error_type}: {message}")
+        self.logger.error(f"执行错误 [ID: {self.execution_id}] - {error_type}: {message}", extra=_audit(
+            "error", self.execution_id, error_type=error_type, message=message))
     
     def end_execution(self, status: str, result: Optional[Any] = None) -> None:
         """记录代码执行结束
@@ -121,10 +427,14 @@ class SecurityLogger:
         """
         if self.start_time:
             execution_time = time.time() - self.start_time
-            self.logger.info(f"执行结束 [ID: {self.execution_id}] - 状态: {status}, 耗时: {execution_time:.4f}秒")
+            self.logger.info(f"执行结束 [ID: {self.execution_id}] - 状态: {status}, 耗时: {execution_time:.4f}秒", extra=_audit(
+                "end", self.execution_id, status=status, duration=execution_time, result=result))
             
             if result:
                 self.logger.info(f"执行结果 [ID: {self.execution_id}]:\n{result}")
             
-            self.execution_id = None
-            self.start_time = None
\ No newline at end of file
+            _current_execution.set(None)
+    
+    def flush(self) -> None:
+        """异步模式下等待已入队的日志全部写入"""
+        self._get_sink().flush()
@@ -11,16 +11,60 @@ import json
 from sandbox.core.sandbox import Sandbox
 from sandbox.config.settings import SandboxSettings
 from sandbox.exceptions import SandboxError, ResourceLimitExceeded
+try:
+    from web.cache import (BYPASS, HIT, MISS, UNCACHEABLE, cache_key, create_result_cache, nondeterminism,
+                           nondeterministic_import)
+    from web.history import create_history_store
+except ImportError:
+    # 以脚本方式运行（python src/web/app.py）时 web 不是包
+    from cache import (BYPASS, HIT, MISS, UNCACHEABLE, cache_key, create_result_cache, nondeterminism,
+                       nondeterministic_import)
+    from history import create_history_store
 
 # 初始化Flask应用
 app = Flask(__name__)
 
-# 存储执行历史
-execution_history = []
+# 执行历史，记录结束后资源数据随记录一起保存和淘汰
+execution_history = create_history_store()
 
-# 存储实时资源使用数据
+# 历史列表每页的记录数
+HISTORY_PAGE_SIZE = 20
+
+# 执行中的实时资源使用数据
 resource_data = {}
 
+# /execute 的结果缓存，请求带 cache=true 时使用
+result_cache = create_result_cache()
+
+# 进程内共享的 Docker 沙箱，第一次 Docker 执行时创建
+_docker_sandbox = None
+_docker_sandbox_lock = threading.Lock()
+
+def get_docker_sandbox():
+    """获取进程内共享的 DockerSandbox
+
+    Flask 和 ASGI 的所有请求共用一个实例：Docker 客户端和镜像检查只做一次，
+    调度器看到全部执行中的容器，常驻容器池在请求之间保持预热。
+    节点和池大小来自环境变量 SANDBOX_DOCKER_ENDPOINTS（逗号分隔）和 SANDBOX_DOCKER_POOL_SIZE，
+    资源限制等设置按请求通过 run / _execute 的 settings 参数传入。
+
+    Returns:
+        DockerSandbox: 共享的 Docker 沙箱
+
+    Raises:
+        SandboxError: Docker 镜像不存在（创建失败时下次调用重试）
+    """
+    global _docker_sandbox
+    with _docker_sandbox_lock:
+        if _docker_sandbox is None:
+            from sandbox.docker.manager import DockerSandbox
+            endpoints = os.getenv('SANDBOX_DOCKER_ENDPOINTS', '')
+            _docker_sandbox = DockerSandbox(SandboxSettings(
+                docker_endpoints=[url for url in endpoints.split(',') if url],
+                docker_pool_size=int(os.getenv('SANDBOX_DOCKER_POOL_SIZE', 0))
+            ))
+        return _docker_sandbox
+
 class ResourceMonitor(threading.Thread):
     """资源监控线程"""
     
@@ -44,6 +88,7 @@ class ResourceMonitor(threading.Thread):
                 # 记录数据并打印调试信息
                 print(f"监控 - 内存: {memory_mb:.2f}MB, CPU: {cpu_percent:.2f}%")
                 
+                # self.data 即 resource_data 中本次执行的列表
                 self.data.append({
                     'timestamp': time.time(),
                     'memory_mb': memory_mb,
@@ -51,9 +96,6 @@ class ResourceMonitor(threading.Thread):
                     'elapsed_time': elapsed_time
                 })
                 
-                # 更新全局数据
-                resource_data[self.execution_id] = self.data
-                
                 time.sleep(0.1)
             except Exception as e:
                 print(f"资源监控错误: {str(e)}")
@@ -64,8 +106,99 @@ class ResourceMonitor(threading.Thread):
 
 @app.route('/')
 def index():
-    """返回首页"""
-    return render_template('index.html', history=execution_history)
+    """返回首页，历史记录按 page 参数分页"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    total = execution_history.count()
+    pages = max((total + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE, 1)
+    history = execution_history.list((page - 1) * HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE)
+    return render_template('index.html', history=history, page=page, pages=pages)
+
+def settings_from_form(form):
+    """根据 /execute 的表单构造沙箱设置
+    
+    Returns:
+        Tuple[SandboxSettings, bool]: 沙箱设置，以及是否在Docker容器中执行
+    """
+    settings = SandboxSettings(
+        max_memory_mb=int(form.get('max_memory_mb', 100)),
+        max_cpu_percent=int(form.get('max_cpu_percent', 50)),
+        max_execution_time=int(form.get('max_execution_time', 5)),
+        allow_file_operations=form.get('allow_file_operations') == 'true',
+        network_access=form.get('network_access') == 'true',
+        allow_imports=form.get('allow_imports') == 'true',
+        allowed_modules=form.get('allowed_modules', 'math,random,json').split(',')
+    )
+    return settings, form.get('use_docker') == 'true'
+
+def record_execution(execution_id, code, settings, start_time, status, result, error, usage, samples,
+                     imported_modules=None):
+    """把一次执行及其资源数据写入执行历史
+    
+    Args:
+        imported_modules: 执行中实际导入的模块，执行失败时为 None
+    
+    Returns:
+        dict: /execute 的响应内容
+    """
+    execution_time = time.time() - start_time
+    execution_record = {
+        'id': execution_id,
+        'timestamp': start_time,
+        'code': code,
+        'status': status,
+        'result': result,
+        'error': error,
+        'execution_time': execution_time,
+        'settings': settings.__dict__
+    }
+    response = {
+        'id': execution_id,
+        'status': status,
+        'result': result,
+        'error': error,
+        'execution_time': execution_time
+    }
+    if usage is not None:
+        # 容器统计得到的峰值，用于确定 mem_limit 和 cpu_quota
+        execution_record['peak_memory_mb'] = response['peak_memory_mb'] = usage.peak_memory_mb
+        execution_record['peak_cpu_percent'] = response['peak_cpu_percent'] = usage.peak_cpu_percent
+    if imported_modules is not None:
+        execution_record['imported_modules'] = response['imported_modules'] = sorted(imported_modules)
+    execution_history.add(execution_record, samples)
+    return response
+
+def lookup_cache(form, code, settings, use_docker):
+    """请求带 cache=true 时查询结果缓存
+    
+    Returns:
+        Tuple[Optional[str], Optional[dict]]: 缓存键（不使用缓存时为 None），以及命中时的响应（cache 为 hit）
+    """
+    if form.get('cache') != 'true' or not result_cache.enabled:
+        return None, None
+    key = cache_key(code, settings, use_docker)
+    response = result_cache.get(key)
+    if response is not None:
+        response['cache'] = HIT
+    return key, response
+
+def store_cache(key, code, settings, response):
+    """执行成功且结果确定时存入结果缓存
+    
+    源码检查之外，还要求执行中实际导入的模块（响应的 imported_modules）都是确定的，
+    动态拼接模块名等绕过源码检查的导入同样不会被缓存。
+    
+    Returns:
+        str: 缓存状态，写入响应的 cache 字段
+    """
+    if key is None:
+        return BYPASS
+    if response['status'] != "成功" or nondeterminism(code, settings) is not None:
+        return UNCACHEABLE
+    imported_modules = response.get('imported_modules')
+    if imported_modules is None or nondeterministic_import(imported_modules) is not None:
+        return UNCACHEABLE
+    result_cache.put(key, response)
+    return MISS
 
 @app.route('/execute', methods=['POST'])
 def execute_code():
@@ -73,43 +206,46 @@ def execute_code():
     code = request.form.get('code', '')
     
     # 获取沙箱设置
-    max_memory_mb = int(request.form.get('max_memory_mb', 100))
-    max_cpu_percent = int(request.form.get('max_cpu_percent', 50))
-    max_execution_time = int(request.form.get('max_execution_time', 5))
-    allow_file_operations = request.form.get('allow_file_operations') == 'true'
-    network_access = request.form.get('network_access') == 'true'
-    allow_imports = request.form.get('allow_imports') == 'true'
-    allowed_modules = request.form.get('allowed_modules', 'math,random,json').split(',')
+    settings, use_docker = settings_from_form(request.form)
+    
+    # 相同代码和设置的确定性结果直接返回
+    key, cached = lookup_cache(request.form, code, settings, use_docker)
+    if cached is not None:
+        return jsonify(cached)
     
     # 打印调试信息
     print(f"执行代码: {code}")
     
-    settings = SandboxSettings(
-        max_memory_mb=max_memory_mb,
-        max_cpu_percent=max_cpu_percent,
-        max_execution_time=max_execution_time,
-        allow_file_operations=allow_file_operations,
-        network_access=network_access,
-        allow_imports=allow_imports,
-        allowed_modules=allowed_modules
-    )
-    
-    sandbox = Sandbox(settings, enable_logging=True)
-    
     execution_id = str(uuid.uuid4())
     start_time = time.time()
+    usage = None
+    imported_modules = None
     
-    # 创建当前进程的监控器
-    import psutil
-    current_process = psutil.Process()
-    
-    # 启动资源监控线程
-    monitor = ResourceMonitor(execution_id, current_process)
-    monitor.start()
+    if use_docker:
+        # 容器的资源数据来自 Docker stats 流，而不是 Flask 进程
+        samples = resource_data[execution_id] = []
+        monitor = None
+    else:
+        sandbox = Sandbox(settings, enable_logging=True)
+        
+        # 创建当前进程的监控器
+        import psutil
+        current_process = psutil.Process()
+        
+        # 启动资源监控线程
+        monitor = ResourceMonitor(execution_id, current_process)
+        resource_data[execution_id] = monitor.data
+        monitor.start()
     
     try:
         # 执行代码
-        result = sandbox.execute(code)
+        if use_docker:
+            execution = get_docker_sandbox().run(code, on_sample=samples.append, settings=settings)
+            result, usage = execution.value, execution.usage
+        else:
+            execution = sandbox.run(code)
+            result = execution.value
+        imported_modules = execution.imported_modules
         status = "成功"
         error = None
         print(f"执行成功，结果: {result}")
@@ -120,66 +256,54 @@ def execute_code():
         print(f"执行失败，错误: {error}")
     finally:
         # 停止资源监控
-        monitor.stop()
-        monitor.join(timeout=1.0)  # 等待监控线程结束
+        if monitor is not None:
+            monitor.stop()
+            monitor.join(timeout=1.0)  # 等待监控线程结束
         
-        # 计算执行时间
-        execution_time = time.time() - start_time
-        
-        # 打印资源数据
-        if execution_id in resource_data:
-            print(f"资源数据点数量: {len(resource_data[execution_id])}")
+        # 资源数据移入历史记录
+        samples = list(resource_data.pop(execution_id, None) or [])
+        if samples:
+            print(f"资源数据点数量: {len(samples)}")
         else:
             print("没有收集到资源数据")
     
     # 记录执行历史
-    execution_record = {
-        'id': execution_id,
-        'timestamp': start_time,
-        'code': code,
-        'status': status,
-        'result': result,
-        'error': error,
-        'execution_time': execution_time,
-        'settings': settings.__dict__
-    }
-    execution_history.insert(0, execution_record)
+    response = record_execution(execution_id, code, settings, start_time, status, result, error, usage, samples,
+                                imported_modules)
+    response['cache'] = store_cache(key, code, settings, response)
     
-    return jsonify({
-        'id': execution_id,
-        'status': status,
-        'result': result,
-        'error': error,
-        'execution_time': execution_time
-    })
+    return jsonify(response)
 
 @app.route('/resource_data/<execution_id>')
 def get_resource_data(execution_id):
     """获取资源使用数据"""
-    if execution_id in resource_data:
-        return jsonify(resource_data[execution_id])
-    return jsonify([])
+    samples = resource_data.get(execution_id)
+    if samples is None:
+        samples = execution_history.get_samples(execution_id)
+    return jsonify(list(samples or []))
 
 @app.route('/history/<execution_id>')
 def get_execution_detail(execution_id):
     """获取执行详情"""
-    for record in execution_history:
-        if record['id'] == execution_id:
-            return render_template('detail.html', record=record)
-    return "执行记录不存在", 404
+    record = execution_history.get(execution_id)
+    if record is None:
+        return "执行记录不存在", 404
+    return render_template('detail.html', record=record)
 
 @app.route('/test_api', methods=['GET'])
 def test_api():
     """测试API是否正常工作"""
-    # 创建一些测试数据
-    test_data = [
+    return jsonify(sample_resource_data())
+
+def sample_resource_data():
+    """生成一组资源数据，用于测试图表"""
+    return [
         {'timestamp': time.time() - 5, 'memory_mb': 10.0, 'cpu_percent': 5.0, 'elapsed_time': 0.0},
         {'timestamp': time.time() - 4, 'memory_mb': 20.0, 'cpu_percent': 15.0, 'elapsed_time': 1.0},
         {'timestamp': time.time() - 3, 'memory_mb': 30.0, 'cpu_percent': 25.0, 'elapsed_time': 2.0},
         {'timestamp': time.time() - 2, 'memory_mb': 40.0, 'cpu_percent': 35.0, 'elapsed_time': 3.0},
         {'timestamp': time.time() - 1, 'memory_mb': 50.0, 'cpu_percent': 45.0, 'elapsed_time': 4.0},
     ]
-    return jsonify(test_data)
 
 def run_server(host='0.0.0.0', port=5000, debug=False):
     """运行Web服务器"""
@@ -0,0 +1,373 @@
+"""
+Web UI 的 ASGI 版本（FastAPI），路由与 app.py 相同
+
+执行交给有界线程池，请求协程只等待执行结果而不占用线程，一个进程可以同时保持大量未完成的请求；
+事件循环上不运行任何阻塞的执行，健康检查在执行池饱和时仍然立即响应。
+另外提供 Server-Sent Events 推送接口，增量推送资源采样、输出和最终状态，支持断线续传；
+以及异步任务接口 /jobs，任务按优先级类别排队，队列满时返回 429。
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+import psutil
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.templating import Jinja2Templates
+
+from sandbox.config.settings import SandboxSettings
+from sandbox.core.accounting import ExecutionResult
+from sandbox.core.cancel import CancelToken
+from sandbox.core.sandbox import Sandbox
+from sandbox.docker.dispatcher import STARTUP_GRACE, AsyncDispatcher
+try:
+    from web.app import (HISTORY_PAGE_SIZE, execution_history, get_docker_sandbox, lookup_cache, record_execution,
+                         resource_data, sample_resource_data, settings_from_form, store_cache)
+    from web.events import DEFAULT_MAX_OUTPUT, STATUS, EventStore, ExecutionEvents, format_event
+    from web.jobs import (BATCH, CANCELLED_STATUS, INTERACTIVE, PRIORITIES, ExecutionTimeEstimate, Job,
+                          job_from_record)
+except ImportError:
+    # 以脚本方式运行（python src/web/asgi.py）时 web 不是包
+    from app import (HISTORY_PAGE_SIZE, execution_history, get_docker_sandbox, lookup_cache, record_execution,
+                     resource_data, sample_resource_data, settings_from_form, store_cache)
+    from events import DEFAULT_MAX_OUTPUT, STATUS, EventStore, ExecutionEvents, format_event
+    from jobs import (BATCH, CANCELLED_STATUS, INTERACTIVE, PRIORITIES, ExecutionTimeEstimate, Job,
+                      job_from_record)
+
+# 执行线程数，即同时执行的最大任务数
+WORKERS = int(os.getenv('SANDBOX_WORKERS', 0)) or min(os.cpu_count() or 1, 8)
+# 排队等待执行的最大交互任务数（含 /execute），超出时返回 429
+QUEUE_SIZE = int(os.getenv('SANDBOX_QUEUE_SIZE', 1000))
+# 批量任务同时执行的最大数，其余执行线程留给交互任务
+BATCH_WORKERS = min(int(os.getenv('SANDBOX_BATCH_WORKERS', 0)) or max(WORKERS - 1, 1), WORKERS)
+# 排队等待执行的最大批量任务数，超出时返回 429
+BATCH_QUEUE_SIZE = int(os.getenv('SANDBOX_BATCH_QUEUE_SIZE', QUEUE_SIZE))
+# 超时或取消后等待执行线程结束的最长时间（秒），超出时放弃该线程、释放执行名额
+CANCEL_GRACE = float(os.getenv('SANDBOX_CANCEL_GRACE', 5))
+# 最多放弃的执行线程数，线程池为它们预留线程
+MAX_ABANDONED = int(os.getenv('SANDBOX_MAX_ABANDONED', 0)) or WORKERS
+# 资源采样间隔（秒）
+SAMPLE_INTERVAL = 0.1
+
+# 执行中和最近结束的执行的事件日志，供 /stream 推送和续传
+event_store = EventStore(int(os.getenv('SANDBOX_STREAM_RETENTION', 100)),
+                         int(os.getenv('SANDBOX_STREAM_MAX_OUTPUT', DEFAULT_MAX_OUTPUT)))
+
+# 尚未结束的任务（含 /execute 的执行），结束后只保留在执行历史中
+jobs: Dict[str, Job] = {}
+
+templates = Jinja2Templates(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'))
+
+
+def _run(code: str, token: CancelToken, settings: SandboxSettings, use_docker: bool,
+         events: ExecutionEvents) -> ExecutionResult:
+    """在执行线程中运行代码，输出写入事件日志，取消令牌被取消时中断执行"""
+    events.started_time = time.time()
+    if use_docker:
+        # 容器的资源数据来自 Docker stats 流；所有请求共用一个 DockerSandbox 及其调度器和容器池
+        return get_docker_sandbox()._execute(code, token, events.output, events.add_sample, settings)
+    return Sandbox(settings, enable_logging=True)._execute(code, token, output=events.output)
+
+
+class ProcessSampler:
+    """事件循环上的单个采样任务，代替每个请求一个的 ResourceMonitor 线程
+
+    每个间隔读取一次服务进程的内存和 CPU，追加到所有执行中（非 Docker）的资源数据中。
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.executions: Dict[str, ExecutionEvents] = {}  # 执行ID -> 事件日志
+        self._process = psutil.Process()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.executions:
+                continue
+            now = time.time()
+            memory_mb = self._process.memory_info().rss / 1024 / 1024
+            cpu_percent = self._process.cpu_percent()
+            for events in self.executions.values():
+                events.add_sample({
+                    'timestamp': now,
+                    'memory_mb': memory_mb,
+                    'cpu_percent': cpu_percent,
+                    'elapsed_time': now - events.start_time
+                })
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 放弃的执行线程仍占用线程池中的线程，为它们预留 MAX_ABANDONED 个
+    executor = ThreadPoolExecutor(WORKERS + MAX_ABANDONED, thread_name_prefix="sandbox-web")
+    # 队列长度按优先级类别在 _submit 中限制
+    app.state.dispatcher = AsyncDispatcher(_run, WORKERS, executor=executor,
+                                           priority_limits={PRIORITIES[BATCH]: BATCH_WORKERS},
+                                           cancel_grace=CANCEL_GRACE, max_abandoned=MAX_ABANDONED)
+    app.state.sampler = ProcessSampler()
+    app.state.sampler.start()
+    app.state.estimate = ExecutionTimeEstimate()
+    try:
+        yield
+    finally:
+        await app.state.sampler.stop()
+        await app.state.dispatcher.close()
+        executor.shutdown(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get('/', response_class=HTMLResponse)
+async def index(request: Request, page: int = 1):
+    """返回首页，历史记录按 page 参数分页"""
+    page = max(page, 1)
+    total = execution_history.count()
+    pages = max((total + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE, 1)
+    history = execution_history.list((page - 1) * HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE)
+    return templates.TemplateResponse(request, 'index.html', {'history': history, 'page': page, 'pages': pages})
+
+
+@app.post('/execute')
+async def execute_code(request: Request):
+    """把代码作为交互任务交给执行池并等待结果
+
+    表单中 stream=true 时立即返回 Server-Sent Events 流（与 /stream 相同），第一个事件 start 带有执行ID；
+    执行不随推送连接断开而取消，可用 /stream 续传。否则等待执行结束后返回结果，请求协程被取消时，
+    排队或执行中的任务随之取消。交互任务的等待队列已满时返回 429。
+    表单中 cache=true 时相同代码和设置的确定性结果直接从结果缓存返回，不再执行。
+    """
+    form = await request.form()
+    settings, use_docker = settings_from_form(form)
+    key, cached = lookup_cache(form, form.get('code', ''), settings, use_docker)
+    if cached is not None:
+        return cached
+    job = _submit(request.app, form, INTERACTIVE, key)
+    if not isinstance(job, Job):
+        return job
+    if form.get('stream') == 'true':
+        return _event_stream(job.events, 0)
+    return await job.task
+
+
+@app.post('/jobs', status_code=202)
+async def submit_job(request: Request):
+    """提交异步任务，立即返回任务ID
+
+    表单字段与 /execute 相同，另有 priority（interactive 或 batch，默认 batch）。
+    该优先级类别的等待队列已满时返回 429，Retry-After 为估计的排队时间。
+    """
+    form = await request.form()
+    priority_class = form.get('priority', BATCH)
+    if priority_class not in PRIORITIES:
+        return JSONResponse({'error': f"未知的优先级: {priority_class}"}, status_code=400)
+    job = _submit(request.app, form, priority_class)
+    if not isinstance(job, Job):
+        return job
+    return JSONResponse(job.to_dict(), status_code=202, headers={'Location': f"/jobs/{job.id}"})
+
+
+@app.get('/jobs/{job_id}')
+async def get_job(job_id: str):
+    """查询任务状态：queued、running、succeeded、failed 或 cancelled，结束后 result 为执行结果"""
+    job = jobs.get(job_id)
+    if job is not None:
+        return job.to_dict()
+    record = execution_history.get(job_id)
+    if record is None:
+        return JSONResponse({'error': "任务不存在"}, status_code=404)
+    return job_from_record(record)
+
+
+@app.post('/jobs/{job_id}/cancel')
+async def cancel_job(job_id: str):
+    """取消任务：排队中的任务不再执行，执行中的任务被中断；任务已结束时返回 409"""
+    job = jobs.get(job_id)
+    if job is None:
+        if execution_history.get(job_id) is None:
+            return JSONResponse({'error': "任务不存在"}, status_code=404)
+        return JSONResponse({'error': "任务已结束"}, status_code=409)
+    job.cancel()
+    return job.to_dict()
+
+
+def _submit(app: FastAPI, form, priority_class: str, key: Optional[str] = None):
+    """创建事件日志并把任务交给调度器，key 为结果缓存键（不使用缓存时为 None）
+
+    Returns:
+        Job 或 429 响应
+    """
+    dispatcher = app.state.dispatcher
+    priority = PRIORITIES[priority_class]
+    queue_size, workers = (QUEUE_SIZE, WORKERS) if priority_class == INTERACTIVE else (BATCH_QUEUE_SIZE, BATCH_WORKERS)
+    queued = dispatcher.queued_at(priority)
+    if queue_size and queued >= queue_size:
+        retry_after = app.state.estimate.retry_after(queued, workers)
+        return JSONResponse({'error': f"排队的{priority_class}任务过多: 已有 {queued} 个任务等待"},
+                            status_code=429, headers={'Retry-After': str(retry_after)})
+
+    code = form.get('code', '')
+    settings, use_docker = settings_from_form(form)
+    events = event_store.create(str(uuid.uuid4()))
+    # 与 DockerSandbox.submit 相同，为容器启动预留时间；本地执行由沙箱自己按 max_execution_time 终止，
+    # 调度器的超时只在沙箱没能及时结束时生效
+    timeout = settings.max_execution_time + STARTUP_GRACE
+    future = dispatcher.submit(code, timeout, settings, use_docker, events, priority=priority)
+
+    job = jobs[events.execution_id] = Job(priority_class, events, future)
+    resource_data[job.id] = events.samples
+    if not use_docker:
+        app.state.sampler.executions[job.id] = events
+    job.task = asyncio.create_task(_complete(app, future, code, settings, use_docker, events, key))
+    job.task.add_done_callback(lambda _: jobs.pop(job.id, None))
+    return job
+
+
+async def _complete(app: FastAPI, future: asyncio.Future, code: str, settings: SandboxSettings,
+                    use_docker: bool, events: ExecutionEvents, key: Optional[str] = None) -> dict:
+    """等待执行结束，写入执行历史和结果缓存并追加最终状态"""
+    execution_id = events.execution_id
+    usage = None
+    imported_modules = None
+    try:
+        execution = await future
+        result, usage = execution.value, (execution.usage if use_docker else None)
+        imported_modules = execution.imported_modules
+        status = "成功"
+        error = None
+    except asyncio.CancelledError:
+        # 任务被取消，或等待结果的 /execute 请求被取消；记录后结束，不再向上传播
+        status = CANCELLED_STATUS
+        result = None
+        error = "执行已取消"
+    except Exception as e:
+        status = "执行失败"
+        result = None
+        error = str(e)
+    finally:
+        app.state.sampler.executions.pop(execution_id, None)
+        resource_data.pop(execution_id, None)
+    if events.started_time is not None and status != CANCELLED_STATUS:
+        # 被取消的任务提前结束，执行时长不代表正常任务
+        app.state.estimate.update(time.time() - events.started_time)
+
+    response = record_execution(execution_id, code, settings, events.start_time, status, result, error,
+                                usage, list(events.samples), imported_modules)
+    response['cache'] = store_cache(key, code, settings, response)
+    event_store.finish(execution_id, response)
+    return response
+
+
+def _event_stream(events: ExecutionEvents, offset: int) -> StreamingResponse:
+    async def body() -> AsyncIterator[str]:
+        async for event in events.follow(offset):
+            # 保活注释，防止代理关闭空闲连接
+            yield format_event(*event) if event is not None else ": keepalive\n\n"
+
+    return StreamingResponse(body(), media_type="text/event-stream",
+                             headers={'Cache-Control': "no-cache", 'X-Accel-Buffering': "no"})
+
+
+@app.get('/stream/{execution_id}')
+async def stream_events(request: Request, execution_id: str, offset: Optional[int] = None):
+    """以 Server-Sent Events 推送一次执行的事件
+
+    事件类型为 start、sample（资源采样点）、stdout / stderr（输出块）和 status（最终状态，即 /execute 的结果），
+    每个事件的 id 是其编号。续传时用 offset 参数指定第一个要接收的编号，或由浏览器自动带上
+    Last-Event-ID 请求头（从其下一个编号开始）。事件日志已被淘汰时只推送最终状态。
+    """
+    if offset is None:
+        last_event_id = request.headers.get('last-event-id', '')
+        offset = int(last_event_id) + 1 if last_event_id.isdigit() else 0
+
+    events = event_store.get(execution_id)
+    if events is not None:
+        return _event_stream(events, offset)
+
+    record = execution_history.get(execution_id)
+    if record is None:
+        return PlainTextResponse("执行记录不存在", status_code=404)
+    status = {key: record.get(key) for key in ('id', 'status', 'result', 'error', 'execution_time')}
+    return StreamingResponse(iter([format_event(None, STATUS, status)]), media_type="text/event-stream")
+
+
+@app.get('/resource_data/{execution_id}')
+async def get_resource_data(execution_id: str):
+    """获取资源使用数据"""
+    samples = resource_data.get(execution_id)
+    if samples is None:
+        samples = execution_history.get_samples(execution_id)
+    return list(samples or [])
+
+
+@app.get('/history/{execution_id}', response_class=HTMLResponse)
+async def get_execution_detail(request: Request, execution_id: str):
+    """获取执行详情"""
+    record = execution_history.get(execution_id)
+    if record is None:
+        return PlainTextResponse("执行记录不存在", status_code=404)
+    return templates.TemplateResponse(request, 'detail.html', {'record': record})
+
+
+@app.get('/test_api')
+async def get_test_api():
+    """测试API是否正常工作"""
+    return sample_resource_data()
+
+
+@app.get('/healthz')
+async def healthz():
+    """存活检查：事件循环能够响应即为存活"""
+    return {'status': "ok"}
+
+
+@app.get('/readyz')
+async def readyz(request: Request):
+    """就绪检查：返回执行池和各优先级类别的使用情况，交互任务的等待队列已满时返回 503"""
+    dispatcher = request.app.state.dispatcher
+    body = {
+        'status': "ok",
+        'workers': dispatcher.max_in_flight,
+        'in_flight': dispatcher.in_flight,
+        'queued': dispatcher.queued,
+        'abandoned': dispatcher.abandoned
+    }
+    for priority_class, queue_size, workers in ((INTERACTIVE, QUEUE_SIZE, WORKERS),
+                                                (BATCH, BATCH_QUEUE_SIZE, BATCH_WORKERS)):
+        priority = PRIORITIES[priority_class]
+        body[priority_class] = {
+            'workers': workers,
+            'in_flight': dispatcher.running_at(priority),
+            'queued': dispatcher.queued_at(priority),
+            'queue_size': queue_size
+        }
+    if QUEUE_SIZE and dispatcher.queued_at(PRIORITIES[INTERACTIVE]) >= QUEUE_SIZE:
+        body['status'] = "busy"
+        return JSONResponse(body, status_code=503)
+    return body
+
+
+def run_server(host='0.0.0.0', port=5000):
+    """运行ASGI服务器"""
+    import uvicorn
+    uvicorn.run(app, host=host, port=port)
+
+
+if __name__ == '__main__':
+    run_server()
@@ -0,0 +1,171 @@
+"""
+执行结果缓存
+/execute 的可选缓存：代码和沙箱设置完全相同的确定性代码片段直接返回保存的结果，不再执行
+"""
+
+import ast
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sandbox.config.settings import SandboxSettings
+
+# 缓存状态，随 /execute 的响应返回
+HIT = "hit"  # 返回保存的结果，没有执行
+MISS = "miss"  # 已执行，结果已存入缓存
+UNCACHEABLE = "uncacheable"  # 已执行，结果不确定或执行失败，不缓存
+BYPASS = "bypass"  # 请求未启用缓存或缓存已禁用
+
+# 结果不确定的模块（按模块名前缀匹配，numpy.random 包括其子模块）
+NONDETERMINISTIC_MODULES = frozenset({
+    'random', 'secrets', 'uuid', 'time', 'datetime', 'os', 'sys', 'socket', 'ssl',
+    'urllib', 'http', 'requests', 'subprocess', 'threading', 'multiprocessing', 'numpy.random'
+})
+
+# 默认缓存容量和有效期（秒）
+DEFAULT_CAPACITY = 256
+DEFAULT_TTL = 60.0
+
+
+def cache_key(code: str, settings: SandboxSettings, use_docker: bool = False) -> str:
+    """代码哈希与沙箱设置指纹组成的缓存键
+
+    Args:
+        code: 要执行的代码
+        settings: 沙箱设置，所有字段都参与指纹（资源限制不同时执行结果可能不同）
+        use_docker: 是否在Docker容器中执行
+
+    Returns:
+        str: 缓存键
+    """
+    fingerprint = json.dumps([asdict(settings), use_docker], sort_keys=True, default=repr)
+    digest = hashlib.sha256(code.encode('utf-8', 'surrogatepass')).hexdigest()
+    return f"{digest}:{hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()}"
+
+
+def nondeterministic_import(modules: Iterable[str]) -> Optional[str]:
+    """找出结果不确定的模块
+
+    Args:
+        modules: 模块名，from 导入记为 包名.名称
+
+    Returns:
+        Optional[str]: 第一个结果不确定的模块名，没有时为 None
+    """
+    for name in modules:
+        parts = name.split('.')
+        for i in range(1, len(parts) + 1):
+            if '.'.join(parts[:i]) in NONDETERMINISTIC_MODULES:
+                return name
+    return None
+
+
+def nondeterminism(code: str, settings: SandboxSettings) -> Optional[str]:
+    """执行前判断代码的结果是否可能不确定
+
+    按源码中的 import 语句和以常量为参数的 __import__ 调用判断；动态导入（参数不是常量）、
+    允许文件操作或网络访问时同样视为不确定。静态检查可以绕过（例如经 __builtins__ 取得
+    __import__），是否缓存最终按执行中实际导入的模块（nondeterministic_import）判断。
+
+    Args:
+        code: 要执行的代码
+        settings: 沙箱设置
+
+    Returns:
+        Optional[str]: 不确定的原因，结果确定时为 None
+    """
+    if settings.allow_file_operations or settings.network_access:
+        return "允许文件操作或网络访问"
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return "语法错误"
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module or ""
+            names = [module] + [f"{module}.{alias.name}" for alias in node.names]
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == '__import__':
+            argument = node.args[0] if node.args else None
+            if not (isinstance(argument, ast.Constant) and isinstance(argument.value, str)):
+                return "动态导入模块"
+            names = [argument.value]
+        else:
+            continue
+        name = nondeterministic_import(names)
+        if name is not None:
+            return f"导入了结果不确定的模块: {name}"
+    return None
+
+
+class ResultCache:
+    """有效期加容量上限（LRU 淘汰）的执行结果缓存，线程安全"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, ttl: float = DEFAULT_TTL):
+        """
+        Args:
+            capacity: 最多缓存的结果数，0 表示禁用
+            ttl: 结果的有效期（秒）
+        """
+        self.capacity = max(capacity, 0)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """获取未过期的结果
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[Dict[str, Any]]: 保存的 /execute 响应，不存在或已过期时为 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, key: str, response: Dict[str, Any]) -> None:
+        """保存结果，超出容量时淘汰最近最少使用的结果"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, dict(response))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """获取缓存统计信息：命中数、未命中数、当前条目数和容量"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'capacity': self.capacity}
+
+
+def create_result_cache() -> ResultCache:
+    """按环境变量 SANDBOX_RESULT_CACHE_SIZE（容量，0 表示禁用）和 SANDBOX_RESULT_CACHE_TTL（有效期，秒）创建结果缓存"""
+    return ResultCache(int(os.getenv('SANDBOX_RESULT_CACHE_SIZE', DEFAULT_CAPACITY)),
+                       float(os.getenv('SANDBOX_RESULT_CACHE_TTL', DEFAULT_TTL)))
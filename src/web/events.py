@@ -0,0 +1,172 @@
+"""
+执行事件日志
+一次执行的资源采样、输出块和最终状态按发生顺序编号，推送接口按编号增量发送，断线后从任意编号续传
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+# 事件类型：start 执行开始，sample 资源采样，stdout / stderr 输出块，truncated 输出超出上限、
+# 之后的输出被丢弃，status 最终状态（最后一个事件）
+START = "start"
+SAMPLE = "sample"
+TRUNCATED = "truncated"
+STATUS = "status"
+
+# 默认保留的已结束执行的事件日志数
+DEFAULT_RETENTION = 100
+# 每个执行默认保留的输出上限（字节，按 UTF-8 编码计）
+DEFAULT_MAX_OUTPUT = 1024 * 1024
+# 每个执行最多保留的资源采样数，按默认采样间隔约为 5 分钟
+DEFAULT_MAX_SAMPLES = 3000
+# 没有新事件时发送保活注释的间隔（秒）
+KEEPALIVE_INTERVAL = 15.0
+
+
+class ExecutionEvents:
+    """一次执行的事件日志
+
+    事件可以在任意线程中追加（执行线程写入输出和容器采样），读取方在事件循环中等待新事件。
+    事件只追加不修改，编号即其在日志中的下标。输出和采样有上限，执行中和保留的日志大小都有界：
+    输出超出上限时截断到上限并追加一个 truncated 事件，之后的输出被丢弃；采样超出上限后不再记录。
+    """
+
+    def __init__(self, execution_id: str, loop: asyncio.AbstractEventLoop,
+                 max_output: int = DEFAULT_MAX_OUTPUT, max_samples: int = DEFAULT_MAX_SAMPLES):
+        """
+        Args:
+            execution_id: 执行ID
+            loop: 读取方所在的事件循环
+            max_output: 保留的输出上限（字节）
+            max_samples: 保留的资源采样数上限
+        """
+        self.execution_id = execution_id
+        self.max_output = max(max_output, 0)
+        self.max_samples = max(max_samples, 0)
+        self.output_bytes = 0
+        self.truncated = False
+        self.start_time = time.time()
+        self.started_time: Optional[float] = None  # 开始执行的时间，排队中为 None
+        self.events: List[Tuple[str, Any]] = []
+        self.samples: List[Dict[str, float]] = []  # 资源采样，同时供 /resource_data 轮询
+        self.finished = False
+        self._loop = loop
+        self._changed = asyncio.Event()
+        self.append(START, {'id': execution_id, 'timestamp': self.start_time})
+
+    def append(self, kind: str, data: Any) -> None:
+        """追加一个事件，可在任意线程中调用"""
+        # list.append 是原子操作，读取方只读取已追加的前缀
+        self.events.append((kind, data))
+        try:
+            self._loop.call_soon_threadsafe(self._changed.set)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def add_sample(self, sample: Dict[str, float]) -> None:
+        """追加一个资源采样点，超出上限时丢弃"""
+        if len(self.samples) >= self.max_samples:
+            return
+        self.samples.append(sample)
+        self.append(SAMPLE, sample)
+
+    def output(self, kind: str, text: str) -> None:
+        """接收沙箱代码的输出块（OutputSink），超出输出上限的部分被丢弃"""
+        if self.truncated:
+            return
+        data = text.encode('utf-8', 'surrogatepass')
+        remaining = self.max_output - self.output_bytes
+        if len(data) > remaining:
+            # 截断到上限，不拆开多字节字符
+            text = data[:remaining].decode('utf-8', 'ignore')
+            self.truncated = True
+        if text:
+            self.output_bytes += len(text.encode('utf-8', 'surrogatepass'))
+            self.append(kind, text)
+        if self.truncated:
+            self.append(TRUNCATED, {'limit': self.max_output})
+
+    def finish(self, status: Dict[str, Any]) -> None:
+        """追加最终状态，之后不再有新事件"""
+        self.append(STATUS, status)
+        self.finished = True
+
+    async def follow(self, offset: int = 0,
+                     keepalive: float = KEEPALIVE_INTERVAL) -> AsyncIterator[Optional[Tuple[int, str, Any]]]:
+        """从编号 offset 起依次产出事件，直到最终状态
+
+        Args:
+            offset: 第一个要产出的事件编号
+            keepalive: 超过该时长（秒）没有新事件时产出一次 None
+
+        Yields:
+            Optional[Tuple[int, str, Any]]: (编号, 类型, 数据)，保活时为 None
+        """
+        index = max(offset, 0)
+        while True:
+            while index < len(self.events):
+                kind, data = self.events[index]
+                yield index, kind, data
+                index += 1
+                if kind == STATUS:
+                    return
+            if self.finished:
+                return
+            # 检查与清除之间不会让出事件循环，set 只在事件循环中执行，不会丢失唤醒
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class EventStore:
+    """执行中和最近结束的执行的事件日志
+
+    执行中的日志一直保留；结束后最多保留 retention 个，超出时淘汰最早结束的。
+    每个日志的输出和采样数有上限，保留的日志总大小约为 retention * max_output。
+    """
+
+    def __init__(self, retention: int = DEFAULT_RETENTION, max_output: int = DEFAULT_MAX_OUTPUT,
+                 max_samples: int = DEFAULT_MAX_SAMPLES):
+        """
+        Args:
+            retention: 保留的已结束执行的事件日志数
+            max_output: 每个执行保留的输出上限（字节）
+            max_samples: 每个执行保留的资源采样数上限
+        """
+        self.retention = max(retention, 0)
+        self.max_output = max_output
+        self.max_samples = max_samples
+        self._live: Dict[str, ExecutionEvents] = {}
+        self._finished: "OrderedDict[str, ExecutionEvents]" = OrderedDict()
+
+    def create(self, execution_id: str) -> ExecutionEvents:
+        """为一次执行创建事件日志，必须在事件循环中调用"""
+        events = self._live[execution_id] = ExecutionEvents(execution_id, asyncio.get_running_loop(),
+                                                            self.max_output, self.max_samples)
+        return events
+
+    def get(self, execution_id: str) -> Optional[ExecutionEvents]:
+        events = self._live.get(execution_id)
+        if events is None:
+            events = self._finished.get(execution_id)
+        return events
+
+    def finish(self, execution_id: str, status: Dict[str, Any]) -> None:
+        """追加最终状态并把日志移入已结束的执行"""
+        events = self._live.pop(execution_id)
+        events.finish(status)
+        self._finished[execution_id] = events
+        while len(self._finished) > self.retention:
+            self._finished.popitem(last=False)
+
+
+def format_event(index: Optional[int], kind: str, data: Any) -> str:
+    """按 Server-Sent Events 格式编码一个事件，id 为事件编号，为 None 时不带 id"""
+    event = f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False, default=repr)}\n\n"
+    return event if index is None else f"id: {index}\n{event}"
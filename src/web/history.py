@@ -0,0 +1,161 @@
+"""
+执行历史存储
+默认使用有容量上限的内存环形缓冲区，可选 SQLite 持久化；两者都按执行ID 常数时间查询并支持分页
+"""
+
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+
+# 默认最多保留的执行记录数
+DEFAULT_CAPACITY = 1000
+
+
+class HistoryStore(ABC):
+    """执行历史存储接口
+
+    每条记录是 /execute 生成的字典（至少包含 id 和 timestamp），资源采样随记录一起保存和淘汰。
+    """
+
+    @abstractmethod
+    def add(self, record: Dict[str, Any], samples: Optional[List[Dict[str, float]]] = None) -> None:
+        """保存一条执行记录及其资源采样"""
+
+    @abstractmethod
+    def get(self, execution_id: str) -> Optional[Dict[str, Any]]:
+        """按执行ID 获取记录，不存在时返回 None"""
+
+    @abstractmethod
+    def get_samples(self, execution_id: str) -> Optional[List[Dict[str, float]]]:
+        """按执行ID 获取资源采样，不存在时返回 None"""
+
+    @abstractmethod
+    def list(self, offset: int = 0, limit: int = 20) -> List[Dict[str, Any]]:
+        """按时间从新到旧分页列出记录"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """记录总数"""
+
+
+class MemoryHistoryStore(HistoryStore):
+    """内存环形缓冲区：超过容量时淘汰最早的记录"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        """
+        Args:
+            capacity: 最多保留的记录数
+        """
+        self.capacity = max(capacity, 1)
+        self._records: "OrderedDict[str, Tuple[Dict[str, Any], Optional[List[Dict[str, float]]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, record: Dict[str, Any], samples: Optional[List[Dict[str, float]]] = None) -> None:
+        with self._lock:
+            self._records[record['id']] = (record, samples)
+            self._records.move_to_end(record['id'])
+            while len(self._records) > self.capacity:
+                self._records.popitem(last=False)
+
+    def get(self, execution_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._records.get(execution_id)
+        return entry[0] if entry is not None else None
+
+    def get_samples(self, execution_id: str) -> Optional[List[Dict[str, float]]]:
+        entry = self._records.get(execution_id)
+        return entry[1] if entry is not None else None
+
+    def list(self, offset: int = 0, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = islice(reversed(self._records.values()), offset, offset + limit)
+            return [record for record, _ in entries]
+
+    def count(self) -> int:
+        return len(self._records)
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """SQLite 存储：主键为执行ID，按时间戳建索引，重启后保留历史"""
+
+    def __init__(self, path: str, capacity: Optional[int] = None):
+        """
+        Args:
+            path: 数据库文件路径
+            capacity: 最多保留的记录数，为 None 时不淘汰
+        """
+        self.capacity = capacity
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS executions ("
+                "id TEXT PRIMARY KEY, timestamp REAL NOT NULL, record TEXT NOT NULL, samples TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS executions_timestamp ON executions (timestamp)")
+
+    def add(self, record: Dict[str, Any], samples: Optional[List[Dict[str, float]]] = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO executions (id, timestamp, record, samples) VALUES (?, ?, ?, ?)",
+                (record['id'], record['timestamp'], json.dumps(record, default=repr),
+                 json.dumps(samples) if samples is not None else None)
+            )
+            if self.capacity is not None:
+                self._conn.execute(
+                    "DELETE FROM executions WHERE timestamp < ("
+                    "SELECT timestamp FROM executions ORDER BY timestamp DESC LIMIT 1 OFFSET ?)",
+                    (self.capacity - 1,)
+                )
+
+    def _fetch_one(self, column: str, execution_id: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {column} FROM executions WHERE id = ?", (execution_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def get(self, execution_id: str) -> Optional[Dict[str, Any]]:
+        return self._fetch_one("record", execution_id)
+
+    def get_samples(self, execution_id: str) -> Optional[List[Dict[str, float]]]:
+        return self._fetch_one("samples", execution_id)
+
+    def list(self, offset: int = 0, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT record FROM executions ORDER BY timestamp DESC LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM executions").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_history_store() -> HistoryStore:
+    """按环境变量创建历史存储
+
+    SANDBOX_HISTORY_DB 指定 SQLite 数据库路径时使用 SQLite，否则使用内存环形缓冲区；
+    SANDBOX_HISTORY_SIZE 为最多保留的记录数，两者未设置时都默认保留 DEFAULT_CAPACITY 条。
+
+    Returns:
+        HistoryStore: 历史存储
+    """
+    size = os.getenv('SANDBOX_HISTORY_SIZE')
+    capacity = int(size) if size else DEFAULT_CAPACITY
+    path = os.getenv('SANDBOX_HISTORY_DB')
+    if path:
+        return SQLiteHistoryStore(path, capacity)
+    return MemoryHistoryStore(capacity)
@@ -0,0 +1,113 @@
+"""
+异步任务
+POST /jobs 提交后立即返回任务ID，任务按优先级类别排队执行，之后可以查询状态或取消
+"""
+
+import asyncio
+import math
+from typing import Any, Dict, Optional
+
+try:
+    from web.events import ExecutionEvents
+except ImportError:
+    # 以脚本方式运行时 web 不是包
+    from events import ExecutionEvents
+
+# 优先级类别：交互任务先于批量任务执行，批量任务只能占用部分执行线程
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# 执行历史中的状态（/execute 响应的 status）对应的任务状态
+CANCELLED_STATUS = "已取消"
+_FINISHED_STATES = {"成功": SUCCEEDED, CANCELLED_STATUS: CANCELLED}
+
+
+class Job:
+    """一个已提交、尚未结束的任务"""
+
+    def __init__(self, priority_class: str, events: ExecutionEvents, future: asyncio.Future):
+        """
+        Args:
+            priority_class: 优先级类别
+            events: 任务的事件日志，执行ID 即任务ID
+            future: 调度器返回的执行结果，取消它即取消任务
+        """
+        self.id = events.execution_id
+        self.priority_class = priority_class
+        self.events = events
+        self.future = future
+        self.task: Optional[asyncio.Task] = None  # 等待执行结束并写入历史的任务
+
+    @property
+    def state(self) -> str:
+        if self.future.cancelled():
+            return CANCELLED
+        if self.events.started_time is None:
+            return QUEUED
+        return RUNNING
+
+    def cancel(self) -> bool:
+        """取消任务：排队中的任务不再执行，执行中的任务被中断
+
+        Returns:
+            bool: 任务已经结束、无法取消时为 False
+        """
+        return self.future.cancel()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'priority': self.priority_class,
+            'state': self.state,
+            'submitted_at': self.events.start_time,
+            'started_at': self.events.started_time
+        }
+
+
+def job_from_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """由执行历史中的记录得到已结束任务的状态
+
+    Args:
+        record: 执行历史记录
+
+    Returns:
+        Dict[str, Any]: 任务状态，result 为 /execute 的响应内容
+    """
+    result = {key: record.get(key) for key in ('id', 'status', 'result', 'error', 'execution_time')}
+    for key in ('peak_memory_mb', 'peak_cpu_percent'):
+        if key in record:
+            result[key] = record[key]
+    return {
+        'id': record['id'],
+        'state': _FINISHED_STATES.get(record['status'], FAILED),
+        'submitted_at': record['timestamp'],
+        'result': result
+    }
+
+
+class ExecutionTimeEstimate:
+    """最近执行时长的指数移动平均，用于估计排队任务的等待时间（Retry-After）"""
+
+    def __init__(self, initial: float = 1.0, alpha: float = 0.2):
+        """
+        Args:
+            initial: 还没有执行结束时使用的估计值（秒）
+            alpha: 新样本的权重
+        """
+        self.value = initial
+        self.alpha = alpha
+
+    def update(self, seconds: float) -> None:
+        self.value += self.alpha * (seconds - self.value)
+
+    def retry_after(self, queued: int, workers: int) -> int:
+        """队列中的任务大致执行完所需的秒数，至少 1 秒"""
+        return max(1, math.ceil(self.value * queued / max(workers, 1)))
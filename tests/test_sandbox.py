@@ -101,4 +101,1891 @@ __result__ = content
 import socket
 s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 __result__ = s.connect(("example.com", 80))
-""")
\ No newline at end of file
+""")
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.settings = SandboxSettings(
+            max_memory_mb=50,
+            max_cpu_percent=100,
+            max_execution_time=1,
+            execution_mode="pool",
+            pool_size=1
+        )
+        self.sandbox = Sandbox(self.settings, enable_logging=False)
+    
+    def test_pool_execution(self):
+        """测试工作进程池执行"""
+        result = self.sandbox.execute("""
+import math
+__result__ = math.sqrt(16)
+""")
+        self.assertEqual(result, 4.0)
+    
+    def test_runaway_code_is_killed(self):
+        """测试失控代码被终止且工作进程被替换"""
+        with self.assertRaises(ResourceLimitExceeded):
+            self.sandbox.execute("""
+while True:
+    pass
+""")
+        # 替换后的工作进程可继续使用
+        self.assertEqual(self.sandbox.execute("__result__ = 1"), 1)
+    
+    def test_pool_forbidden_import(self):
+        """测试工作进程中的导入限制"""
+        with self.assertRaises(SandboxError):
+            self.sandbox.execute("import os")
+
+    def test_result_not_unpickled_in_host(self):
+        """测试执行结果以 JSON 回传，结果对象的 __reduce__ 不会在主进程中执行"""
+        import os
+        from dataclasses import replace
+        sandbox = Sandbox(replace(self.settings, allowed_modules=['os']), enable_logging=False)
+        result = sandbox.execute("""
+import os
+Payload = type('Payload', (), {'__reduce__': lambda self, getpid=os.getpid: (getpid, ())})
+__result__ = [Payload(), 1]
+""")
+        self.assertEqual(result[1], 1)
+        self.assertIsInstance(result[0], str)
+        self.assertIn("Payload", result[0])
+        self.assertNotEqual(result[0], os.getpid())
+
+
+class TestZygote(unittest.TestCase):
+    def setUp(self):
+        self.settings = SandboxSettings(
+            max_memory_mb=50,
+            max_cpu_percent=100,
+            max_execution_time=1,
+            execution_mode="zygote",
+            allowed_modules=['math', 'json']
+        )
+        self.sandbox = Sandbox(self.settings, enable_logging=False)
+    
+    def test_zygote_execution(self):
+        """测试从 zygote fork 子进程执行"""
+        result = self.sandbox.execute("""
+import json
+__result__ = json.dumps({'a': 1})
+""")
+        self.assertEqual(result, '{"a": 1}')
+    
+    def test_zygote_timeout(self):
+        """测试 zygote 子进程超时被终止"""
+        with self.assertRaises(ResourceLimitExceeded):
+            self.sandbox.execute("""
+while True:
+    pass
+""")
+        self.assertEqual(self.sandbox.execute("__result__ = 2"), 2)
+    
+    def test_result_not_unpickled(self):
+        """测试子进程的结果以 JSON 回传，结果对象的 __reduce__ 不会在 zygote 或主进程中执行"""
+        import os
+        from dataclasses import replace
+        sandbox = Sandbox(replace(self.settings, allowed_modules=['os']), enable_logging=False)
+        for mode in ("zygote", "isolated"):
+            sandbox.update_settings(replace(sandbox.settings, execution_mode=mode))
+            result = sandbox.execute("""
+import os
+Payload = type('Payload', (), {'__reduce__': lambda self, getpid=os.getpid: (getpid, ())})
+__result__ = {'payload': Payload(), 'pid': os.getpid()}
+""")
+            self.assertIsInstance(result['payload'], str)
+            self.assertIn("Payload", result['payload'])
+            self.assertNotEqual(result['pid'], os.getpid())
+
+    def test_child_closes_inherited_fds(self):
+        """测试子进程只保留标准输入输出、结果管道和退出管道，不持有 zygote 与主进程的连接"""
+        from dataclasses import replace
+        sandbox = Sandbox(replace(self.settings, allowed_modules=['os']), enable_logging=False)
+        code = """
+import os
+links = []
+for fd in os.listdir('/proc/self/fd'):
+    if int(fd) > 2:
+        try:
+            links.append(os.readlink('/proc/self/fd/' + fd))
+        except Exception:
+            pass
+__result__ = links
+"""
+        for mode in ("zygote", "isolated"):
+            sandbox.update_settings(replace(sandbox.settings, execution_mode=mode))
+            links = sandbox.execute(code)
+            self.assertFalse([link for link in links if link.startswith("socket:")])
+            self.assertLessEqual(len([link for link in links if link.startswith("pipe:")]), 2)
+
+    def test_startup_report(self):
+        """测试启动延迟报告"""
+        from sandbox.core.zygote import get_zygote
+        zygote = get_zygote(self.settings.allowed_modules)
+        modules = [item['module'] for item in zygote.startup_report]
+        self.assertEqual(modules, ['json', 'math'])
+        self.assertIn('json', zygote.format_startup_report())
+
+
+class TestCodeCache(unittest.TestCase):
+    def test_lru_eviction_and_counters(self):
+        """测试缓存命中统计和 LRU 淘汰"""
+        from sandbox.core.cache import CodeCache
+        cache = CodeCache(maxsize=2)
+        first = cache.compile("__result__ = 1")
+        self.assertIs(cache.compile("__result__ = 1"), first)
+        cache.compile("__result__ = 2")
+        cache.compile("__result__ = 3")
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 3, 'size': 2, 'maxsize': 2})
+        self.assertIsNot(cache.compile("__result__ = 1"), first)
+    
+    def test_requested_size_only_grows(self):
+        """测试共享缓存的容量只按最大要求增长，0 表示本次不使用缓存"""
+        from sandbox.core.cache import CodeCache
+        cache = CodeCache(maxsize=4)
+        for i in range(4):
+            cache.compile(f"__result__ = {i}", maxsize=2)
+        self.assertEqual(cache.stats()['size'], 4)
+        cache.compile("__result__ = 4", maxsize=8)
+        self.assertEqual(cache.stats()['maxsize'], 8)
+        cache.compile("__result__ = 5", maxsize=0)
+        self.assertEqual(cache.stats()['size'], 5)
+        self.assertEqual(cache.stats()['maxsize'], 8)
+    
+    def test_sandbox_uses_cache(self):
+        """测试沙箱执行复用编译结果"""
+        from sandbox.core.cache import get_code_cache
+        sandbox = Sandbox(SandboxSettings(), enable_logging=False)
+        code = "__result__ = 'cached'"
+        sandbox.execute(code)
+        hits = get_code_cache().stats()['hits']
+        self.assertEqual(sandbox.execute(code), 'cached')
+        self.assertEqual(get_code_cache().stats()['hits'], hits + 1)
+
+
+class TestAsyncExecution(unittest.TestCase):
+    def setUp(self):
+        self.sandbox = Sandbox(SandboxSettings(
+            max_memory_mb=1024,
+            max_cpu_percent=100,
+            max_execution_time=1,
+            max_concurrency=2
+        ), enable_logging=False)
+    
+    def tearDown(self):
+        self.sandbox.cleanup()
+    
+    def test_concurrent_execution(self):
+        """测试并发异步执行"""
+        import asyncio
+        
+        async def run():
+            tasks = [self.sandbox.execute_async(f"__result__ = {i}") for i in range(5)]
+            return await asyncio.gather(*tasks)
+        
+        self.assertEqual(asyncio.run(run()), [0, 1, 2, 3, 4])
+    
+    def test_timeout_stops_running_code(self):
+        """测试超时映射为资源超限并中断代码"""
+        import asyncio
+        
+        async def run():
+            await self.sandbox.execute_async("""
+while True:
+    pass
+""", timeout=0.2)
+        
+        with self.assertRaises(ResourceLimitExceeded):
+            asyncio.run(run())
+        # 被中断的线程可以继续执行新任务
+        self.assertEqual(asyncio.run(self.sandbox.execute_async("__result__ = 'ok'")), 'ok')
+
+    def test_cancel_deferred_inside_shield(self):
+        """测试沙箱内部实现执行期间推迟注入的取消异常"""
+        import threading
+        import time
+        from sandbox.core.cancel import CancelToken, ExecutionCancelled, cancel_shield
+
+        token = CancelToken()
+        entered = threading.Event()
+        steps = []
+
+        def target():
+            try:
+                with token.guard_thread():
+                    with cancel_shield():
+                        entered.set()
+                        deadline = time.monotonic() + 0.3
+                        while time.monotonic() < deadline:
+                            pass
+                        steps.append("shield")
+                    steps.append("after")
+            except ExecutionCancelled:
+                steps.append("cancelled")
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        entered.wait()
+        token.cancel(SandboxError("cancel"))
+        thread.join(5)
+        self.assertEqual(steps, ["shield", "cancelled"])
+
+    def test_cancel_not_swallowed_by_except(self):
+        """测试沙箱代码用 except Exception 捕获中断异常后仍会被终止"""
+        import time
+        sandbox = Sandbox(SandboxSettings(max_execution_time=1, allowed_modules=['time']), enable_logging=False)
+        start = time.monotonic()
+        with self.assertRaises(ResourceLimitExceeded):
+            sandbox.execute("""
+import time
+start = time.time()
+while time.time() - start < 4:
+    try:
+        time.sleep(0.05)
+    except Exception:
+        pass
+__result__ = "finished"
+""")
+        self.assertLess(time.monotonic() - start, 3)
+        self.assertEqual(sandbox.execute("__result__ = 'ok'"), 'ok')
+
+
+class TestKernelLimits(unittest.TestCase):
+    def _sandbox(self, mode):
+        return Sandbox(SandboxSettings(
+            max_memory_mb=50,
+            max_execution_time=1,
+            execution_mode=mode,
+            pool_size=1,
+            enforcement="rlimit"
+        ), enable_logging=False)
+    
+    def test_rlimit_memory(self):
+        """测试 RLIMIT_AS 拒绝超限内存分配"""
+        for mode in ("pool", "zygote"):
+            with self.assertRaises(ResourceLimitExceeded):
+                self._sandbox(mode).execute("x = ' ' * (200 * 1024 * 1024)")
+    
+    def test_rlimit_cpu(self):
+        """测试 RLIMIT_CPU 在墙钟超时之前以 SIGXCPU 终止死循环"""
+        from dataclasses import replace
+        for mode in ("pool", "zygote"):
+            sandbox = self._sandbox(mode)
+            sandbox.update_settings(replace(sandbox.settings, max_execution_time=1.5))
+            with self.assertRaises(ResourceLimitExceeded) as context:
+                sandbox.execute("""
+while True:
+    pass
+""")
+            # describe_exit 只在工作进程因 SIGXCPU 退出时给出该描述
+            self.assertIn("CPU时间超出限制", str(context.exception))
+            self.assertEqual(sandbox.execute("__result__ = 3"), 3)
+    
+    def test_cgroup_falls_back(self):
+        """测试 cgroup 不可用时回退到 rlimit"""
+        sandbox = Sandbox(SandboxSettings(
+            max_memory_mb=50,
+            execution_mode="pool",
+            pool_size=1,
+            enforcement="cgroup",
+            cgroup_root="/nonexistent/sandbox"
+        ), enable_logging=False)
+        self.assertEqual(sandbox.execute("__result__ = 4"), 4)
+        with self.assertRaises(ResourceLimitExceeded):
+            sandbox.execute("x = ' ' * (200 * 1024 * 1024)")
+
+
+class TestMonitorService(unittest.TestCase):
+    def test_single_monitor_thread(self):
+        """测试并发执行共享一个监控线程"""
+        import threading
+        sandbox = Sandbox(SandboxSettings(
+            max_memory_mb=10000,
+            max_cpu_percent=10000,
+            allowed_modules=['time']
+        ), enable_logging=False)
+        workers = [threading.Thread(target=sandbox.execute, args=("import time\ntime.sleep(0.3)",))
+                   for _ in range(20)]
+        for worker in workers:
+            worker.start()
+        monitors = [t for t in threading.enumerate() if t.name == "sandbox-monitor"]
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(monitors), 1)
+
+    def test_blocked_callback_does_not_delay_enforcement(self):
+        """测试采样回调阻塞时其他执行仍按时被终止"""
+        import threading
+        from dataclasses import replace
+        from sandbox.core.monitor import MonitoredExecution, get_monitor
+
+        class FakeSampler:
+            def sample(self, batch):
+                return 1.0, 0.0
+
+        release = threading.Event()
+        breached = threading.Event()
+        settings = SandboxSettings(max_memory_mb=100, max_cpu_percent=100,
+                                   max_execution_time=0.2, check_interval=0.05)
+        monitor = get_monitor()
+        blocked = monitor.register(MonitoredExecution(
+            FakeSampler(), replace(settings, max_execution_time=60), lambda message: None,
+            on_sample=lambda memory_mb, cpu_percent: release.wait(10)))
+        runaway = monitor.register(MonitoredExecution(
+            FakeSampler(), settings, lambda message: breached.set()))
+        try:
+            self.assertTrue(breached.wait(2))
+        finally:
+            release.set()
+            monitor.unregister(blocked)
+            monitor.unregister(runaway)
+
+    def test_faulty_execution_does_not_stop_monitor(self):
+        """测试某个执行的采样器或超限回调抛出异常时，监控线程继续终止其他执行，采样出错的执行仍按时超时"""
+        import threading
+        from dataclasses import replace
+        from sandbox.core.monitor import MonitoredExecution, get_monitor
+
+        class FakeSampler:
+            def sample(self, batch):
+                return 1.0, 0.0
+
+        class BrokenSampler:
+            def sample(self, batch):
+                raise RuntimeError("broken sampler")
+
+        def broken_breach(message):
+            raise RuntimeError("broken callback")
+
+        broken_timed_out = threading.Event()
+        runaway_breached = threading.Event()
+        settings = SandboxSettings(max_memory_mb=100, max_cpu_percent=100,
+                                   max_execution_time=0.2, check_interval=0.05)
+        monitor = get_monitor()
+        with self.assertLogs('sandbox.core.monitor', level='ERROR'):
+            executions = [
+                monitor.register(MonitoredExecution(BrokenSampler(), settings,
+                                                    lambda message: broken_timed_out.set())),
+                monitor.register(MonitoredExecution(FakeSampler(), replace(settings, max_execution_time=0.05),
+                                                    broken_breach)),
+            ]
+            try:
+                self.assertTrue(broken_timed_out.wait(2))
+                executions.append(monitor.register(MonitoredExecution(
+                    FakeSampler(), settings, lambda message: runaway_breached.set())))
+                self.assertTrue(runaway_breached.wait(2))
+            finally:
+                for execution in executions:
+                    monitor.unregister(execution)
+
+    def test_breach_repeats_until_unregister(self):
+        """测试超限的执行在注销前每个采样间隔再次调用超限回调，注销后不再调用"""
+        import threading
+        import time
+        from sandbox.core.monitor import MonitoredExecution, get_monitor
+
+        class FakeSampler:
+            def sample(self, batch):
+                return 1.0, 0.0
+
+        calls = []
+        repeated = threading.Event()
+
+        def on_breach(message):
+            calls.append(message)
+            if len(calls) >= 3:
+                repeated.set()
+
+        settings = SandboxSettings(max_memory_mb=100, max_cpu_percent=100,
+                                   max_execution_time=0.05, check_interval=0.05)
+        monitor = get_monitor()
+        execution = monitor.register(MonitoredExecution(FakeSampler(), settings, on_breach))
+        try:
+            self.assertTrue(repeated.wait(2))
+        finally:
+            monitor.unregister(execution)
+        count = len(calls)
+        time.sleep(0.2)
+        self.assertEqual(len(calls), count)
+        self.assertEqual(set(calls), {execution.breach})
+
+
+class TestResourceAccounting(unittest.TestCase):
+    def test_run_reports_usage(self):
+        """测试 run 返回本次执行的资源使用情况"""
+        sandbox = Sandbox(SandboxSettings(max_cpu_percent=10000), enable_logging=False)
+        result = sandbox.run("__result__ = sum(range(200000))")
+        self.assertEqual(result.value, sum(range(200000)))
+        self.assertTrue(result.execution_id)
+        self.assertGreater(result.usage.wall_time, 0)
+        self.assertGreater(result.usage.cpu_time, 0)
+
+    def test_tracemalloc_separates_concurrent_executions(self):
+        """测试 tracemalloc 计量下并发执行的内存峰值互不影响"""
+        import threading
+        settings = SandboxSettings(
+            max_memory_mb=10000,
+            max_cpu_percent=10000,
+            check_interval=0.02,
+            allowed_modules=['time'],
+            memory_accounting="tracemalloc"
+        )
+        results = {}
+
+        def run(name, code):
+            results[name] = Sandbox(settings, enable_logging=False).run(code)
+
+        big = threading.Thread(target=run, args=("big", "import time\nx = [0] * (5 * 1024 * 1024)\ntime.sleep(0.3)"))
+        small = threading.Thread(target=run, args=("small", "import time\ntime.sleep(0.3)"))
+        big.start()
+        small.start()
+        big.join()
+        small.join()
+        self.assertGreater(results["big"].usage.peak_memory_mb, 30)
+        self.assertLess(results["small"].usage.peak_memory_mb, 1)
+
+    def test_process_accounting_ignores_overlapping_executions(self):
+        """测试 process 计量下并发执行的内存增长不会使其他执行被误判超限"""
+        import threading
+        import time
+        results, errors = {}, {}
+
+        def run(name, settings, code):
+            try:
+                results[name] = Sandbox(settings, enable_logging=False).run(code)
+            except Exception as e:
+                errors[name] = e
+
+        small = threading.Thread(target=run, args=("small", SandboxSettings(
+            max_memory_mb=20, max_cpu_percent=10000, check_interval=0.02, allowed_modules=['time']),
+            "import time\ntime.sleep(0.5)"))
+        big = threading.Thread(target=run, args=("big", SandboxSettings(
+            max_memory_mb=10000, max_cpu_percent=10000, check_interval=0.02, allowed_modules=['time']),
+            "import time\nx = b'\\x01' * (100 * 1024 * 1024)\ntime.sleep(0.2)"))
+        small.start()
+        time.sleep(0.1)
+        big.start()
+        big.join()
+        small.join()
+        self.assertEqual(errors, {})
+        # 后开始的执行按执行归属内存
+        self.assertGreater(results["big"].usage.peak_memory_mb, 90)
+        self.assertLess(results["small"].usage.peak_memory_mb, 20)
+
+    def test_tracemalloc_stops_after_last_execution(self):
+        """测试最后一个 tracemalloc 计量的执行结束后停止追踪"""
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            self.skipTest("tracemalloc 已由其他代码启动")
+        sandbox = Sandbox(SandboxSettings(memory_accounting="tracemalloc"), enable_logging=False)
+        self.assertEqual(sandbox.execute("__result__ = 1"), 1)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_process_memory_is_relative_to_baseline(self):
+        """测试 process 计量只计入执行期间的 RSS 增长"""
+        ballast = b"\x01" * (64 * 1024 * 1024)
+        try:
+            sandbox = Sandbox(SandboxSettings(max_memory_mb=32, max_cpu_percent=10000), enable_logging=False)
+            result = sandbox.run("__result__ = 1")
+            self.assertLess(result.usage.peak_memory_mb, 32)
+        finally:
+            del ballast
+
+
+class TestSandboxSession(unittest.TestCase):
+    def test_namespace_persists(self):
+        """测试会话在多次执行之间保留变量，reset 后清空"""
+        from sandbox.core.session import SandboxSession
+        with SandboxSession(SandboxSettings(allowed_modules=['json']), enable_logging=False) as session:
+            session.execute("import json\ndata = json.loads('[1, 2, 3]')\ndef total():\n    return sum(data)")
+            self.assertEqual(session.execute("__result__ = total()"), 6)
+            self.assertIsNone(session.execute("x = 1"))
+            self.assertEqual(session.variables(), ['data', 'json', 'total', 'x'])
+            session.reset()
+            with self.assertRaises(SandboxError):
+                session.execute("__result__ = data")
+
+    def test_idle_session_is_evicted(self):
+        """测试空闲超时的会话被回收"""
+        import time
+        from sandbox.core.session import SandboxSession
+        from sandbox.exceptions import SessionClosed
+        session = SandboxSession(enable_logging=False, idle_timeout=0.2)
+        session.execute("x = 1")
+        time.sleep(0.5)
+        self.assertTrue(session.closed)
+        with self.assertRaises(SessionClosed):
+            session.execute("__result__ = x")
+
+
+class TestBatchExecution(unittest.TestCase):
+    def test_execute_many(self):
+        """测试批量执行按顺序返回结果并隔离单项失败"""
+        sandbox = Sandbox(SandboxSettings(max_cpu_percent=10000, allowed_modules=['math']), enable_logging=False)
+        codes = [f"__result__ = {i} * {i}" for i in range(8)]
+        codes[3] = "import os"
+        batch = sandbox.execute_many(codes, max_workers=2)
+        results = batch.results()
+        self.assertEqual([r.index for r in results], list(range(8)))
+        self.assertFalse(results[3].ok)
+        self.assertIsInstance(results[3].error, SandboxError)
+        self.assertEqual([r.value for r in results if r.ok], [i * i for i in range(8) if i != 3])
+        self.assertEqual((batch.stats.succeeded, batch.stats.failed), (7, 1))
+        self.assertGreater(batch.stats.throughput, 0)
+
+    def test_as_completed(self):
+        """测试按完成顺序迭代结果"""
+        sandbox = Sandbox(SandboxSettings(allowed_modules=['time']), enable_logging=False)
+        codes = ["import time\ntime.sleep(0.5)\n__result__ = 'slow'", "__result__ = 'fast'"]
+        values = [r.value for r in sandbox.execute_many(codes, ordered=False, max_workers=2)]
+        self.assertEqual(values, ['fast', 'slow'])
+
+    def test_batch_pools_are_not_retained(self):
+        """测试不同 max_workers 的批量执行不会留下常驻进程池"""
+        import os
+        from sandbox.core import pool
+        sandbox = Sandbox(SandboxSettings(max_cpu_percent=10000), enable_logging=False)
+        sandbox.execute_many(["__result__ = 1"]).results()
+        sizes = set(pool._pools)
+        for workers in ((os.cpu_count() or 1) + 1, (os.cpu_count() or 1) + 2):
+            batch = sandbox.execute_many(["__result__ = 2"] * 3, max_workers=workers)
+            self.assertEqual([r.value for r in batch.results()], [2, 2, 2])
+        self.assertEqual(set(pool._pools), sizes)
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.settings = SandboxSettings(max_cpu_percent=10000, allowed_modules=['time'])
+
+    def test_first_chunk_arrives_before_completion(self):
+        """测试输出在产生时即返回，最后一块为结果"""
+        import time
+        sandbox = Sandbox(self.settings, enable_logging=False)
+        code = "import time\nprint('start')\ntime.sleep(0.5)\nprint('end')\n__result__ = 42"
+        start = time.monotonic()
+        chunks = []
+        for chunk in sandbox.execute_stream(code):
+            if not chunks:
+                first_chunk_time = time.monotonic() - start
+            chunks.append((chunk.kind, chunk.data))
+        self.assertLess(first_chunk_time, 0.3)
+        self.assertEqual(chunks, [("stdout", "start\n"), ("stdout", "end\n"), ("result", 42)])
+
+    def test_stream_error(self):
+        """测试执行出错时先返回 stderr 再抛出异常"""
+        sandbox = Sandbox(self.settings, enable_logging=False)
+        kinds = []
+        with self.assertRaises(SandboxError):
+            for chunk in sandbox.execute_stream("print('a')\nimport os"):
+                kinds.append(chunk.kind)
+        self.assertEqual(kinds, ["stdout", "stderr"])
+
+    def test_backpressure_and_early_stop(self):
+        """测试缓冲区满时代码暂停，提前停止迭代会取消执行"""
+        import threading
+        import time
+        from dataclasses import replace
+        sandbox = Sandbox(replace(self.settings, stream_buffer_size=2), enable_logging=False)
+        stream = sandbox.execute_stream("for i in range(1000000):\n    print(i)")
+        self.assertEqual(next(stream).data, "0\n")
+        time.sleep(0.2)
+        # 调用方未读取，代码停在缓冲区写入处
+        self.assertEqual(next(stream).data, "1\n")
+        stream.close()
+        deadline = time.monotonic() + 2
+        while any(t.name == "sandbox-stream" for t in threading.enumerate()) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(any(t.name == "sandbox-stream" for t in threading.enumerate()))
+
+    def test_zygote_streaming(self):
+        """测试 zygote 和 isolated 模式在子进程产生输出时即转发，而不是执行结束后一起返回"""
+        import time
+        from dataclasses import replace
+        code = "import time\nprint('start')\ntime.sleep(0.5)\nprint('end')\n__result__ = 42"
+        for mode in ("zygote", "isolated"):
+            sandbox = Sandbox(replace(self.settings, execution_mode=mode), enable_logging=False)
+            start = time.monotonic()
+            chunks = []
+            for chunk in sandbox.execute_stream(code):
+                if not chunks:
+                    first_chunk_time = time.monotonic() - start
+                chunks.append((chunk.kind, chunk.data))
+            self.assertLess(first_chunk_time, 0.3)
+            self.assertEqual(chunks, [("stdout", "start\n"), ("stdout", "end\n"), ("result", 42)])
+
+    def test_pool_streaming(self):
+        """测试 pool 模式逐块转发工作进程的输出"""
+        from dataclasses import replace
+        sandbox = Sandbox(replace(self.settings, execution_mode="pool", pool_size=1), enable_logging=False)
+        chunks = [(c.kind, c.data) for c in sandbox.execute_stream("print('x', 1, sep='-')\n__result__ = 2")]
+        self.assertEqual(chunks, [("stdout", "x-1\n"), ("result", 2)])
+
+
+class FakeExecutorSocket:
+    """附加到容器的套接字：按帧协议解码主机消息，由容器的 reply 生成带 8 字节流头的回复"""
+
+    def __init__(self, container):
+        from sandbox.docker.protocol import FrameDecoder
+        self.container = container
+        self.decoder = FrameDecoder()
+        self.pending = b""
+        self.timeout = None
+
+    def sendall(self, data):
+        import struct
+        from sandbox.docker.protocol import encode
+        if self.container.killed.is_set():
+            raise BrokenPipeError()
+        for message in self.decoder.feed(data):
+            self.container.received.append(message)
+            if not self.container.responsive:
+                continue
+            for reply in self.container.reply(message):
+                body = encode(reply)
+                self.pending += struct.pack(">BxxxL", 1, len(body)) + body
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv(self, size):
+        import socket
+        if not self.pending:
+            if not self.container.responsive:
+                # 执行循环无响应，相当于等待到超时
+                raise socket.timeout()
+            if not self.container.killed.wait(min(self.timeout or 5.0, 5.0)):
+                raise socket.timeout()
+        if self.container.killed.is_set():
+            return b""
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def close(self):
+        pass
+
+
+class FakeContainer:
+    """运行执行循环的容器：ping 回复 pong，代码为 hang 时不回复，breach 时报告资源超限"""
+
+    def __init__(self):
+        import threading
+        self.responsive = True
+        self.killed = threading.Event()
+        self.removed = False
+        self.received = []
+        self.attrs = {'State': {'OOMKilled': False}}
+
+    def reply(self, message):
+        if message['type'] == "ping":
+            return [{"type": "pong"}]
+        code = message['code']
+        if code == "hang":
+            return []
+        if code == "breach":
+            return [{"type": "error", "id": message['id'], "error_type": "ResourceLimitExceeded",
+                     "error": "内存使用超出限制"}]
+        return [{"type": "output", "id": message['id'], "kind": "stdout", "data": "out\n"},
+                {"type": "result", "id": message['id'], "result": code}]
+
+    def attach_socket(self, params=None):
+        return FakeExecutorSocket(self)
+
+    def kill(self):
+        self.killed.set()
+
+    def remove(self, force=False):
+        self.killed.set()
+        self.removed = True
+
+    def reload(self):
+        pass
+
+
+class FakeDockerClient:
+    """只提供 containers.run 的 Docker 客户端，记录启动的容器"""
+
+    def __init__(self):
+        import threading
+        self.started = []
+        self.lock = threading.Lock()
+        self.containers = self
+
+    def run(self, **kwargs):
+        container = FakeContainer()
+        with self.lock:
+            self.started.append(container)
+        return container
+
+
+class TestDockerProtocol(unittest.TestCase):
+    def test_frames_roundtrip(self):
+        """测试帧协议在任意切分下都能完整解码"""
+        import io
+        from sandbox.docker.protocol import FrameDecoder, encode, read_message, write_message
+        messages = [{"type": "job", "id": "1", "code": "print('你好')"}, {"type": "pong"}]
+        data = b"".join(encode(m) for m in messages)
+        decoder = FrameDecoder()
+        decoded = []
+        for i in range(len(data)):
+            decoded.extend(decoder.feed(data[i:i + 1]))
+        self.assertEqual(decoded, messages)
+
+        buffer = io.BytesIO()
+        write_message(buffer, {"type": "result", "id": "1", "result": object()})
+        buffer.seek(0)
+        self.assertTrue(read_message(buffer)['result'].startswith("<object"))
+        self.assertIsNone(read_message(buffer))
+
+    def _container(self, client=None):
+        from sandbox.docker.container import ExecutorContainer
+        client = client or FakeDockerClient()
+        settings = SandboxSettings(docker_stats=False, max_execution_time=5)
+        return ExecutorContainer(client, "image", settings), client, settings
+
+    def test_startup_handshake_and_run(self):
+        """测试容器启动时先完成 ping 握手，执行时转发输出并返回结果"""
+        container, client, settings = self._container()
+        fake = client.started[0]
+        self.assertEqual(fake.received, [{"type": "ping"}])
+        chunks = []
+        value, usage = container.run("__result__ = 1", settings, output=lambda kind, data: chunks.append((kind, data)))
+        self.assertEqual(value, "__result__ = 1")
+        self.assertEqual(chunks, [("stdout", "out\n")])
+        self.assertEqual(fake.received[1]['type'], "job")
+        self.assertTrue(fake.received[1]['stream'])
+        self.assertEqual(container.executions, 1)
+        self.assertTrue(container.healthy)
+
+    def test_start_error_when_unresponsive(self):
+        """测试执行循环无响应时抛出 ContainerStartError 并删除容器"""
+        from sandbox.docker.container import ContainerStartError
+
+        class SilentClient(FakeDockerClient):
+            def run(self, **kwargs):
+                container = super().run(**kwargs)
+                container.responsive = False
+                return container
+
+        client = SilentClient()
+        with self.assertRaises(ContainerStartError):
+            self._container(client)
+        self.assertTrue(client.started[0].removed)
+
+    def test_cancel_kills_container(self):
+        """测试取消执行时终止容器，之后容器不再健康"""
+        import threading
+        from sandbox.core.cancel import CancelToken
+        container, client, settings = self._container()
+        token = CancelToken()
+        errors = []
+
+        def run():
+            try:
+                container.run("hang", settings, token)
+            except SandboxError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        while thread.is_alive() and not any(m['type'] == "job" for m in client.started[0].received):
+            thread.join(0.01)
+        token.cancel(SandboxError("执行已取消"))
+        thread.join(5)
+        self.assertTrue(client.started[0].killed.is_set())
+        self.assertEqual([str(e) for e in errors], ["执行已取消"])
+        self.assertFalse(container.healthy)
+
+    def test_unhealthy_after_breach(self):
+        """测试容器内报告资源超限后标记为不健康"""
+        container, _, settings = self._container()
+        with self.assertRaises(ResourceLimitExceeded):
+            container.run("breach", settings)
+        self.assertFalse(container.healthy)
+
+
+class TestExecutorStartup(unittest.TestCase):
+    def test_import_is_lazy(self):
+        """测试导入执行器时不加载沙箱和 psutil"""
+        import subprocess
+        import sys
+        code = ("import sys, sandbox.docker.executor; "
+                "print([m for m in ('psutil', 'sandbox.core.sandbox') if m in sys.modules])")
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_startup_budget(self):
+        """测试执行器在启动预算内响应 ping（扣除与环境有关的解释器启动时间）"""
+        import subprocess
+        import sys
+        import time
+        from sandbox.docker.executor import STARTUP_BUDGET
+        from sandbox.docker.protocol import encode, read_message
+
+        def interpreter_startup():
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "pass"], check=True)
+            return time.perf_counter() - start
+
+        def executor_ready():
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                [sys.executable, "-c", "from sandbox.docker.executor import serve; serve()"],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+            process.stdin.write(encode({"type": "ping"}))
+            process.stdin.flush()
+            message = read_message(process.stdout)
+            elapsed = time.perf_counter() - start
+            process.stdin.close()
+            process.wait()
+            self.assertEqual(message, {"type": "pong"})
+            return elapsed
+
+        baseline = min(interpreter_startup() for _ in range(3))
+        ready = min(executor_ready() for _ in range(3))
+        self.assertLess(ready - baseline, STARTUP_BUDGET)
+
+
+class TestIsolation(unittest.TestCase):
+    def test_probe_isolation(self):
+        """测试隔离步骤在不支持时被跳过而不是报错"""
+        from sandbox.core.isolation import probe_isolation
+        report = probe_isolation()
+        self.assertEqual(set(report), {'network', 'tmpfs', 'no_new_privs', 'capabilities', 'uid'})
+        if report['tmpfs']:
+            self.assertTrue(report['network'])
+
+    def test_isolated_execution(self):
+        """测试 isolated 模式在隔离的子进程中执行代码"""
+        sandbox = Sandbox(SandboxSettings(execution_mode="isolated", allowed_modules=['math']),
+                          enable_logging=False)
+        self.assertEqual(sandbox.execute("import math\n__result__ = math.factorial(5)"), 120)
+        with self.assertRaises(ResourceLimitExceeded):
+            sandbox.execute("x = ' ' * (200 * 1024 * 1024)")
+
+    def test_isolation_applied(self):
+        """测试隔离实际生效：/tmp 的写入对宿主不可见、无法连接网络、uid 已降低（只检查探测到可用的步骤）"""
+        import os
+        import socket
+        import uuid
+        from sandbox.core.isolation import probe_isolation
+        report = probe_isolation()
+        sandbox = Sandbox(SandboxSettings(execution_mode="isolated", allowed_modules=['os', 'socket']),
+                          enable_logging=False)
+
+        if report['tmpfs']:
+            path = os.path.join("/tmp", f"sandbox-isolation-{uuid.uuid4().hex}")
+            code = (f"import os\nfd = os.open({path!r}, os.O_CREAT | os.O_WRONLY)\nos.write(fd, b'x')\n"
+                    f"os.close(fd)\n__result__ = os.path.exists({path!r})")
+            self.assertTrue(sandbox.execute(code))
+            self.assertFalse(os.path.exists(path))
+
+        if report['network']:
+            # 宿主可以连接的监听端口，在隔离的网络命名空间中不可达
+            listener = socket.socket()
+            self.addCleanup(listener.close)
+            listener.bind(("127.0.0.1", 0))
+            listener.listen(1)
+            port = listener.getsockname()[1]
+            code = ("import socket\ns = socket.socket()\ns.settimeout(2)\n"
+                    f"try:\n    s.connect(('127.0.0.1', {port}))\n    __result__ = 'connected'\n"
+                    "except Exception as e:\n    __result__ = type(e).__name__\nfinally:\n    s.close()")
+            self.assertNotEqual(sandbox.execute(code), "connected")
+
+        # 以 root 运行且可以切换用户时为 nobody，否则 uid 不变
+        self.assertEqual(sandbox.execute("import os\n__result__ = os.geteuid()"), report['uid'])
+
+    def test_isolation_unprivileged(self):
+        """测试非 root 用户隔离后在用户命名空间内没有能力，无法卸载私有 /tmp"""
+        import ctypes
+        import os
+        import pickle
+        from sandbox.core.isolation import NOBODY_ID, isolate
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(read_fd)
+                libc = ctypes.CDLL(None, use_errno=True)
+                if os.geteuid() == 0:
+                    os.setgroups([])
+                    os.setgid(NOBODY_ID)
+                    os.setuid(NOBODY_ID)
+                    # 切换用户后进程不可转储，/proc/self 下的 id 映射文件无法写入；普通用户启动的进程是可转储的
+                    libc.prctl(4, 1, 0, 0, 0)  # PR_SET_DUMPABLE
+                report = isolate(16)
+                with open("/proc/self/status") as f:
+                    cap_eff = next(line.split()[1] for line in f if line.startswith("CapEff"))
+                unmounted = libc.umount2(b"/tmp", 2) == 0  # MNT_DETACH
+                with os.fdopen(write_fd, 'wb') as f:
+                    f.write(pickle.dumps((report, cap_eff, unmounted, os.geteuid())))
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as f:
+            data = f.read()
+        os.waitpid(pid, 0)
+        report, cap_eff, unmounted, euid = pickle.loads(data)
+
+        self.assertNotEqual(euid, 0)
+        self.assertEqual(report['uid'], euid)
+        if report['capabilities']:
+            self.assertEqual(int(cap_eff, 16), 0)
+        if report['tmpfs']:
+            self.assertTrue(report['capabilities'])
+            self.assertFalse(unmounted)
+
+    def test_isolation_reported(self):
+        """测试隔离报告随结果返回并写入安全日志，zygote 启动报告中包含隔离探测结果"""
+        from unittest import mock
+        from sandbox.core.zygote import get_zygote
+        sandbox = Sandbox(SandboxSettings(execution_mode="isolated", allowed_modules=['math']))
+        with mock.patch.object(sandbox.logger, 'log_isolation') as log_isolation:
+            result = sandbox.run("__result__ = 1")
+        self.assertEqual(set(result.isolation), {'network', 'tmpfs', 'no_new_privs', 'capabilities', 'uid'})
+        log_isolation.assert_called_once_with(result.isolation)
+
+        zygote = get_zygote(['math'])
+        self.assertEqual(zygote.isolation_report, result.isolation)
+        self.assertIn("isolated 模式", zygote.format_startup_report())
+
+
+class TestAsyncDispatcher(unittest.TestCase):
+    def _run(self, coro):
+        import asyncio
+        return asyncio.run(coro)
+
+    def test_fifo_and_bounded(self):
+        """测试任务按提交顺序开始执行且同时执行数不超过上限"""
+        import asyncio
+        import threading
+        import time
+        from sandbox.docker.dispatcher import AsyncDispatcher
+        started, lock = [], threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def run(code, token):
+            with lock:
+                started.append(code)
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+            return code
+
+        async def main():
+            dispatcher = AsyncDispatcher(run, max_in_flight=2)
+            futures = [dispatcher.submit(str(i), timeout=5) for i in range(8)]
+            results = await asyncio.gather(*futures)
+            await dispatcher.close()
+            return results
+
+        self.assertEqual(self._run(main()), [str(i) for i in range(8)])
+        self.assertEqual(started[:2], ['0', '1'])
+        self.assertEqual(sorted(started[2:4]), ['2', '3'])
+        self.assertEqual(state['peak'], 2)
+
+    def test_timeout_cancels_and_holds_slot(self):
+        """测试超时时取消执行，并在执行真正结束后才开始下一个任务"""
+        import time
+        from sandbox.docker.dispatcher import AsyncDispatcher
+        events = []
+
+        def run(code, token):
+            events.append(('start', code))
+            while not token.cancelled and code == 'slow':
+                time.sleep(0.01)
+            time.sleep(0.05 if code == 'slow' else 0)
+            events.append(('end', code))
+            token.raise_if_cancelled()
+            return code
+
+        async def main():
+            dispatcher = AsyncDispatcher(run, max_in_flight=1)
+            slow = dispatcher.submit('slow', timeout=0.1)
+            fast = dispatcher.submit('fast', timeout=5)
+            with self.assertRaises(ResourceLimitExceeded):
+                await slow
+            self.assertEqual(await fast, 'fast')
+            await dispatcher.close()
+
+        self._run(main())
+        self.assertEqual(events, [('start', 'slow'), ('end', 'slow'), ('start', 'fast'), ('end', 'fast')])
+
+    def test_unresponsive_execution_is_abandoned(self):
+        """测试不响应取消的执行超出 cancel_grace 后被放弃，名额交给下一个任务，放弃数有上限"""
+        import asyncio
+        import threading
+        from sandbox.docker.dispatcher import AsyncDispatcher
+        release = threading.Event()
+
+        def run(code, token):
+            if code == 'stuck':
+                # 不检查取消令牌，模拟阻塞在 C 调用中的代码
+                release.wait(5)
+            return code
+
+        async def main():
+            dispatcher = AsyncDispatcher(run, max_in_flight=1, cancel_grace=0.05, max_abandoned=1)
+            with self.assertRaises(ResourceLimitExceeded):
+                await dispatcher.submit('stuck', timeout=0.05)
+            self.assertEqual(dispatcher.abandoned, 1)
+            self.assertEqual(dispatcher.in_flight, 0)
+            self.assertEqual(await dispatcher.submit('fast', timeout=5), 'fast')
+
+            # 达到上限后一直等待被取消的执行结束
+            second = dispatcher.submit('stuck', timeout=0.05)
+            await asyncio.sleep(0.3)
+            self.assertFalse(second.done())
+            release.set()
+            with self.assertRaises(ResourceLimitExceeded):
+                await second
+            await dispatcher.close()
+            await asyncio.sleep(0.05)
+            self.assertEqual(dispatcher.abandoned, 0)
+
+        self._run(main())
+
+    def test_queue_limit_and_cancel(self):
+        """测试队列满时拒绝提交，取消排队中的 Future 时任务不会执行"""
+        import asyncio
+        import time
+        from sandbox.docker.dispatcher import AsyncDispatcher
+        ran = []
+
+        def run(code, token):
+            ran.append(code)
+            time.sleep(0.05)
+            return code
+
+        async def main():
+            dispatcher = AsyncDispatcher(run, max_in_flight=1, max_queued=2)
+            first = dispatcher.submit('a', timeout=5)
+            await asyncio.sleep(0.01)
+            queued = dispatcher.submit('b', timeout=5)
+            last = dispatcher.submit('c', timeout=5)
+            with self.assertRaises(SandboxError):
+                dispatcher.submit('d', timeout=5)
+            queued.cancel()
+            self.assertEqual(await asyncio.gather(first, last), ['a', 'c'])
+            await dispatcher.close()
+
+        self._run(main())
+        self.assertEqual(ran, ['a', 'c'])
+
+    def test_priorities(self):
+        """测试高优先级任务先开始，受限的优先级不会占满全部名额"""
+        import asyncio
+        import time
+        from sandbox.docker.dispatcher import AsyncDispatcher
+        started = []
+
+        def run(code, token):
+            started.append(code)
+            time.sleep(0.05)
+            return code
+
+        async def main():
+            dispatcher = AsyncDispatcher(run, max_in_flight=2, priority_limits={1: 1})
+            batch = [dispatcher.submit(f"batch-{i}", 5, priority=1) for i in range(3)]
+            await asyncio.sleep(0.01)
+            self.assertEqual((dispatcher.running_at(1), dispatcher.queued_at(1)), (1, 2))
+            interactive = dispatcher.submit("interactive", 5)
+            await asyncio.sleep(0.01)
+            self.assertEqual(dispatcher.running_at(0), 1)
+            await asyncio.gather(interactive, *batch)
+            await dispatcher.close()
+
+        self._run(main())
+        self.assertEqual(started, ["batch-0", "interactive", "batch-1", "batch-2"])
+
+
+class TestDockerStats(unittest.TestCase):
+    def _stats(self, usage, inactive, total, system, pre_total, pre_system):
+        return {
+            'memory_stats': {'usage': usage, 'stats': {'inactive_file': inactive}},
+            'cpu_stats': {'cpu_usage': {'total_usage': total}, 'system_cpu_usage': system, 'online_cpus': 2},
+            'precpu_stats': {'cpu_usage': {'total_usage': pre_total}, 'system_cpu_usage': pre_system}
+        }
+
+    def test_conversion(self):
+        """测试 Docker 统计换算为内存（不含文件缓存）和 CPU 使用率"""
+        from sandbox.docker.stats import cpu_percent, memory_mb
+        stats = self._stats(60 * 1024 * 1024, 10 * 1024 * 1024, 3 * 10**8, 4 * 10**9, 10**8, 2 * 10**9)
+        self.assertAlmostEqual(memory_mb(stats), 50.0)
+        self.assertAlmostEqual(cpu_percent(stats), 20.0)
+        # 第一条统计没有上一次的 CPU 数据
+        self.assertEqual(cpu_percent(self._stats(0, 0, 10**8, 10**9, 0, 0)), 0.0)
+
+    def test_recorder_series_and_peaks(self):
+        """测试采样点与 /resource_data 格式一致并记录峰值和 CPU 时间"""
+        from sandbox.docker.stats import StatsRecorder
+        received = []
+        recorder = StatsRecorder(received.append)
+        recorder.add(self._stats(80 * 1024 * 1024, 0, 5 * 10**8, 2 * 10**9, 10**8, 10**9))
+        recorder.add(self._stats(40 * 1024 * 1024, 0, 9 * 10**8, 4 * 10**9, 5 * 10**8, 2 * 10**9))
+        self.assertEqual(set(received[0]), {'timestamp', 'memory_mb', 'cpu_percent', 'elapsed_time'})
+        usage = recorder.usage()
+        self.assertAlmostEqual(usage.peak_memory_mb, 80.0)
+        self.assertAlmostEqual(usage.peak_cpu_percent, 80.0)
+        self.assertAlmostEqual(usage.cpu_time, 0.8)
+
+
+class TestContainerPool(unittest.TestCase):
+    def setUp(self):
+        from sandbox.docker.pool import ContainerPool
+        self.client = FakeDockerClient()
+        self.settings = SandboxSettings(docker_pool_size=2, docker_recycle_after=2, docker_stats=False,
+                                        docker_health_interval=0.05, max_execution_time=1)
+        self.pool = ContainerPool(self.client, "image", self.settings)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def wait_for(self, condition, timeout=5.0):
+        import time
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("条件未在超时内满足")
+            time.sleep(0.01)
+
+    def live(self):
+        return [c for c in self.client.started if not c.removed]
+
+    def test_prestart(self):
+        """测试创建后在后台启动 size 个容器，执行时不再启动新容器"""
+        self.wait_for(lambda: self.pool._idle.qsize() == 2)
+        self.assertEqual(len(self.client.started), 2)
+        value, _ = self.pool.execute("__result__ = 1", self.settings)
+        self.assertEqual(value, "__result__ = 1")
+        self.assertEqual(len(self.client.started), 2)
+
+    def test_health_check_replaces_unresponsive(self):
+        """测试健康检查删除无响应的空闲容器并在后台补充"""
+        self.wait_for(lambda: self.pool._idle.qsize() == 2)
+        broken = self.client.started[0]
+        broken.responsive = False
+        self.wait_for(lambda: broken.removed)
+        self.wait_for(lambda: len(self.live()) == 2 and self.pool._idle.qsize() == 2)
+        self.assertEqual(len(self.client.started), 3)
+
+    def test_recycle_after_n_executions(self):
+        """测试容器执行 recycle_after 次后被替换"""
+        self.wait_for(lambda: self.pool._idle.qsize() == 2)
+        for _ in range(4):
+            self.pool.execute("__result__ = 1", self.settings)
+        self.wait_for(lambda: len(self.live()) == 2)
+        recycled = [c for c in self.client.started if c.removed]
+        self.assertTrue(recycled)
+        for container in recycled:
+            self.assertEqual(sum(1 for m in container.received if m['type'] == "job"), 2)
+
+    def test_replace_on_breach(self):
+        """测试容器内报告资源超限后容器被替换"""
+        from sandbox.exceptions import ResourceLimitExceeded
+        self.wait_for(lambda: self.pool._idle.qsize() == 2)
+        with self.assertRaises(ResourceLimitExceeded):
+            self.pool.execute("breach", self.settings)
+        self.assertEqual(sum(1 for c in self.client.started if c.removed), 1)
+        self.wait_for(lambda: len(self.live()) == 2 and self.pool._idle.qsize() == 2)
+        self.assertEqual(len(self.client.started), 3)
+
+
+class TestDockerScheduler(unittest.TestCase):
+    class FakeClient:
+        """只提供调度需要的接口的 Docker 客户端"""
+
+        def __init__(self, memory_mb, reachable=True):
+            self.memory_mb = memory_mb
+            self.reachable = reachable
+
+        def info(self):
+            if not self.reachable:
+                raise ConnectionError("daemon unreachable")
+            return {'MemTotal': self.memory_mb * 1024 * 1024}
+
+    def _scheduler(self, clients, runs):
+        from sandbox.core.accounting import ResourceUsage
+        from sandbox.docker.container import ContainerStartError
+        from sandbox.docker.scheduler import DockerEndpoint, DockerScheduler
+
+        class FakeScheduler(DockerScheduler):
+            def _execute_on(self, endpoint, code, token, output, on_sample, settings):
+                runs.append((endpoint.name, endpoint.in_flight))
+                if not endpoint.client.reachable:
+                    raise ContainerStartError("Docker容器启动失败")
+                return endpoint.name, ResourceUsage()
+
+        endpoints = [DockerEndpoint(name, client) for name, client in clients]
+        return FakeScheduler(endpoints, "image", SandboxSettings(max_memory_mb=100)), endpoints
+
+    def test_least_loaded(self):
+        """测试优先选择执行中任务少、剩余内存能容纳容器的节点"""
+        scheduler, (small, big, full) = self._scheduler(
+            [('small', self.FakeClient(1024)), ('big', self.FakeClient(4096)), ('full', self.FakeClient(100))], [])
+        self.assertIs(scheduler.choose(), big)
+        big.in_flight = 1
+        self.assertIs(scheduler.choose(), small)
+        small.in_flight = big.in_flight = 5
+        # full 节点内存不足以容纳新容器
+        self.assertIs(scheduler.choose(), big)
+
+    def test_retry_on_endpoint_failure(self):
+        """测试节点无法启动容器时换到其他节点重试并暂停使用故障节点"""
+        runs = []
+        scheduler, (down, up) = self._scheduler(
+            [('down', self.FakeClient(8192, reachable=False)), ('up', self.FakeClient(1024))], runs)
+        scheduler._refresh = lambda endpoint, now: None
+        down.memory_mb, up.memory_mb = 8192, 1024
+        value, _ = scheduler.execute("__result__ = 1")
+        self.assertEqual(value, 'up')
+        self.assertEqual(runs, [('down', 1), ('up', 1)])
+        self.assertEqual(down.failures, 1)
+        self.assertEqual((down.in_flight, up.in_flight), (0, 0))
+        # 故障节点暂停使用期间直接选择其他节点
+        self.assertIs(scheduler.choose(), up)
+
+        up.client.reachable = False
+        with self.assertRaises(SandboxError):
+            scheduler.execute("__result__ = 1")
+
+    def test_per_execution_settings(self):
+        """测试共享的调度器按每次执行的设置选择节点并传给容器"""
+        from dataclasses import replace
+        runs = []
+        scheduler, (small, big) = self._scheduler([('small', self.FakeClient(1024)), ('big', self.FakeClient(4096))],
+                                                  runs)
+        scheduler.refresh()
+        big.in_flight = 1
+        self.assertEqual(scheduler.execute("__result__ = 1")[0], 'small')
+        # small 节点容纳不下 1500MB 的容器
+        self.assertEqual(scheduler.execute("__result__ = 1", settings=replace(scheduler.settings,
+                                                                              max_memory_mb=1500))[0], 'big')
+        self.assertEqual(runs, [('small', 1), ('big', 2)])
+
+    def test_refresh_outside_lock(self):
+        """测试读取节点信息时不持有调度锁，慢节点不阻塞其他执行的节点选择"""
+        import threading
+        lock_held = []
+        release = threading.Event()
+        scheduler = None
+
+        class SlowClient(self.FakeClient):
+            def info(self):
+                lock_held.append(scheduler._lock.locked())
+                release.wait(5)
+                return super().info()
+
+        scheduler, (slow, fast) = self._scheduler([('slow', SlowClient(4096)), ('fast', self.FakeClient(1024))], [])
+        refresher = threading.Thread(target=scheduler.refresh)
+        refresher.start()
+        while not lock_held:
+            refresher.join(0.01)
+        # slow 节点正在刷新，其他调用不重复刷新，也不等待
+        self.assertIn(scheduler.choose(), (slow, fast))
+        release.set()
+        refresher.join(5)
+        self.assertEqual(lock_held, [False])
+        self.assertIs(scheduler.choose(), slow)
+
+
+class TestAsyncSecurityLogger(unittest.TestCase):
+    def test_async_writes_batches(self):
+        """测试异步模式下日志由后台线程写入文件"""
+        import glob
+        import tempfile
+        from sandbox.logging.security_logger import SecurityLogger, close_log_sink
+        with tempfile.TemporaryDirectory() as log_dir:
+            logger = SecurityLogger(log_dir, async_mode=True, queue_size=100)
+            logger.start_execution("exec-1", "x = 1", {'max_memory_mb': 100})
+            for i in range(10):
+                logger.log_resource_usage(float(i), 1.0)
+            logger.end_execution("成功")
+            close_log_sink(log_dir)
+            with open(glob.glob(f"{log_dir}/security-*.log")[0], encoding='utf-8') as f:
+                content = f.read()
+        self.assertIn("开始执行代码 [ID: exec-1]", content)
+        self.assertIn('"max_memory_mb": 100', content)
+        self.assertEqual(content.count("资源使用 [ID: exec-1]"), 10)
+        self.assertIn("执行结束 [ID: exec-1]", content)
+
+    def test_drop_policy(self):
+        """测试队列满时丢弃记录并计数"""
+        import logging
+        import time
+        from sandbox.logging.security_logger import QueueLogHandler
+        handler = QueueLogHandler(2)
+        record = lambda level: logging.makeLogRecord({'levelno': level, 'msg': 'x'})
+        for _ in range(5):
+            handler.handle(record(logging.INFO))
+        self.assertEqual(handler.queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 3)
+        start = time.monotonic()
+        handler.handle(record(logging.WARNING))
+        self.assertGreater(time.monotonic() - start, 0.04)
+        self.assertEqual(handler.take_dropped(), 4)
+        self.assertEqual(handler.dropped, 0)
+
+
+class TestSharedLogSink(unittest.TestCase):
+    def test_single_sink_per_directory(self):
+        """测试多个 SecurityLogger 共享同一组处理器和日志文件"""
+        import glob
+        import tempfile
+        from sandbox.logging.security_logger import SecurityLogger, close_log_sink
+        with tempfile.TemporaryDirectory() as log_dir:
+            loggers = [SecurityLogger(log_dir) for _ in range(5)]
+            self.assertEqual(len(loggers[0].logger.handlers), 2)
+            self.assertIs(loggers[0].logger, loggers[-1].logger)
+            loggers[3].log_error("TestError", "once")
+            close_log_sink(log_dir)
+            files = glob.glob(f"{log_dir}/security-*.log")
+            self.assertEqual(len(files), 1)
+            with open(files[0], encoding='utf-8') as f:
+                self.assertEqual(f.read().count("TestError: once"), 1)
+
+    def test_sink_resolved_once(self):
+        """测试记录日志时不再查找共享输出，输出被关闭后改用新的输出"""
+        import glob
+        import tempfile
+        from unittest import mock
+        from sandbox.logging import security_logger
+        from sandbox.logging.security_logger import SecurityLogger, close_log_sink
+        with tempfile.TemporaryDirectory() as log_dir:
+            logger = SecurityLogger(log_dir)
+            with mock.patch.object(security_logger, 'get_log_sink') as get_log_sink:
+                logger.log_error("TestError", "cached")
+            get_log_sink.assert_not_called()
+            close_log_sink(log_dir)
+            logger.log_error("TestError", "reopened")
+            close_log_sink(log_dir)
+            contents = []
+            for path in glob.glob(f"{log_dir}/security-*.log"):
+                with open(path, encoding='utf-8') as f:
+                    contents.append(f.read())
+        self.assertEqual(sum("TestError: reopened" in content for content in contents), 1)
+
+    def test_sink_per_options(self):
+        """测试日志设置不同的 SecurityLogger 使用各自的输出，后创建的设置不会被忽略"""
+        import glob
+        import tempfile
+        from sandbox.logging.security_logger import SecurityLogger, close_log_sink
+        with tempfile.TemporaryDirectory() as log_dir:
+            sync_logger = SecurityLogger(log_dir)
+            async_logger = SecurityLogger(log_dir, async_mode=True, queue_size=100, audit=True)
+            self.assertIsNot(sync_logger.logger, async_logger.logger)
+            self.assertIs(SecurityLogger(log_dir, async_mode=True, queue_size=100, audit=True).logger,
+                          async_logger.logger)
+            sync_logger.log_error("TestError", "sync")
+            async_logger.log_error("TestError", "async")
+            close_log_sink(log_dir)
+            contents = []
+            for path in sorted(glob.glob(f"{log_dir}/security-*.log")):
+                with open(path, encoding='utf-8') as f:
+                    contents.append(f.read())
+            audit_files = glob.glob(f"{log_dir}/audit/audit-*.jsonl*")
+        self.assertEqual(len(contents), 2)
+        self.assertEqual(sorted(content.count("TestError: async") for content in contents), [0, 1])
+        self.assertEqual(sorted(content.count("TestError: sync") for content in contents), [0, 1])
+        self.assertTrue(audit_files)
+
+    def test_concurrent_attribution(self):
+        """测试并发执行的日志按上下文归属到各自的执行"""
+        import glob
+        import re
+        import tempfile
+        import threading
+        from sandbox.logging.security_logger import SecurityLogger, close_log_sink
+        with tempfile.TemporaryDirectory() as log_dir:
+            logger = SecurityLogger(log_dir)
+            barrier = threading.Barrier(2)
+
+            def run(execution_id):
+                logger.start_execution(execution_id, "pass", {})
+                barrier.wait()
+                logger.log_module_import(f"module_{execution_id}", True)
+                barrier.wait()
+                logger.end_execution("成功")
+
+            threads = [threading.Thread(target=run, args=(name,)) for name in ("a", "b")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertIsNone(logger.execution_id)
+            close_log_sink(log_dir)
+            with open(glob.glob(f"{log_dir}/security-*.log")[0], encoding='utf-8') as f:
+                imports = re.findall(r"模块导入 \[ID: (\w+)\] - 允许 导入 module_(\w+)", f.read())
+        self.assertEqual(sorted(imports), [("a", "a"), ("b", "b")])
+
+
+class TestAuditLog(unittest.TestCase):
+    def test_rotation_compression_and_lookup(self):
+        """测试审计日志轮转、压缩后仍能按执行ID 和时间范围查询"""
+        import glob
+        import gzip
+        import os
+        import tempfile
+        from sandbox.logging.audit import AuditLog, AuditReader
+        with tempfile.TemporaryDirectory() as directory:
+            audit = AuditLog(directory, max_bytes=2048)
+            for i in range(40):
+                execution_id = f"exec-{i}"
+                audit.write([
+                    {'ts': 1000.0 + i, 'event': "start", 'execution_id': execution_id, 'code': "x = 1" * 20},
+                    {'ts': 1000.0 + i, 'event': "module_import", 'execution_id': execution_id, 'module': "math"},
+                    {'ts': 1000.5 + i, 'event': "end", 'execution_id': execution_id, 'status': "成功"},
+                ])
+            reader = AuditReader(directory)
+            # 当前分段未压缩时也能查询
+            self.assertEqual(len(reader.find("exec-39")), 3)
+            audit.close()
+
+            segments = glob.glob(os.path.join(directory, "audit-*.jsonl.gz"))
+            self.assertGreater(len(segments), 1)
+            self.assertFalse(glob.glob(os.path.join(directory, "audit-*.jsonl")))
+            with gzip.open(sorted(segments)[0], 'rt', encoding='utf-8') as f:
+                self.assertIn('"exec-0"', f.readline())
+
+            reader = AuditReader(directory)
+            records = reader.find("exec-17")
+            self.assertEqual([r['event'] for r in records], ["start", "module_import", "end"])
+            self.assertEqual(records[1]['module'], "math")
+            self.assertEqual(reader.find("missing"), [])
+            in_range = {r['execution_id'] for r in reader.between(1010.0, 1012.0)}
+            self.assertEqual(in_range, {"exec-10", "exec-11", "exec-12"})
+
+    def test_multiple_writers(self):
+        """测试多个写入者共用目录时互不压缩对方正在写入的分段，只恢复已退出写入者的分段"""
+        import glob
+        import os
+        import tempfile
+        from sandbox.logging.audit import AuditLog, AuditReader
+
+        def start(execution_id, ts):
+            return [{'ts': ts, 'event': "start", 'execution_id': execution_id},
+                    {'ts': ts, 'event': "end", 'execution_id': execution_id}]
+
+        with tempfile.TemporaryDirectory() as directory:
+            first = AuditLog(directory)
+            first.write(start("exec-first", 1000.0))
+            second = AuditLog(directory)
+            second.write(start("exec-second", 1001.0))
+            self.assertNotEqual(first.path, second.path)
+            self.assertTrue(os.path.exists(first.path))
+            first.write(start("exec-first-2", 1002.0))
+
+            # 模拟进程崩溃：文件锁随进程退出释放，分段未压缩
+            crashed = AuditLog(directory)
+            crashed.write(start("exec-crashed", 1003.0))
+            crashed._file.close()
+            crashed._writer_lock.close()
+
+            third = AuditLog(directory)
+            self.assertFalse(os.path.exists(crashed.path))
+            self.assertTrue(os.path.exists(crashed.path + ".gz"))
+            self.assertTrue(os.path.exists(first.path))
+            self.assertTrue(os.path.exists(second.path))
+
+            reader = AuditReader(directory)
+            for execution_id in ("exec-first", "exec-first-2", "exec-second", "exec-crashed"):
+                self.assertEqual(len(reader.find(execution_id)), 2, execution_id)
+            for audit in (first, second, third):
+                audit.close()
+            self.assertFalse(glob.glob(os.path.join(directory, "*.lock")))
+            self.assertFalse(glob.glob(os.path.join(directory, "audit-*.jsonl")))
+            reader = AuditReader(directory)
+            self.assertEqual(len(list(reader.between(1000.0, 1003.0))), 8)
+
+    def test_rotation_compresses_in_background(self):
+        """测试轮转不等待压缩，压缩期间写入和查询照常进行"""
+        import os
+        import tempfile
+        import threading
+        from unittest import mock
+        from sandbox.logging import audit as audit_module
+        from sandbox.logging.audit import AuditLog, AuditReader
+        release = threading.Event()
+        compress = audit_module.compress_segment
+
+        def slow_compress(path, *args):
+            release.wait(10)
+            return compress(path, *args)
+
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(audit_module, "compress_segment", slow_compress):
+            audit = AuditLog(directory)
+            audit.write([{'ts': 1000.0, 'event': "start", 'execution_id': "exec-old"},
+                         {'ts': 1000.0, 'event': "end", 'execution_id': "exec-old"}])
+            rotated = audit.path
+            audit.rotate()
+            audit.write([{'ts': 1001.0, 'event': "start", 'execution_id': "exec-new"},
+                         {'ts': 1001.0, 'event': "end", 'execution_id': "exec-new"}])
+            self.assertTrue(os.path.exists(rotated))
+            reader = AuditReader(directory)
+            self.assertEqual(len(reader.find("exec-old")), 2)
+            self.assertEqual(len(reader.find("exec-new")), 2)
+            release.set()
+            audit.close()
+            self.assertFalse(os.path.exists(rotated))
+            self.assertTrue(os.path.exists(rotated + ".gz"))
+            self.assertEqual(len(AuditReader(directory).find("exec-old")), 2)
+
+    def test_reader_refresh_is_incremental(self):
+        """测试 refresh 只读取索引中新增的项"""
+        import os
+        import tempfile
+        from sandbox.logging.audit import INDEX_FILE, AuditLog, AuditReader
+        with tempfile.TemporaryDirectory() as directory:
+            audit = AuditLog(directory)
+            audit.write([{'ts': 1000.0, 'event': "start", 'execution_id': "exec-1"}])
+            reader = AuditReader(directory)
+            self.assertIn("exec-1", reader.executions)
+            read = reader._index_offset
+            audit.write([{'ts': 1001.0, 'event': "start", 'execution_id': "exec-2"}])
+            self.assertNotIn("exec-2", reader.executions)
+            reader.refresh()
+            self.assertIn("exec-1", reader.executions)
+            self.assertIn("exec-2", reader.executions)
+            self.assertGreater(reader._index_offset, read)
+            audit.close()
+            reader.refresh()
+            self.assertEqual(reader._index_offset, os.path.getsize(os.path.join(directory, INDEX_FILE)))
+            self.assertEqual(len(reader.segments), 1)
+
+    def test_security_logger_writes_audit(self):
+        """测试启用审计日志后 SecurityLogger 的事件写为结构化记录"""
+        import os
+        import tempfile
+        from sandbox.logging.audit import AuditReader
+        from sandbox.logging.security_logger import SecurityLogger, close_log_sink
+        with tempfile.TemporaryDirectory() as log_dir:
+            logger = SecurityLogger(log_dir, audit=True)
+            logger.start_execution("exec-audit", "import os", {'max_memory_mb': 100})
+            logger.log_module_import("os", False)
+            logger.end_execution("失败", "SecurityError")
+            close_log_sink(log_dir)
+            records = AuditReader(os.path.join(log_dir, "audit")).find("exec-audit")
+        self.assertEqual([r['event'] for r in records], ["start", "module_import", "end"])
+        self.assertEqual(records[0]['code'], "import os")
+        self.assertEqual(records[0]['settings'], {'max_memory_mb': 100})
+        self.assertEqual((records[1]['module'], records[1]['allowed']), ("os", False))
+        self.assertEqual(records[2]['status'], "失败")
+
+
+class TestHistoryStore(unittest.TestCase):
+    def _records(self, count):
+        return [{'id': f"exec-{i}", 'timestamp': 1000.0 + i, 'code': f"x = {i}"} for i in range(count)]
+
+    def _check_store(self, store):
+        for record in self._records(5):
+            store.add(record, [{'memory_mb': 1.0}])
+        self.assertEqual(store.count(), 3)
+        self.assertIsNone(store.get("exec-0"))
+        self.assertEqual(store.get("exec-4")['code'], "x = 4")
+        self.assertEqual(store.get_samples("exec-3"), [{'memory_mb': 1.0}])
+        self.assertEqual([r['id'] for r in store.list(0, 2)], ["exec-4", "exec-3"])
+        self.assertEqual([r['id'] for r in store.list(2, 2)], ["exec-2"])
+
+    def test_memory_ring_buffer(self):
+        """测试内存存储按容量淘汰最早的记录并分页"""
+        from web.history import MemoryHistoryStore
+        self._check_store(MemoryHistoryStore(capacity=3))
+
+    def test_sqlite_store(self):
+        """测试 SQLite 存储的查询、分页、淘汰和持久化"""
+        import os
+        import tempfile
+        from web.history import SQLiteHistoryStore
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "history.db")
+            store = SQLiteHistoryStore(path, capacity=3)
+            self._check_store(store)
+            store.close()
+            reopened = SQLiteHistoryStore(path)
+            self.assertEqual(reopened.get("exec-4")['timestamp'], 1004.0)
+            reopened.close()
+
+    def test_create_store_defaults(self):
+        """测试未设置 SANDBOX_HISTORY_SIZE 时 SQLite 存储同样使用默认容量，接口不能直接实例化"""
+        import os
+        import tempfile
+        from unittest import mock
+        from web.history import DEFAULT_CAPACITY, HistoryStore, create_history_store
+        with self.assertRaises(TypeError):
+            HistoryStore()
+        with tempfile.TemporaryDirectory() as directory:
+            environ = {'SANDBOX_HISTORY_DB': os.path.join(directory, "history.db")}
+            with mock.patch.dict(os.environ, environ):
+                os.environ.pop('SANDBOX_HISTORY_SIZE', None)
+                store = create_history_store()
+            self.assertEqual(store.capacity, DEFAULT_CAPACITY)
+            store.close()
+
+
+class TestAsgiServer(unittest.TestCase):
+    def test_health_responsive_when_saturated(self):
+        """测试执行池占满并有任务排队时健康检查仍然立即响应"""
+        import asyncio
+        import time
+        from fastapi.testclient import TestClient
+        from web import asgi
+        from web.events import ExecutionEvents
+
+        settings = SandboxSettings(max_memory_mb=1024, max_cpu_percent=100, max_execution_time=5)
+        with TestClient(asgi.app) as client:
+            dispatcher = asgi.app.state.dispatcher
+
+            async def saturate():
+                loop = asyncio.get_running_loop()
+                return [dispatcher.submit("while True:\n    pass", 5, settings, False, ExecutionEvents(str(i), loop))
+                        for i in range(dispatcher.max_in_flight + 3)]
+
+            futures = client.portal.call(saturate)
+            try:
+                deadline = time.time() + 5
+                while dispatcher.in_flight < dispatcher.max_in_flight and time.time() < deadline:
+                    time.sleep(0.05)
+                start = time.time()
+                self.assertEqual(client.get('/healthz').json(), {'status': "ok"})
+                ready = client.get('/readyz').json()
+                self.assertLess(time.time() - start, 1.0)
+                self.assertEqual(ready['in_flight'], dispatcher.max_in_flight)
+                self.assertEqual(ready['queued'], 3)
+            finally:
+                for future in futures:
+                    client.portal.call(lambda: future.cancel())
+
+    def test_submit_timeout_allows_container_startup(self):
+        """测试调度器超时与 DockerSandbox.submit 一样为容器启动预留时间，/execute 和 /jobs 都适用"""
+        import asyncio
+        from unittest import mock
+        from fastapi.testclient import TestClient
+        from sandbox.docker.dispatcher import STARTUP_GRACE
+        from web import asgi, jobs
+
+        form = {'code': "__result__ = 1", 'max_execution_time': '3', 'use_docker': 'true'}
+        with TestClient(asgi.app) as client:
+            dispatcher = asgi.app.state.dispatcher
+            for priority_class in (jobs.INTERACTIVE, jobs.BATCH):
+                async def submit():
+                    with mock.patch.object(dispatcher, 'submit') as dispatcher_submit:
+                        dispatcher_submit.return_value = asyncio.get_running_loop().create_future()
+                        job = asgi._submit(asgi.app, form, priority_class)
+                        job.task.cancel()
+                        return dispatcher_submit.call_args
+
+                call = client.portal.call(submit)
+                self.assertEqual(call.args[1], 3 + STARTUP_GRACE)
+                self.assertTrue(call.args[3])
+
+    @unittest.skipUnless(__import__('importlib').util.find_spec('multipart'), "需要 python-multipart")
+    def test_execute(self):
+        """测试 /execute 在执行池中执行并写入历史"""
+        from fastapi.testclient import TestClient
+        from web import asgi
+
+        with TestClient(asgi.app) as client:
+            response = client.post('/execute', data={'code': "__result__ = 1 + 1"}).json()
+            self.assertEqual(response['status'], "成功")
+            self.assertEqual(response['result'], 2)
+            self.assertEqual(client.get(f"/history/{response['id']}").status_code, 200)
+
+
+class TestExecutionEvents(unittest.TestCase):
+    def test_follow_and_resume(self):
+        """测试事件按编号增量产出，其他线程追加时唤醒读取方，可从任意编号续传"""
+        import asyncio
+        import threading
+        from web.events import EventStore
+
+        async def run():
+            store = EventStore(retention=1)
+            events = store.create("exec-1")
+            received = []
+
+            async def reader():
+                async for event in events.follow(0):
+                    received.append(event[:2])
+
+            task = asyncio.create_task(reader())
+            await asyncio.sleep(0.01)
+            writer = threading.Thread(target=lambda: [events.output("stdout", "hi\n"), events.add_sample({'memory_mb': 1.0})])
+            writer.start()
+            writer.join()
+            await asyncio.sleep(0.01)
+            store.finish("exec-1", {'status': "成功"})
+            await asyncio.wait_for(task, 1)
+
+            resumed = [event[:2] async for event in events.follow(2)]
+            store.create("exec-2")
+            store.finish("exec-2", {})
+            return received, resumed, events.samples, store.get("exec-1")
+
+        received, resumed, samples, evicted = asyncio.run(run())
+        self.assertEqual(received, [(0, "start"), (1, "stdout"), (2, "sample"), (3, "status")])
+        self.assertEqual(resumed, [(2, "sample"), (3, "status")])
+        self.assertEqual(samples, [{'memory_mb': 1.0}])
+        self.assertIsNone(evicted)
+
+    def test_output_is_capped(self):
+        """测试输出超出上限时截断并追加 truncated 事件，之后的输出和超出上限的采样被丢弃"""
+        import asyncio
+        from web.events import EventStore
+
+        async def run():
+            store = EventStore(retention=1, max_output=8, max_samples=1)
+            events = store.create("exec-1")
+            events.output("stdout", "abcdef")
+            events.output("stdout", "中文")
+            events.output("stderr", "dropped")
+            events.add_sample({'memory_mb': 1.0})
+            events.add_sample({'memory_mb': 2.0})
+            store.finish("exec-1", {})
+            return store.get("exec-1")
+
+        events = asyncio.run(run())
+        # "中文" 占 6 字节，剩余 2 字节不足一个字符，整块丢弃
+        self.assertEqual(events.events[1:4], [("stdout", "abcdef"), ("truncated", {'limit': 8}),
+                                              ("sample", {'memory_mb': 1.0})])
+        self.assertEqual(events.output_bytes, 6)
+        self.assertEqual(events.samples, [{'memory_mb': 1.0}])
+        self.assertEqual([kind for kind, _ in events.events], ["start", "stdout", "truncated", "sample", "status"])
+
+    def test_stream_endpoint(self):
+        """测试 /stream 按 offset 或 Last-Event-ID 续传"""
+        from fastapi.testclient import TestClient
+        from web import asgi
+
+        with TestClient(asgi.app) as client:
+            def create():
+                events = asgi.event_store.create("exec-stream")
+                events.add_sample({'memory_mb': 1.0})
+                asgi.event_store.finish("exec-stream", {'id': "exec-stream", 'status': "成功"})
+
+            async def run_create():
+                create()
+
+            client.portal.call(run_create)
+            body = client.get('/stream/exec-stream', params={'offset': 1}).text
+            self.assertEqual(body.count("id: "), 2)
+            self.assertIn("event: sample", body)
+            self.assertIn("event: status", body)
+            body = client.get('/stream/exec-stream', headers={'Last-Event-ID': "1"}).text
+            self.assertNotIn("event: sample", body)
+            self.assertIn("id: 2\nevent: status", body)
+            self.assertEqual(client.get('/stream/unknown').status_code, 404)
+
+
+class TestJobs(unittest.TestCase):
+    def test_job_lifecycle(self):
+        """测试任务提交后立即返回，可以查询状态、取消，批量队列满时返回 429"""
+        import time
+        from unittest import mock
+        from fastapi.testclient import TestClient
+        from web import asgi, jobs
+
+        form = {'code': "__result__ = 6 * 7", 'max_memory_mb': '1024', 'max_cpu_percent': '100'}
+        busy = dict(form, code="while True:\n    pass")
+
+        def wait_state(client, job_id, state):
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                job = client.get(f"/jobs/{job_id}").json()
+                # 已结束的任务在写入历史后才带有 result
+                if job['state'] == state and (state in (jobs.QUEUED, jobs.RUNNING) or 'result' in job):
+                    return job
+                time.sleep(0.05)
+            self.fail(f"任务 {job_id} 未进入状态 {state}: {job}")
+
+        with TestClient(asgi.app) as client, mock.patch.object(asgi, 'BATCH_QUEUE_SIZE', 1):
+            async def submit(form, priority_class):
+                job = asgi._submit(asgi.app, form, priority_class)
+                return job.id if isinstance(job, jobs.Job) else (job.status_code, job.headers['Retry-After'])
+
+            job_id = client.portal.call(submit, form, jobs.BATCH)
+            self.assertEqual(wait_state(client, job_id, jobs.SUCCEEDED)['result']['result'], 42)
+
+            running = [client.portal.call(submit, busy, jobs.BATCH) for _ in range(asgi.BATCH_WORKERS)]
+            for running_id in running:
+                wait_state(client, running_id, jobs.RUNNING)
+            queued = client.portal.call(submit, busy, jobs.BATCH)
+            self.assertEqual(client.get(f"/jobs/{queued}").json()['state'], jobs.QUEUED)
+            status_code, retry_after = client.portal.call(submit, form, jobs.BATCH)
+            self.assertEqual(status_code, 429)
+            self.assertGreaterEqual(int(retry_after), 1)
+
+            for job_id in [queued] + running:
+                self.assertEqual(client.post(f"/jobs/{job_id}/cancel").json()['state'], jobs.CANCELLED)
+            for job_id in [queued] + running:
+                self.assertEqual(wait_state(client, job_id, jobs.CANCELLED)['result']['status'], jobs.CANCELLED_STATUS)
+            self.assertEqual(client.post(f"/jobs/{queued}/cancel").status_code, 409)
+            self.assertEqual(client.get("/jobs/unknown").status_code, 404)
+
+
+class TestResultCache(unittest.TestCase):
+    def test_ttl_and_lru(self):
+        """测试结果缓存按有效期过期、按容量淘汰最近最少使用的结果"""
+        import time
+        from web.cache import ResultCache
+        cache = ResultCache(capacity=2, ttl=0.2)
+        cache.put("a", {'result': 1})
+        cache.put("b", {'result': 2})
+        self.assertEqual(cache.get("a"), {'result': 1})
+        cache.put("c", {'result': 3})
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), {'result': 3})
+        time.sleep(0.25)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_key_and_nondeterminism(self):
+        """测试缓存键包含设置指纹，导入随机模块的代码不可缓存"""
+        from web.cache import cache_key, nondeterminism
+        settings = SandboxSettings()
+        self.assertEqual(cache_key("x = 1", settings), cache_key("x = 1", SandboxSettings()))
+        self.assertNotEqual(cache_key("x = 1", settings), cache_key("x = 1", SandboxSettings(max_memory_mb=200)))
+        self.assertNotEqual(cache_key("x = 1", settings), cache_key("x = 1", settings, use_docker=True))
+        self.assertIsNone(nondeterminism("import math\n__result__ = math.pi", settings))
+        self.assertIsNotNone(nondeterminism("import random", settings))
+        self.assertIsNotNone(nondeterminism("from numpy import random", settings))
+        self.assertIsNotNone(nondeterminism("m = 'random'\n__import__(m)", settings))
+        self.assertIsNotNone(nondeterminism("x = 1", SandboxSettings(network_access=True)))
+
+    def test_execute_cache_status(self):
+        """测试 /execute 报告缓存状态，命中时不再执行"""
+        from web import app as web_app
+        web_app.result_cache.clear()
+        client = web_app.app.test_client()
+        form = {'code': "__result__ = 6 * 7", 'max_memory_mb': '1024', 'max_cpu_percent': '100', 'cache': 'true'}
+
+        first = client.post('/execute', data=form).get_json()
+        second = client.post('/execute', data=form).get_json()
+        self.assertEqual((first['cache'], second['cache']), ("miss", "hit"))
+        self.assertEqual((second['id'], second['result']), (first['id'], 42))
+        self.assertEqual(client.post('/execute', data=dict(form, cache='false')).get_json()['cache'], "bypass")
+        random_form = dict(form, code="import random\n__result__ = random.random()")
+        self.assertEqual(client.post('/execute', data=random_form).get_json()['cache'], "uncacheable")
+        self.assertEqual(client.post('/execute', data=random_form).get_json()['cache'], "uncacheable")
+
+    def test_runtime_imports_decide_cacheability(self):
+        """测试绕过源码检查的导入按执行中实际导入的模块判定为不可缓存"""
+        from web import app as web_app
+        from web.cache import nondeterminism
+        web_app.result_cache.clear()
+        client = web_app.app.test_client()
+        code = "__result__ = __builtins__['__import__']('random').random()"
+        self.assertIsNone(nondeterminism(code, SandboxSettings()))
+        form = {'code': code, 'max_memory_mb': '1024', 'max_cpu_percent': '100', 'allow_imports': 'true',
+                'cache': 'true'}
+
+        response = client.post('/execute', data=form).get_json()
+        self.assertEqual(response['imported_modules'], ["random"])
+        self.assertEqual(response['cache'], "uncacheable")
+        self.assertEqual(client.post('/execute', data=form).get_json()['cache'], "uncacheable")
+
+        execution = Sandbox(enable_logging=False).run("from json import dumps\n__result__ = dumps(1)")
+        self.assertEqual(execution.imported_modules, {"json", "json.dumps"})